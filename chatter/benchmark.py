@@ -0,0 +1,260 @@
+"""
+Benchmarks for Chatter's reply latency and training throughput
+
+Builds a synthetic corpus into temporary databases, then times
+`generate_response` for every model and algorithm Chatter offers,
+and rows/sec for channel training and the Kaggle trainers.
+Models that aren't installed are reported as skipped.
+
+    python -m chatter.benchmark --conversations 2000 --queries 200 --output bench.json
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import pathlib
+import platform
+import random
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+from chatterbot.conversation import Statement
+from chatterbot.trainers import ListTrainer
+
+from chatter.chat import Chatter, create_chatbot
+from chatter.trainers import MovieTrainer, UbuntuCorpusTrainer2
+from chatter.vectors import VectorSimilarity
+
+log = logging.getLogger("red.fox_v3.chatter.benchmark")
+
+WORDS = (
+    "hello hi hey thanks ok sure yes no maybe why what when where who how game play win lose "
+    "server channel bot message reply music song listen watch movie show read book code bug "
+    "fix test build deploy python discord weekend today tomorrow night morning coffee food "
+    "pizza cat dog weather rain sun cold hot good bad great awful funny weird love hate think"
+).split()
+
+
+def synthetic_conversations(count: int, seed=0) -> List[List[str]]:
+    """Conversations of 2 to 6 short statements, drawn from a small vocabulary"""
+    rng = random.Random(seed)
+    return [
+        [
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+            for _ in range(rng.randint(2, 6))
+        ]
+        for _ in range(count)
+    ]
+
+
+def synthetic_queries(conversations: List[List[str]], count: int, seed=0) -> List[str]:
+    """Half are statements from the corpus, half are shuffled versions that won't match exactly"""
+    rng = random.Random(seed)
+    statements = [text for conversation in conversations for text in conversation]
+    queries = []
+    for i in range(count):
+        words = rng.choice(statements).split()
+        if i % 2:
+            rng.shuffle(words)
+        queries.append(" ".join(words))
+    return queries
+
+
+def percentiles(seconds: List[float]) -> dict:
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def write_movie_fixture(directory: pathlib.Path, conversations: List[List[str]]):
+    """movie_lines.tsv and movie_conversations.tsv in the Cornell corpus layout"""
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / "movie_lines.tsv", "w", encoding="utf-8") as lines, open(
+        directory / "movie_conversations.tsv", "w", encoding="utf-8"
+    ) as convs:
+        line_number = 0
+        for conversation in conversations:
+            line_ids = []
+            for i, text in enumerate(conversation):
+                line_number += 1
+                line_ids.append(f"L{line_number}")
+                lines.write(f"L{line_number}\tu{i % 2}\tm0\tUSER{i % 2}\t{text}\n")
+            convs.write(f"u0\tu1\tm0\t{line_ids}\n")
+
+
+def write_ubuntu_fixture(path: pathlib.Path, conversations: List[List[str]]):
+    """A dialogueText csv in the Kaggle Ubuntu corpus layout"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["folder", "dialogueID", "date", "from", "to", "text"])
+        for dialogue_id, conversation in enumerate(conversations):
+            for i, text in enumerate(conversation):
+                writer.writerow(
+                    ["1", f"{dialogue_id}.tsv", "2020-01-01T00:00:00.000Z", f"u{i % 2}", "", text]
+                )
+
+
+def count_rows(chatbot) -> int:
+    return chatbot.storage.count()
+
+
+def bench_list_training(directory: pathlib.Path, language, conversations) -> dict:
+    """One ListTrainer call per conversation inside a bulk load, as channel training does"""
+    chatbot = create_chatbot(directory / "list.sqlite3", language, Chatter.algos[0], 0.9)
+    trainer = ListTrainer(chatbot, show_training_progress=False)
+
+    start_time = time.perf_counter()
+    with chatbot.storage.bulk_load():
+        for conversation in conversations:
+            trainer.train(conversation)
+    elapsed = time.perf_counter() - start_time
+
+    rows = count_rows(chatbot)
+    return {"rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed}
+
+
+def bench_kaggle_training(directory: pathlib.Path, language, conversations, workers) -> dict:
+    results = {}
+
+    chatbot = create_chatbot(directory / "movies.sqlite3", language, Chatter.algos[0], 0.9)
+    trainer = MovieTrainer(chatbot, directory, workers=workers)
+    write_movie_fixture(trainer.data_directory, conversations)
+    start_time = time.perf_counter()
+    asyncio.run(trainer.run_movie_training())
+    elapsed = time.perf_counter() - start_time
+    rows = count_rows(chatbot)
+    results["movies"] = {"rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed}
+
+    chatbot = create_chatbot(directory / "ubuntu.sqlite3", language, Chatter.algos[0], 0.9)
+    trainer = UbuntuCorpusTrainer2(chatbot, directory, workers=workers)
+    extracted_dir = trainer.data_directory / "Ubuntu-dialogue-corpus"
+    write_ubuntu_fixture(extracted_dir / "dialogueText.csv", conversations)
+    start_time = time.perf_counter()
+    asyncio.run(trainer.run_dialogue_training(extracted_dir, "dialogueText.csv"))
+    elapsed = time.perf_counter() - start_time
+    rows = count_rows(chatbot)
+    results["ubuntu"] = {"rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed}
+
+    return results
+
+
+def bench_responses(directory: pathlib.Path, language, algo, threshold, queries) -> dict:
+    """Uncached generate_response latency against the corpus bench_list_training built"""
+    vector_path = None
+    if algo is VectorSimilarity:
+        vector_path = directory / f"vectors_{language.ISO_639_1}.npy"
+    chatbot = create_chatbot(
+        directory / "list.sqlite3", language, algo, threshold, vector_path=vector_path
+    )
+
+    start_time = time.perf_counter()
+    chatbot.storage.warm_up()
+    warm_up = time.perf_counter() - start_time
+
+    timings = []
+    for text in queries:
+        start_time = time.perf_counter()
+        chatbot.generate_response(Statement(text))
+        timings.append(time.perf_counter() - start_time)
+
+    return {"warm_up_seconds": warm_up, **percentiles(timings)}
+
+
+def run(args) -> dict:
+    conversations = synthetic_conversations(args.conversations, args.seed)
+    queries = synthetic_queries(conversations, args.queries, args.seed)
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "conversations": args.conversations,
+        "statements": sum(map(len, conversations)),
+        "queries": args.queries,
+        "threshold": args.threshold,
+        "models": {},
+    }
+
+    for model_number in args.models:
+        language = Chatter.models[model_number]
+        model_results = results["models"][language.ISO_639_1] = {}
+        log.info(f"Benchmarking {language.ISO_639_1}")
+
+        with tempfile.TemporaryDirectory(prefix="chatter_bench_") as tmp:
+            directory = pathlib.Path(tmp)
+            try:
+                model_results["list_training"] = bench_list_training(
+                    directory, language, conversations
+                )
+            except (ImportError, OSError) as e:  # Model isn't installed
+                model_results["skipped"] = str(e)
+                log.warning(f"Skipping {language.ISO_639_1}: {e}")
+                continue
+
+            model_results["responses"] = {}
+            for algo_number in args.algos:
+                algo = Chatter.algos[algo_number]
+                log.info(f"Timing {algo.__name__}")
+                model_results["responses"][algo.__name__] = bench_responses(
+                    directory, language, algo, args.threshold, queries
+                )
+
+            if not args.skip_kaggle:
+                model_results["kaggle_training"] = bench_kaggle_training(
+                    directory, language, conversations, args.workers
+                )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument(
+        "--models",
+        type=int,
+        nargs="+",
+        default=list(range(len(Chatter.models))),
+        help="Numbers from [p]chatter model",
+    )
+    parser.add_argument(
+        "--algos",
+        type=int,
+        nargs="+",
+        default=list(range(len(Chatter.algos))),
+        help="Numbers from [p]chatter algorithm",
+    )
+    parser.add_argument("--threshold", type=float, default=0.90)
+    parser.add_argument("--workers", type=int, default=None, help="Kaggle training processes")
+    parser.add_argument("--skip-kaggle", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=pathlib.Path, default=None, help="Defaults to stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    for name in ("chatterbot", "red.fox_v3.chatterbot"):  # Several lines per reply
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    results = run(args)
+
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with args.output.open("w") as f:
+            json.dump(results, f, indent=2)
+        log.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
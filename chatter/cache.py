@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+
+class CachedCandidates:
+    """What BestMatch found for an input, before a response was picked"""
+
+    __slots__ = ("match_search_text", "confidence", "responses", "alternate_responses", "created")
+
+    def __init__(self, match_search_text, confidence, responses, alternate_responses):
+        self.match_search_text = match_search_text
+        self.confidence = confidence
+        self.responses: List = responses
+        self.alternate_responses: List = alternate_responses
+        self.created = time.monotonic()
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of response candidates with a time to live
+
+    Keys are the input's search_text plus whatever else changes the result
+    (model, algorithm, threshold). Used from executor threads, so everything is locked.
+    """
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, CachedCandidates]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key) -> Optional[CachedCandidates]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and time.monotonic() - entry.created > self.ttl:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry: CachedCandidates):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_statement(self, statement):
+        """
+        Drop anything a newly learned statement could change
+
+        That's inputs with the same search_text, which might now match it,
+        and inputs whose closest match it was said in response to.
+        """
+        if statement is None:
+            return
+        search_text = statement.search_text
+        search_in_response_to = statement.search_in_response_to
+        with self._lock:
+            stale = [
+                key
+                for key, entry in self._entries.items()
+                if key[0] == search_text
+                or (search_in_response_to and entry.match_search_text == search_in_response_to)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "invalidations": self.invalidations,
+        }
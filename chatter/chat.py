@@ -2,18 +2,14 @@ import asyncio
 import logging
 import os
 import pathlib
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
-from functools import partial
 from typing import Dict, List, Optional
 
 import discord
 from chatterbot import ChatBot
-from chatterbot.comparisons import (
-    JaccardSimilarity,
-    LevenshteinDistance,
-    SpacySimilarity,
-)
+from chatterbot.comparisons import LevenshteinDistance
 from chatterbot.response_selection import get_random_response
 from chatterbot.trainers import (
     ChatterBotCorpusTrainer,
@@ -25,7 +21,19 @@ from redbot.core.commands import Cog
 from redbot.core.data_manager import cog_data_path
 from redbot.core.utils.predicates import MessagePredicate
 
-from chatter.trainers import MovieTrainer, TwitterCorpusTrainer, UbuntuCorpusTrainer2
+from chatter.cache import ResponseCache
+from chatter.executor import ChatterExecutor
+from chatter.learning import LearningQueue
+from chatter.maintenance import run_maintenance
+from chatter.models import JaccardSimilarity, PosLemmaTagger, SpacySimilarity, release_model
+from chatter.shards import GuildShards
+from chatter.trainers import (
+    CHECKPOINT_FILE,
+    MovieTrainer,
+    TwitterCorpusTrainer,
+    UbuntuCorpusTrainer2,
+)
+from chatter.vectors import VectorSimilarity
 
 chatterbot_log = logging.getLogger("red.fox_v3.chatterbot")
 log = logging.getLogger("red.fox_v3.chatter")
@@ -38,6 +46,32 @@ def my_local_get_prefix(prefixes, content):
     return None
 
 
+def create_chatbot(
+    database_path: pathlib.Path,
+    tagger_language,
+    similarity_algo,
+    similarity_threshold: float,
+    vector_path: Optional[pathlib.Path] = None,
+    response_cache: Optional[ResponseCache] = None,
+) -> ChatBot:
+    """The ChatBot Chatter talks with, also used by chatter.benchmark"""
+    return ChatBot(
+        "ChatterBot",
+        # storage_adapter="chatterbot.storage.SQLStorageAdapter",
+        storage_adapter="chatter.storage_adapters.MyDumbSQLStorageAdapter",
+        database_uri="sqlite:///" + str(database_path),
+        statement_comparison_function=similarity_algo,
+        response_selection_method=get_random_response,
+        logic_adapters=["chatter.logic.ChatterBestMatch"],
+        maximum_similarity_threshold=similarity_threshold,
+        tagger=PosLemmaTagger,  # Loads the model on the first message, not here
+        tagger_language=tagger_language,
+        vector_path=vector_path,
+        response_cache=response_cache,
+        logger=chatterbot_log,
+    )
+
+
 class ENG_TRF:
     ISO_639_1 = "en_core_web_trf"
     ISO_639 = "eng"
@@ -68,7 +102,7 @@ class Chatter(Cog):
     """
 
     models = [ENG_SM, ENG_MD, ENG_LG, ENG_TRF]
-    algos = [SpacySimilarity, JaccardSimilarity, LevenshteinDistance]
+    algos = [SpacySimilarity, JaccardSimilarity, LevenshteinDistance, VectorSimilarity]
 
     def __init__(self, bot):
         super().__init__()
@@ -79,6 +113,13 @@ class Chatter(Cog):
             "model_number": 0,
             "algo_number": 0,
             "threshold": 0.90,
+            "training_workers": 0,
+            "maintenance_hours": 0,
+            "maintenance_max_age": 0,
+            "maintenance_max_per_text": 0,
+            "maintenance_last_run": None,
+            "sharding": False,
+            "global_corpus": True,
         }
         self.default_guild = {
             "whitelist": None,
@@ -96,25 +137,61 @@ class Chatter(Cog):
         self.tagger_language = ENG_SM
         self.similarity_algo = SpacySimilarity
         self.similarity_threshold = 0.90
-        self.chatbot = None
+        self.chatbot = None  # The global corpus, and all of the data when not sharding
+
+        # Each guild's channel training and learning go to its own database when sharding
+        self.sharding = False
+        self.global_corpus = True  # Fall back on the global corpus for sharded guilds
+        self.shards = GuildShards(path / "guilds", self._create_guild_chatbot)
         # self.chatbot.set_trainer(ListTrainer)
 
         # self.trainer = ListTrainer(self.chatbot)
 
         self.config.register_global(**default_global)
         self.config.register_guild(**self.default_guild)
+        self.config.register_channel(last_harvested=None)  # Id of the last message trained on
 
         self.loop = asyncio.get_event_loop()
 
         self._guild_cache = defaultdict(dict)
         self._global_cache = {}
 
+        # Chatter's own threads, replies and learning share one pool and training gets another
+        self.executor = ChatterExecutor(max_workers=4, max_pending=32)
+        self.training_executor = ChatterExecutor(
+            max_workers=1, max_pending=1, thread_name_prefix="chatter_training"
+        )
+        self.guild_concurrency = 2  # Replies being generated at once per guild
+        self.harvest_concurrency = 3  # Channels gathered at once, discord.py handles rate limits
+        self._guild_semaphores: Dict[int, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.guild_concurrency)
+        )
+
+        self.response_cache = ResponseCache()
+        self.learning_queue = LearningQueue(
+            self._get_chatbot,
+            on_learned=self.response_cache.invalidate_statement,
+            executor=self.executor,
+        )
+
+        self._maintenance_task: Optional[asyncio.Task] = None
+
         self._last_message_per_channel: Dict[Optional[discord.Message]] = defaultdict(lambda: None)
 
     async def red_delete_data_for_user(self, **kwargs):
         """Nothing to delete"""
         return
 
+    def cog_unload(self):
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+        asyncio.create_task(self._shutdown())
+
+    async def _shutdown(self):
+        await self.learning_queue.drain()  # Saves whatever is still queued
+        self.executor.shutdown(wait=False)
+        self.training_executor.shutdown(wait=False)
+
     async def initialize(self):
         all_config = dict(self.config.defaults["GLOBAL"])
         all_config.update(await self.config.all())
@@ -125,79 +202,267 @@ class Chatter(Cog):
         self.tagger_language = self.models[model_number]
         self.similarity_algo = self.algos[algo_number]
         self.similarity_threshold = threshold
+        self.sharding = all_config["sharding"]
+        self.global_corpus = all_config["global_corpus"]
         self.chatbot = self._create_chatbot()
+        self.learning_queue.start()
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    def _vector_path(self, model=None, guild_id=None):
+        model = model or self.tagger_language
+        if guild_id is not None:
+            return self.shards.directory / f"{guild_id}_vectors_{model.ISO_639_1}.npy"
+        return self.data_path.parent / f"vectors_{model.ISO_639_1}.npy"
 
     def _create_chatbot(self):
-        return ChatBot(
-            "ChatterBot",
-            # storage_adapter="chatterbot.storage.SQLStorageAdapter",
-            storage_adapter="chatter.storage_adapters.MyDumbSQLStorageAdapter",
-            database_uri="sqlite:///" + str(self.data_path),
-            statement_comparison_function=self.similarity_algo,
-            response_selection_method=get_random_response,
-            logic_adapters=["chatterbot.logic.BestMatch"],
-            maximum_similarity_threshold=self.similarity_threshold,
-            tagger_language=self.tagger_language,
-            logger=chatterbot_log,
+        vector_path = None
+        if self.similarity_algo is VectorSimilarity:
+            vector_path = self._vector_path()
+
+        chatbot = create_chatbot(
+            self.data_path,
+            self.tagger_language,
+            self.similarity_algo,
+            self.similarity_threshold,
+            vector_path=vector_path,
+            response_cache=self.response_cache,
         )
+        self.response_cache.clear()  # Anything cached came from the old one
+        # Shards are reopened with the new settings
+        self.loop.run_in_executor(self.executor, self.shards.close_all)
+
+        # Build the search index in the background so the first reply doesn't have to
+        self.loop.run_in_executor(self.training_executor, chatbot.storage.warm_up)
+        return chatbot
+
+    def _create_guild_chatbot(self, guild_id: int, warm_up=True):
+        """Blocks, only call from an executor"""
+        vector_path = None
+        if self.similarity_algo is VectorSimilarity:
+            vector_path = self._vector_path(guild_id=guild_id)
+
+        chatbot = create_chatbot(
+            self.shards.path(guild_id),
+            self.tagger_language,
+            self.similarity_algo,
+            self.similarity_threshold,
+            vector_path=vector_path,
+            response_cache=self.response_cache,
+        )
+        if warm_up:
+            chatbot.storage.warm_up()
+        return chatbot
 
-    async def _get_conversation(self, ctx, in_channels: List[discord.TextChannel]):
+    def _get_chatbot(self, guild_id: Optional[int] = None) -> Optional[ChatBot]:
         """
-        Compiles all conversation in the Guild this bot can get it's hands on
-        Currently takes a stupid long time
-        Returns a list of text
+        The chatbot a guild's data goes to. Blocks if the guild's database isn't open yet
+
+        None while data is being cleared
         """
-        out = [[]]
-        after = datetime.today() - timedelta(days=(await self.config.guild(ctx.guild).days()))
-        convo_delta = timedelta(minutes=(await self.config.guild(ctx.guild).convo_delta()))
+        if self.chatbot is None:
+            return None
+        if self.sharding and guild_id is not None:
+            return self.shards.get(guild_id)
+        return self.chatbot
 
-        def predicate(msg: discord.Message):
-            return msg.clean_content
+    def _generate_response(self, guild_id: int, text: str):
+        """
+        Runs in the executor. Sharded guilds fall back on the global corpus
+        when their own data has nothing close enough
+        """
+        chatbot = self._get_chatbot(guild_id)
+        if chatbot is None:  # Data is being cleared
+            return None
+        Statement = chatbot.storage.get_object("statement")
+        response = chatbot.generate_response(Statement(text))
 
-        def new_conversation(msg, sent, out_in, delta):
-            # Should always be positive numbers
-            return msg.created_at - sent >= delta
+        if (
+            chatbot is not self.chatbot
+            and self.global_corpus
+            and response.confidence < self.similarity_threshold
+        ):
+            fallback = self.chatbot.generate_response(Statement(text))
+            if fallback.confidence > response.confidence:
+                response = fallback
+        return response
+
+    async def _harvest_channel(
+        self,
+        channel: discord.TextChannel,
+        after: discord.abc.Snowflake,
+        convo_delta: timedelta,
+        queue: asyncio.Queue,
+    ) -> Optional[int]:
+        """
+        Puts every conversation in the channel after `after` on the queue as a list of text
+
+        Returns the id of the last message read, if any
+        """
+        conversation = []
+        user = None
+        send_time = None
+        last_id = None
+
+        try:
+            async for message in channel.history(
+                limit=None, after=after, oldest_first=True
+            ):  # type: discord.Message
+                last_id = message.id
+                if not message.clean_content:
+                    continue
+
+                if send_time is not None and message.created_at - send_time >= convo_delta:
+                    if len(conversation) > 1:  # TODO: Toggleable skipping short conversations
+                        await queue.put(conversation)
+                    conversation = []
+                    user = None
+
+                send_time = message.created_at
+
+                if user == message.author:
+                    conversation[-1] += "\n" + message.clean_content
+                else:
+                    user = message.author
+                    conversation.append(message.clean_content)
+        except discord.HTTPException:  # Includes Forbidden
+            log.warning(f"Stopped gathering {channel} at {last_id}", exc_info=True)
+
+        if len(conversation) > 1:
+            await queue.put(conversation)
 
-        for channel in in_channels:
-            # if in_channel:
-            #     channel = in_channel
-            await ctx.maybe_send_embed("Gathering {}".format(channel.mention))
-            user = None
-            i = 0
-            send_time = after - timedelta(days=100)  # Makes the first message a new message
+        return last_id
 
+    async def _harvest_and_train(self, ctx, channels: List[discord.TextChannel], batch_size=100):
+        """
+        Gathers messages from several channels at once and trains on them as they come in
+
+        Each channel remembers the last message trained on, so only new messages are gathered
+        next time. Returns the number of conversations trained on.
+        """
+        guild_config = self.config.guild(ctx.guild)
+        after = datetime.today() - timedelta(days=(await guild_config.days()))
+        after_id = discord.utils.time_snowflake(after)
+        convo_delta = timedelta(minutes=(await guild_config.convo_delta()))
+
+        queue = asyncio.Queue(maxsize=batch_size * 5)  # Don't let gathering get too far ahead
+        semaphore = asyncio.Semaphore(self.harvest_concurrency)
+
+        async def harvest(channel):
+            last_id = None
             try:
-                async for message in channel.history(
-                    limit=None, after=after, oldest_first=True
-                ).filter(
-                    predicate=predicate
-                ):  # type: discord.Message
-                    # if message.author.bot:  # Skip bot messages
-                    #     continue
-                    if new_conversation(message, send_time, out[i], convo_delta):
-                        out.append([])
-                        i += 1
-                        user = None
-
-                    send_time = (
-                        message.created_at
-                    )  # + timedelta(seconds=1)  # Can't remember why I added 1 second
-
-                    if user == message.author:
-                        out[i][-1] += "\n" + message.clean_content
-                    else:
-                        user = message.author
-                        out[i].append(message.clean_content)
-
-            except discord.Forbidden:
-                pass
-            except discord.HTTPException:
-                pass
-
-            # if in_channel:
-            #     break
-
-        return out
+                async with semaphore:
+                    last_harvested = await self.config.channel(channel).last_harvested()
+                    await ctx.maybe_send_embed("Gathering {}".format(channel.mention))
+                    last_id = await self._harvest_channel(
+                        channel,
+                        discord.Object(id=max(after_id, last_harvested or 0)),
+                        convo_delta,
+                        queue,
+                    )
+            except Exception:
+                log.exception(f"Failed to gather {channel}")
+            await queue.put((channel, last_id))  # Done with this channel
+
+        harvesters = asyncio.gather(*(harvest(channel) for channel in channels))
+
+        chatbot = await self.loop.run_in_executor(
+            self.training_executor, self._get_chatbot, ctx.guild.id
+        )
+        storage = chatbot.storage
+        await self.loop.run_in_executor(self.training_executor, storage.begin_bulk_load)
+        trained = 0
+        try:
+            remaining = len(channels)
+            batch = []
+            finished = []
+            while remaining:
+                item = await queue.get()
+                if isinstance(item, tuple):
+                    finished.append(item)
+                    remaining -= 1
+                else:
+                    batch.append(item)
+
+                if len(batch) >= batch_size or (finished and queue.empty()) or not remaining:
+                    if batch:
+                        await self.loop.run_in_executor(
+                            self.training_executor, self._train_batch, chatbot, batch
+                        )
+                        trained += len(batch)
+                        log.info(f"Trained on {trained} conversations")
+                        batch = []
+
+                    # Everything these channels gathered is saved now
+                    for channel, last_id in finished:
+                        if last_id is not None:
+                            await self.config.channel(channel).last_harvested.set(last_id)
+                    finished = []
+
+            await harvesters
+        finally:
+            harvesters.cancel()
+            await self.loop.run_in_executor(self.training_executor, storage.end_bulk_load)
+
+        return trained
+
+    async def _run_maintenance(self, dry_run=True, backupname=None):
+        """
+        Runs on the training thread, so it never overlaps with another maintenance run.
+        Training submits many jobs there and maintenance can land between them,
+        so any database in the middle of a bulk load is skipped and counted in the report.
+
+        If a backup name is given, the data is backed up first
+        """
+        settings = await self.config.all()
+
+        def maintain():
+            if backupname is not None:
+                trainer = ListTrainer(self.chatbot)
+                trainer.export_for_training(str(cog_data_path(self) / f"{backupname}.json"))
+
+            def maintain_one(chatbot):
+                return run_maintenance(
+                    chatbot.storage,
+                    max_age_days=settings["maintenance_max_age"],
+                    max_per_text=settings["maintenance_max_per_text"],
+                    dry_run=dry_run,
+                )
+
+            report = maintain_one(self.chatbot)
+            for database_report in self.shards.each(maintain_one):  # Leaves the cache alone
+                report.add(database_report)
+            return report
+
+        report = await self.loop.run_in_executor(self.training_executor, maintain)
+        if not dry_run:
+            self.response_cache.clear()
+            await self.config.maintenance_last_run.set(time.time())
+        return report
+
+    async def _maintenance_loop(self):
+        while True:
+            hours = await self.config.maintenance_hours()
+            last_run = await self.config.maintenance_last_run()
+            if last_run is None:
+                last_run = time.time()
+                await self.config.maintenance_last_run.set(last_run)
+            if not hours:
+                due_in = 3600
+            else:
+                due_in = last_run + hours * 3600 - time.time()
+            if due_in > 0:
+                # Wake up at least hourly in case the schedule changed
+                await asyncio.sleep(min(due_in, 3600))
+                continue
+
+            if self.chatbot is None:  # Data is being cleared
+                await asyncio.sleep(60)
+                continue
+            try:
+                await self._run_maintenance(dry_run=False)
+            except Exception:
+                log.exception("Scheduled maintenance failed")
+                await self.config.maintenance_last_run.set(time.time())  # Try again next time
 
     def _train_twitter(self, *args, **kwargs):
         trainer = TwitterCorpusTrainer(self.chatbot)
@@ -213,7 +478,12 @@ class Chatter(Cog):
         return True
 
     async def _train_movies(self):
-        trainer = MovieTrainer(self.chatbot, cog_data_path(self))
+        trainer = MovieTrainer(
+            self.chatbot,
+            cog_data_path(self),
+            workers=await self.config.training_workers(),
+            executor=self.training_executor,
+        )
         return await trainer.asynctrain()
 
     async def _train_ubuntu2(self, intensity):
@@ -233,7 +503,12 @@ class Chatter(Cog):
             train_kwarg["train_196"] = True
             train_kwarg["train_301"] = True
 
-        trainer = UbuntuCorpusTrainer2(self.chatbot, cog_data_path(self))
+        trainer = UbuntuCorpusTrainer2(
+            self.chatbot,
+            cog_data_path(self),
+            workers=await self.config.training_workers(),
+            executor=self.training_executor,
+        )
         return await trainer.asynctrain(**train_kwarg)
 
     def _train_english(self):
@@ -244,14 +519,10 @@ class Chatter(Cog):
         #     return False
         return True
 
-    def _train(self, data):
-        trainer = ListTrainer(self.chatbot)
-        total = len(data)
-        for c, convo in enumerate(data, 1):
-            log.info(f"{c} / {total}")
-            if len(convo) > 1:  # TODO: Toggleable skipping short conversations
-                trainer.train(convo)
-        return True
+    def _train_batch(self, chatbot, conversations):
+        trainer = ListTrainer(chatbot)
+        for convo in conversations:
+            trainer.train(convo)
 
     @commands.group(invoke_without_command=False)
     async def chatter(self, ctx: commands.Context):
@@ -321,6 +592,48 @@ class Chatter(Cog):
         else:
             await ctx.maybe_send_embed("I will no longer learn from conversations.")
 
+    @commands.is_owner()
+    @chatter.command(name="cachestats")
+    async def chatter_cachestats(self, ctx: commands.Context, clear: bool = False):
+        """
+        Show how often replies are served from the response cache
+
+        Use `[p]chatter cachestats True` to empty the cache afterwards
+        """
+        stats = self.response_cache.stats()
+        await ctx.maybe_send_embed(
+            f"Entries: {stats['size']} / {stats['maxsize']} (expire after {stats['ttl']} seconds)\n"
+            f"Hits: {stats['hits']}\n"
+            f"Misses: {stats['misses']}\n"
+            f"Hit rate: {stats['hit_rate']:.1%}\n"
+            f"Invalidated: {stats['invalidations']}"
+        )
+        if clear:
+            self.response_cache.clear()
+            await ctx.tick()
+
+    @commands.is_owner()
+    @chatter.command(name="queuestats")
+    async def chatter_queuestats(self, ctx: commands.Context):
+        """
+        Show how busy Chatter's threads are
+
+        Replies are skipped with :thinking: while the reply queue is full
+        """
+        lines = []
+        for name, executor in (("Replies", self.executor), ("Training", self.training_executor)):
+            stats = executor.stats()
+            lines.append(
+                f"**{name}** ({stats['max_workers']} threads)\n"
+                f"Running: {stats['running']}, queued: {stats['queued']}"
+                f" (max {stats['max_pending']})\n"
+                f"Completed: {stats['completed']}, shed: {stats['shed']}\n"
+                f"Wait: {stats['avg_wait'] * 1000:.0f}ms average,"
+                f" {stats['max_wait'] * 1000:.0f}ms max"
+            )
+        lines.append(f"Learning queue: {len(self.learning_queue)}")
+        await ctx.maybe_send_embed("\n\n".join(lines))
+
     @commands.is_owner()
     @chatter.command(name="cleardata")
     async def chatter_cleardata(self, ctx: commands.Context, confirm: bool = False):
@@ -341,6 +654,8 @@ class Chatter(Cog):
         async with ctx.typing():
             await self.config.clear_all()
             self.chatbot = None
+            self.sharding = False
+            self.global_corpus = True
             await asyncio.sleep(
                 10
             )  # Pause to allow pending commands to complete before deleting sql data
@@ -352,8 +667,51 @@ class Chatter(Cog):
                         "Failed to clear training database. Please wait a bit and try again"
                     )
 
-            self._create_chatbot()
+            for model in self.models:  # Vectors are keyed on statement ids, they go too
+                vector_path = self._vector_path(model)
+                for path in (vector_path, vector_path.with_suffix(".json")):
+                    if path.is_file():
+                        try:
+                            os.remove(path)
+                        except PermissionError:
+                            log.warning(f"Failed to remove {path}, delete it manually")
+
+            # Training would resume past conversations that aren't in the database anymore
+            for path in cog_data_path(self).glob(f"*/{CHECKPOINT_FILE}"):
+                try:
+                    os.remove(path)
+                except PermissionError:
+                    log.warning(f"Failed to remove {path}, delete it manually")
+
+            try:
+                await self.loop.run_in_executor(self.executor, self.shards.remove_all)
+            except PermissionError:
+                log.warning(f"Failed to remove {self.shards.directory}, delete it manually")
+
+            self.chatbot = self._create_chatbot()
+
+        await ctx.tick()
+
+    @commands.is_owner()
+    @chatter.command(name="shard")
+    async def chatter_shard(
+        self, ctx: commands.Context, enabled: bool, global_corpus: bool = True
+    ):
+        """
+        Give every guild its own training database
+
+        Channel training and learning go to the guild's own database,
+        so a guild with lots of data doesn't slow down replies everywhere else.
+        Other training (english, ubuntu, kaggle) goes to the global corpus,
+        which sharded guilds fall back on unless `global_corpus` is False.
 
+        Existing data stays in the global corpus.
+        """
+        self.sharding = enabled
+        self.global_corpus = global_corpus
+        await self.config.sharding.set(enabled)
+        await self.config.global_corpus.set(global_corpus)
+        self.response_cache.clear()
         await ctx.tick()
 
     @commands.is_owner()
@@ -362,13 +720,14 @@ class Chatter(Cog):
         self, ctx: commands.Context, algo_number: int, threshold: float = None
     ):
         """
-        Switch the active logic algorithm to one of the three. Default is Spacy
+        Switch the active logic algorithm to one of the four. Default is Spacy
 
         0: Spacy
         1: Jaccard
         2: Levenshtein
+        3: Spacy Vectors (Fast, precomputes vectors for all training data on first use)
         """
-        if algo_number < 0 or algo_number > 2:
+        if algo_number < 0 or algo_number >= len(self.algos):
             await ctx.send_help()
             return
 
@@ -418,10 +777,13 @@ class Chatter(Cog):
             if not pred.result:
                 return
 
+        old_language = self.tagger_language
         self.tagger_language = self.models[model_number]
         await self.config.model_number.set(model_number)
         async with ctx.typing():
             self.chatbot = self._create_chatbot()
+            if old_language is not self.tagger_language:
+                release_model(old_language.ISO_639_1)
 
             await ctx.maybe_send_embed(
                 f"Model has been switched to {self.tagger_language.ISO_639_1}"
@@ -464,6 +826,24 @@ class Chatter(Cog):
         await self.config.guild(ctx.guild).days.set(days)
         await ctx.tick()
 
+    @commands.is_owner()
+    @chatter_trainset.command(name="workers")
+    async def workers(self, ctx: commands.Context, workers: int):
+        """
+        Sets the number of processes used to train on kaggle data sets
+        Each process loads its own copy of the current model, so this costs RAM
+
+        Use 0 to use one less than the number of CPUs
+        This is a global setting
+        """
+
+        if workers < 0:
+            await ctx.send_help()
+            return
+
+        await self.config.training_workers.set(workers)
+        await ctx.tick()
+
     @commands.is_owner()
     @chatter.command(name="kaggle")
     async def chatter_kaggle(self, ctx: commands.Context):
@@ -487,7 +867,7 @@ class Chatter(Cog):
         trainer = ListTrainer(self.chatbot)
 
         future = await self.loop.run_in_executor(
-            None, trainer.export_for_training, str(path / f"{backupname}.json")
+            self.training_executor, trainer.export_for_training, str(path / f"{backupname}.json")
         )
 
         if future:
@@ -495,6 +875,75 @@ class Chatter(Cog):
         else:
             await ctx.maybe_send_embed("Error occurred :(")
 
+    @commands.is_owner()
+    @chatter.group(name="maintenance")
+    async def chatter_maintenance(self, ctx: commands.Context):
+        """
+        Deduplicate, prune and compact the training database
+        """
+        pass
+
+    @chatter_maintenance.command(name="report")
+    async def chatter_maintenance_report(self, ctx: commands.Context):
+        """
+        Show what maintenance would remove and reclaim, without changing anything
+        """
+        async with ctx.typing():
+            report = await self._run_maintenance(dry_run=True)
+        await ctx.maybe_send_embed(str(report))
+
+    @chatter_maintenance.command(name="run")
+    async def chatter_maintenance_run(self, ctx: commands.Context, backupname: str = None):
+        """
+        Run maintenance now
+
+        Pass a backup name to back up your training data first, see `[p]chatter backup`
+        """
+        await ctx.maybe_send_embed("Running maintenance, this may take a while")
+        async with ctx.typing():
+            report = await self._run_maintenance(dry_run=False, backupname=backupname)
+        await ctx.maybe_send_embed(str(report))
+
+    @chatter_maintenance.command(name="schedule")
+    async def chatter_maintenance_schedule(self, ctx: commands.Context, hours: int):
+        """
+        Run maintenance every this many hours. 0 to disable (the default)
+        """
+        if hours < 0:
+            await ctx.send_help()
+            return
+
+        if hours and not await self.config.maintenance_hours():
+            await self.config.maintenance_last_run.set(time.time())  # First run in `hours`
+        await self.config.maintenance_hours.set(hours)
+        await ctx.tick()
+
+    @chatter_maintenance.command(name="maxage")
+    async def chatter_maintenance_maxage(self, ctx: commands.Context, days: int):
+        """
+        Remove statements older than this many days. 0 to keep them forever (the default)
+        """
+        if days < 0:
+            await ctx.send_help()
+            return
+
+        await self.config.maintenance_max_age.set(days)
+        await ctx.tick()
+
+    @chatter_maintenance.command(name="maxpertext")
+    async def chatter_maintenance_maxpertext(self, ctx: commands.Context, count: int):
+        """
+        Keep at most this many statements with the same text, newest first
+
+        Trims common short statements like "ok" and "thanks". 0 for no limit (the default)
+        """
+        if count < 0:
+            await ctx.send_help()
+            return
+
+        await self.config.maintenance_max_per_text.set(count)
+        await ctx.tick()
+
     @commands.is_owner()
     @chatter.group(name="train")
     async def chatter_train(self, ctx: commands.Context):
@@ -527,6 +976,7 @@ class Chatter(Cog):
 
         async with ctx.typing():
             future = await self._train_ubuntu2(intensity)
+            self.response_cache.clear()
 
         if future:
             await ctx.maybe_send_embed("Training successful!")
@@ -553,6 +1003,7 @@ class Chatter(Cog):
 
         async with ctx.typing():
             future = await self._train_movies()
+            self.response_cache.clear()
 
         if future:
             await ctx.maybe_send_embed("Training successful!")
@@ -573,7 +1024,8 @@ class Chatter(Cog):
             return
 
         async with ctx.typing():
-            future = await self.loop.run_in_executor(None, self._train_ubuntu)
+            future = await self.loop.run_in_executor(self.training_executor, self._train_ubuntu)
+            self.response_cache.clear()
 
         if future:
             await ctx.maybe_send_embed("Training successful!")
@@ -586,7 +1038,8 @@ class Chatter(Cog):
         Trains the bot in english
         """
         async with ctx.typing():
-            future = await self.loop.run_in_executor(None, self._train_english)
+            future = await self.loop.run_in_executor(self.training_executor, self._train_english)
+            self.response_cache.clear()
 
         if future:
             await ctx.maybe_send_embed("Training successful!")
@@ -626,31 +1079,31 @@ class Chatter(Cog):
             "If you experience issues, clear your trained data and train again on a smaller scope."
         )
 
-        async with ctx.typing():
-            conversation = await self._get_conversation(ctx, channels)
-
-        if not conversation:
-            await ctx.maybe_send_embed("Failed to gather training data")
-            return
-
         await ctx.maybe_send_embed(
-            "Gather successful! Training begins now\n"
+            "Training begins now, only messages since the last training are gathered\n"
             "(**This will take a long time, be patient. See console for progress**)"
         )
         embed = discord.Embed(title="Loading")
         embed.set_image(url="http://www.loop.universaleverything.com/animations/1295.gif")
         temp_message = await ctx.send(embed=embed)
-        future = await self.loop.run_in_executor(None, self._train, conversation)
+        try:
+            trained = await self._harvest_and_train(ctx, channels)
+        except Exception:
+            log.exception("Failed to train on channels")
+            trained = None
+        self.response_cache.clear()
 
         try:
             await temp_message.delete()
         except discord.Forbidden:
             pass
 
-        if future:
-            await ctx.maybe_send_embed("Training successful!")
-        else:
+        if trained is None:
             await ctx.maybe_send_embed("Error occurred :(")
+        elif not trained:
+            await ctx.maybe_send_embed("No new conversations to train on")
+        else:
+            await ctx.maybe_send_embed(f"Training successful! Learned {trained} conversations")
 
     @Cog.listener()
     async def on_message_without_command(self, message: discord.Message):
@@ -722,25 +1175,24 @@ class Chatter(Cog):
 
             # Always use generate reponse
             # Chatterbot tries to learn based on the result it comes up with, which is dumb
-            log.debug("Generating response")
-            Statement = self.chatbot.storage.get_object("statement")
-            future = await self.loop.run_in_executor(
-                None, self.chatbot.generate_response, Statement(text)
-            )
+            semaphore = self._guild_semaphores[guild.id]
+            if self.executor.saturated or semaphore.locked():
+                log.debug("Too busy, not generating a response")
+                self.executor.record_shed()
+                future = None
+            else:
+                log.debug("Generating response")
+                async with semaphore:
+                    future = await self.loop.run_in_executor(
+                        self.executor, self._generate_response, guild.id, text
+                    )
 
             if not self._global_cache:
                 self._global_cache = await self.config.all()
 
             if in_response_to is not None and self._global_cache["learning"] and not channel.nsfw:
-                log.debug("learning response")
-                await self.loop.run_in_executor(
-                    None,
-                    partial(
-                        self.chatbot.learn_response,
-                        Statement(text),
-                        previous_statement=in_response_to,
-                    ),
-                )
+                log.debug("queueing response to learn")
+                self.learning_queue.put(text, in_response_to, guild.id)
 
             replying = None
             if (
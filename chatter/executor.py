@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ChatterExecutor(ThreadPoolExecutor):
+    """
+    Thread pool that only Chatter uses, so its work can't starve other cogs
+
+    Keeps track of how many jobs are waiting and how long they waited to start.
+    `saturated` is True once `max_pending` jobs are queued or running.
+    """
+
+    def __init__(self, max_workers=4, max_pending=32, thread_name_prefix="chatter"):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+
+        self.pending = 0  # Submitted and not finished
+        self.running = 0
+        self.completed = 0
+        self.shed = 0  # Requests turned away because this was saturated
+
+        self._waits = deque(maxlen=200)  # Seconds between submit and start
+        self._stats_lock = threading.Lock()
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_pending
+
+    def record_shed(self):
+        """Counts a request turned away because this was saturated"""
+        with self._stats_lock:
+            self.shed += 1
+
+    def submit(self, fn, *args, **kwargs):
+        submitted = time.monotonic()
+
+        def timed():
+            with self._stats_lock:
+                self._waits.append(time.monotonic() - submitted)
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+                    self.pending -= 1
+                    self.completed += 1
+
+        with self._stats_lock:
+            self.pending += 1
+        try:
+            return super().submit(timed)
+        except RuntimeError:  # Shut down
+            with self._stats_lock:
+                self.pending -= 1
+            raise
+
+    def stats(self):
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "running": self.running,
+                "queued": self.pending - self.running,
+                "completed": self.completed,
+                "shed": self.shed,
+                "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+                "max_wait": waits[-1] if waits else 0.0,
+            }
@@ -0,0 +1,133 @@
+import heapq
+from bisect import bisect_left
+import logging
+import threading
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+log = logging.getLogger("red.fox_v3.chatter.index")
+
+
+class StatementIndex:
+    """
+    In-memory inverted index of search_text tokens to statement ids
+
+    Tokens are the space separated pieces of a statement's search_text,
+    which PosLemmaTagger builds out of lemmas.
+    Postings are appended in id order, so the newest statements are at the end.
+    """
+
+    def __init__(self, max_postings: int = 25000):
+        # Tokens that show up more than this are treated as stop words ("ok", "thanks")
+        self.max_postings = max_postings
+
+        self.lock = threading.RLock()
+        self.ready = False
+        self.last_id = 0
+
+        self._postings: Dict[str, array] = defaultdict(lambda: array("I"))
+        self._removed: Set[int] = set()
+
+    def __len__(self):
+        return len(self._postings)
+
+    def clear(self):
+        with self.lock:
+            self._postings.clear()
+            self._removed.clear()
+            self.last_id = 0
+            self.ready = False
+
+    def build(self, rows: Iterable[Tuple[int, str]]):
+        """Rebuild the index from scratch out of (id, search_text) rows"""
+        with self.lock:
+            self.clear()
+            count = self.update(rows)
+            self.ready = True
+        log.info(f"Indexed {count} statements with {len(self)} tokens")
+        return count
+
+    def update(self, rows: Iterable[Tuple[int, str]]):
+        """Add (id, search_text) rows to the index. Rows must be in id order"""
+        count = 0
+        with self.lock:
+            for statement_id, search_text in rows:
+                self._add(statement_id, search_text)
+                count += 1
+        return count
+
+    def replace(self, statement_id: int, old_search_text: str, search_text: str):
+        """
+        Moves an indexed statement from the tokens of `old_search_text` to those of `search_text`
+
+        Statements the index hasn't reached yet are left for the next update.
+        """
+        old_tokens = set((old_search_text or "").split())
+        tokens = set((search_text or "").split())
+        with self.lock:
+            if not self.ready or statement_id > self.last_id:
+                return
+            self._removed.discard(statement_id)
+            for token in old_tokens - tokens:
+                postings = self._postings.get(token, None)
+                if postings is None:
+                    continue
+                i = bisect_left(postings, statement_id)
+                if i < len(postings) and postings[i] == statement_id:
+                    del postings[i]
+                if not postings:
+                    del self._postings[token]
+            for token in tokens - old_tokens:
+                postings = self._postings[token]
+                i = bisect_left(postings, statement_id)  # Keeps postings in id order
+                if i == len(postings) or postings[i] != statement_id:
+                    postings.insert(i, statement_id)
+
+    def _add(self, statement_id: int, search_text: str):
+        for token in set((search_text or "").split()):
+            self._postings[token].append(statement_id)
+        if statement_id > self.last_id:
+            self.last_id = statement_id
+
+    def discard(self, statement_id: int):
+        """Postings are left alone, the id is skipped until the next rebuild"""
+        with self.lock:
+            self._removed.add(statement_id)
+
+    def candidates(self, search_text: str, limit: int) -> List[int]:
+        """
+        Returns up to `limit` statement ids that share the most tokens with `search_text`
+
+        Best candidates come first, ties go to the newest statement
+        """
+        tokens = set((search_text or "").split())
+        with self.lock:
+            postings = [self._postings[t] for t in tokens if t in self._postings]
+            if not postings:
+                return []
+
+            rare = [p for p in postings if len(p) <= self.max_postings]
+            if not rare:
+                # Only stop words to go on, don't bother counting millions of ids
+                rarest = min(postings, key=len)
+                out = []
+                for statement_id in reversed(rarest):
+                    if statement_id not in self._removed:
+                        out.append(statement_id)
+                        if len(out) >= limit:
+                            break
+                return out
+
+            counts = Counter()
+            for p in rare:
+                counts.update(p)
+
+            return [
+                statement_id
+                for statement_id, _ in heapq.nlargest(
+                    limit,
+                    ((i, c) for i, c in counts.items() if i not in self._removed),
+                    key=lambda item: (item[1], item[0]),
+                )
+            ]
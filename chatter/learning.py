@@ -0,0 +1,140 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from collections import defaultdict
+from typing import Callable, Hashable, List, Optional, Tuple
+
+from chatterbot.conversation import Statement
+
+log = logging.getLogger("red.fox_v3.chatter.learning")
+
+_STOP = object()
+
+
+def _save_learned(chatbot, pairs: List[Tuple[str, str]]) -> List[Statement]:
+    """Runs in the executor. Same as chatbot.learn_response, but for many at once"""
+    tagger = chatbot.storage.tagger
+    statements = []
+    for text, previous_statement in pairs:
+        statement = Statement(text=text, in_response_to=previous_statement)
+        statement.search_text = tagger.get_text_index_string(text)
+        statement.search_in_response_to = tagger.get_text_index_string(previous_statement)
+        statements.append(statement)
+
+    chatbot.storage.create_many(statements)
+    return statements
+
+
+class LearningQueue:
+    """
+    Write-behind queue for learning responses
+
+    A single writer task saves pending (text, previous_statement) pairs in one transaction
+    once `batch_size` are waiting or `flush_interval` seconds have passed.
+    Each pair is saved to `get_chatbot(key)`, the key it was queued with.
+    """
+
+    def __init__(
+        self,
+        get_chatbot: Callable,
+        on_learned: Optional[Callable] = None,
+        batch_size=50,
+        flush_interval=5.0,
+        maxsize=1000,
+        executor: Optional[Executor] = None,
+    ):
+        self.get_chatbot = get_chatbot  # Looked up each time, chatbots are replaced
+        self.on_learned = on_learned
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.executor = executor
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._writer())
+
+    def put(self, text: str, previous_statement: str, key: Hashable = None) -> bool:
+        try:
+            self._queue.put_nowait((key, text, previous_statement))
+        except asyncio.QueueFull:
+            log.warning("Learning queue is full, dropping message")
+            return False
+        return True
+
+    def stop(self):
+        """Stops the writer once everything already queued is saved"""
+        if self._task is None or self._task.done():
+            return
+        try:
+            self._queue.put_nowait(_STOP)
+        except asyncio.QueueFull:
+            # Can't wait in here, let the writer finish the queue before it sees this
+            asyncio.create_task(self._queue.put(_STOP))
+
+    async def drain(self):
+        """Stops the writer and waits for it to finish"""
+        self.stop()
+        if self._task is not None:
+            await self._task
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while batch[-1] is not _STOP and len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            stopping = batch[-1] is _STOP
+            pairs_by_key = defaultdict(list)
+            for item in batch:
+                if item is not _STOP:
+                    key, text, previous_statement = item
+                    pairs_by_key[key].append((text, previous_statement))
+
+            for key, pairs in pairs_by_key.items():
+                await self._save(loop, key, pairs)
+
+            for _ in batch:
+                self._queue.task_done()
+
+            if stopping:
+                return
+
+    async def _save(self, loop, key, pairs):
+        def save():
+            chatbot = self.get_chatbot(key)  # Can open a database, so not on the loop
+            if chatbot is None:  # Data is being cleared
+                return None
+            return _save_learned(chatbot, pairs)
+
+        try:
+            statements = await loop.run_in_executor(self.executor, save)
+        except Exception:
+            log.exception(f"Failed to learn {len(pairs)} responses")
+            return
+
+        if statements is None:
+            log.debug(f"No chatbot, dropping {len(pairs)} responses")
+            return
+
+        log.debug(f"Learned {len(statements)} responses")
+        if self.on_learned is not None:
+            for statement in statements:
+                self.on_learned(statement)
@@ -0,0 +1,124 @@
+from chatterbot import filters
+from chatterbot.logic import BestMatch
+
+from chatter.cache import CachedCandidates
+from chatter.search import CandidateSearch, VectorSearch
+
+
+class ChatterBestMatch(BestMatch):
+    """
+    BestMatch that searches through Chatter's own search algorithms
+
+    ChatBot only knows about chatterbot's built-in searches,
+    so they get registered here before BestMatch looks them up.
+
+    If a `response_cache` is passed in, the candidate responses for an input are cached
+    and a response is picked from them each time, so replies still vary.
+    """
+
+    search_algorithms = [CandidateSearch, VectorSearch]
+
+    def __init__(self, chatbot, **kwargs):
+        for search_class in self.search_algorithms:
+            if search_class.name not in chatbot.search_algorithms:
+                chatbot.search_algorithms[search_class.name] = search_class(chatbot, **kwargs)
+
+        # Comparisons like VectorSimilarity come with a search of their own
+        kwargs.setdefault(
+            "search_algorithm_name",
+            getattr(
+                kwargs.get("statement_comparison_function"),
+                "search_algorithm_name",
+                CandidateSearch.name,
+            ),
+        )
+        super().__init__(chatbot, **kwargs)
+
+        self.response_cache = kwargs.get("response_cache", None)
+        self.cache_namespace = (
+            self.chatbot.storage.database_uri,  # Guilds can have their own database
+            self.chatbot.storage.tagger.language.ISO_639_1,
+            getattr(kwargs.get("statement_comparison_function"), "__name__", None),
+            self.maximum_similarity_threshold,
+        )
+
+    def find_candidates(self, input_statement) -> CachedCandidates:
+        """The uncached half of BestMatch.process"""
+        search_results = self.search_algorithm.search(input_statement)
+
+        # Use the input statement as the closest match if no other results are found
+        closest_match = next(search_results, input_statement)
+
+        # Search for the closest match to the input statement
+        for result in search_results:
+            closest_match = result
+
+            # Stop searching if a match that is close enough is found
+            if result.confidence >= self.maximum_similarity_threshold:
+                break
+
+        self.chatbot.logger.info(
+            f'Using "{closest_match.text}" as a close match to "{input_statement.text}" '
+            f"with a confidence of {closest_match.confidence}"
+        )
+
+        # Recently repeated responses are left in, they're filtered out when picking
+        responses = list(
+            self.chatbot.storage.filter(
+                search_in_response_to=closest_match.search_text,
+                exclude_text_words=self.excluded_words,
+            )
+        )
+
+        alternate_responses = []
+        if not responses:
+            self.chatbot.logger.info("No responses found. Generating alternate response list.")
+            alternate_responses = list(
+                self.chatbot.storage.filter(
+                    search_in_response_to=self.chatbot.storage.tagger.get_text_index_string(
+                        input_statement.text
+                    ),
+                    exclude_text_words=self.excluded_words,
+                )
+            )
+
+        return CachedCandidates(
+            closest_match.search_text,
+            closest_match.confidence,
+            responses,
+            alternate_responses,
+        )
+
+    def process(self, input_statement, additional_response_selection_parameters=None):
+        if self.response_cache is None or additional_response_selection_parameters:
+            return super().process(input_statement, additional_response_selection_parameters)
+
+        if not input_statement.search_text:
+            input_statement.search_text = self.chatbot.storage.tagger.get_text_index_string(
+                input_statement.text
+            )
+
+        key = (input_statement.search_text, *self.cache_namespace)
+        candidates = self.response_cache.get(key)
+        if candidates is None:
+            candidates = self.find_candidates(input_statement)
+            self.response_cache.set(key, candidates)
+
+        recent_repeated_responses = filters.get_recent_repeated_responses(
+            self.chatbot, input_statement.conversation
+        )
+
+        for response_list in (candidates.responses, candidates.alternate_responses):
+            response_list = [r for r in response_list if r.text not in recent_repeated_responses]
+            if response_list:
+                self.chatbot.logger.info(
+                    f"Selecting response from {len(response_list)} optimal responses."
+                )
+                response = self.select_response(
+                    input_statement, response_list, self.chatbot.storage
+                )
+                response.confidence = candidates.confidence
+                self.chatbot.logger.info(f'Response selected. Using "{response.text}"')
+                return response
+
+        return self.get_default_response(input_statement)
@@ -0,0 +1,188 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+log = logging.getLogger("red.fox_v3.chatter.maintenance")
+
+# Everything picked for deletion goes in a temp table first, so a dry run can count it
+# and statements picked by more than one rule are only counted once
+
+DUPLICATES = """
+INSERT OR IGNORE INTO temp.doomed (id)
+SELECT id FROM statement
+WHERE search_text != '' AND id NOT IN (
+    SELECT MIN(id) FROM statement
+    WHERE search_text != ''
+    GROUP BY lower(trim(search_text)), lower(trim(COALESCE(search_in_response_to, '')))
+)
+"""
+
+OLDER_THAN = """
+INSERT OR IGNORE INTO temp.doomed (id)
+SELECT id FROM statement WHERE created_at < ?
+"""
+
+# Keeps the newest `?` statements with the same search_text, out of those still left
+OVER_LIMIT = """
+INSERT OR IGNORE INTO temp.doomed (id)
+SELECT id FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY search_text ORDER BY id DESC) AS n
+    FROM statement
+    WHERE search_text != '' AND id NOT IN (SELECT id FROM temp.doomed)
+) WHERE n > ?
+"""
+
+DOOMED_BYTES = """
+SELECT COALESCE(SUM(
+    length(CAST(text AS BLOB))
+    + length(CAST(COALESCE(search_text, '') AS BLOB))
+    + length(CAST(COALESCE(in_response_to, '') AS BLOB))
+    + length(CAST(COALESCE(search_in_response_to, '') AS BLOB))
+    + length(CAST(COALESCE(conversation, '') AS BLOB))
+    + length(CAST(COALESCE(persona, '') AS BLOB))
+), 0)
+FROM statement WHERE id IN (SELECT id FROM temp.doomed)
+"""
+
+
+class MaintenanceReport:
+    """What run_maintenance removed, or would remove on a dry run"""
+
+    def __init__(self, dry_run: bool):
+        self.dry_run = dry_run
+        self.databases = 1
+        self.busy = 0  # Databases skipped because they were being trained
+        self.duplicates = 0
+        self.too_old = 0
+        self.over_limit = 0
+        self.bytes_reclaimable = 0  # Estimate, row payloads plus free pages
+        self.size_before = 0
+        self.size_after = None
+        self.elapsed = 0.0
+
+    def add(self, other: "MaintenanceReport"):
+        """Adds another database's results to this one"""
+        self.databases += other.databases
+        self.busy += other.busy
+        self.duplicates += other.duplicates
+        self.too_old += other.too_old
+        self.over_limit += other.over_limit
+        self.bytes_reclaimable += other.bytes_reclaimable
+        self.size_before += other.size_before
+        if self.size_after is not None:
+            self.size_after += other.size_after
+        self.elapsed += other.elapsed
+
+    @property
+    def rows(self):
+        return self.duplicates + self.too_old + self.over_limit
+
+    def __str__(self):
+        lines = [
+            "Dry run, nothing was changed" if self.dry_run else "Maintenance complete",
+            f"Databases: {self.databases}",
+        ]
+        if self.busy:
+            lines.append(f"Skipped while training: {self.busy}, try again once it finishes")
+        lines += [
+            f"Duplicate statements: {self.duplicates}",
+            f"Older than the age limit: {self.too_old}",
+            f"Over the per-text limit: {self.over_limit}",
+            f"Database size: {self.size_before / 2**20:.1f}MB",
+        ]
+        if self.dry_run:
+            lines.append(f"Would reclaim about {self.bytes_reclaimable / 2**20:.1f}MB")
+        else:
+            lines.append(f"Size after: {self.size_after / 2**20:.1f}MB")
+        lines.append(f"Took {self.elapsed:.1f} seconds")
+        return "\n".join(lines)
+
+
+def database_size(storage) -> int:
+    """Size of the sqlite file and its write-ahead log, in bytes"""
+    path = storage.engine.url.database
+    if not path:  # In memory
+        return 0
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def compact(storage):
+    """Rebuilds the indexes, refreshes the query planner's statistics and shrinks the file"""
+    storage.create_indexes()
+    with storage.engine.connect() as conn:
+        # VACUUM can't run inside a transaction
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.exec_driver_sql("REINDEX")
+        conn.exec_driver_sql("ANALYZE")
+        conn.exec_driver_sql("VACUUM")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def run_maintenance(storage, max_age_days=0, max_per_text=0, dry_run=True) -> MaintenanceReport:
+    """
+    Deduplicates and prunes statements, then compacts the database
+
+    Duplicates share the same normalized search_text and search_in_response_to,
+    the oldest one is kept. `max_age_days` and `max_per_text` are off when 0.
+    Blocks, run it in an executor. Skips the database if it's in the middle of a bulk load.
+    """
+    report = MaintenanceReport(dry_run)
+    start_time = time.time()
+    report.size_before = database_size(storage)
+
+    if not storage.begin_maintenance():
+        log.info("Skipping maintenance, a bulk load is running")
+        report.busy = 1
+        if not dry_run:
+            report.size_after = report.size_before
+        return report
+    try:
+        _maintain(storage, report, max_age_days, max_per_text, dry_run)
+    finally:
+        storage.end_maintenance()
+
+    report.elapsed = time.time() - start_time
+    log.info(
+        f"{'Dry run' if dry_run else 'Maintenance'}: {report.rows} statements, "
+        f"{report.bytes_reclaimable} bytes reclaimable, {report.elapsed:.1f} seconds"
+    )
+    return report
+
+
+def _maintain(storage, report: MaintenanceReport, max_age_days, max_per_text, dry_run):
+
+    doomed_ids = []
+    with storage.engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS temp.doomed")
+        conn.exec_driver_sql("CREATE TEMP TABLE doomed (id INTEGER PRIMARY KEY)")
+
+        report.duplicates = conn.exec_driver_sql(DUPLICATES).rowcount
+        if max_age_days:
+            cutoff = datetime.now() - timedelta(days=max_age_days)
+            report.too_old = conn.exec_driver_sql(
+                OLDER_THAN, (cutoff.strftime("%Y-%m-%d %H:%M:%S"),)
+            ).rowcount
+        if max_per_text:
+            report.over_limit = conn.exec_driver_sql(OVER_LIMIT, (max_per_text,)).rowcount
+
+        page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+        free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        report.bytes_reclaimable = (
+            conn.exec_driver_sql(DOOMED_BYTES).scalar() + page_size * free_pages
+        )
+
+        if not dry_run and report.rows:
+            doomed_ids = [row[0] for row in conn.exec_driver_sql("SELECT id FROM temp.doomed")]
+            conn.exec_driver_sql(
+                "DELETE FROM tag_association WHERE statement_id IN (SELECT id FROM temp.doomed)"
+            )
+            conn.exec_driver_sql("DELETE FROM statement WHERE id IN (SELECT id FROM temp.doomed)")
+
+        conn.exec_driver_sql("DROP TABLE temp.doomed")
+
+    if not dry_run:
+        log.info(f"Removed {len(doomed_ids)} statements, compacting the database")
+        storage.forget(doomed_ids)
+        compact(storage)
+        report.size_after = database_size(storage)
@@ -0,0 +1,77 @@
+import logging
+import string
+import threading
+from typing import Dict, List
+
+from chatterbot import comparisons, languages, tagging
+
+log = logging.getLogger("red.fox_v3.chatter.models")
+
+# Nothing in chatter reads entities or dependency parses, tagging only needs POS and lemmas
+EXCLUDED_COMPONENTS = ["ner", "parser"]
+
+_models: Dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def get_model(name: str):
+    """
+    Returns the spaCy pipeline `name`, loading it the first time it's asked for
+
+    Every tagger and comparator in the process shares the same copy.
+    """
+    nlp = _models.get(name, None)
+    if nlp is None:
+        with _lock:  # Two threads asking at once shouldn't load it twice
+            nlp = _models.get(name, None)
+            if nlp is None:
+                import spacy
+
+                log.info(f"Loading spaCy model {name}")
+                nlp = spacy.load(name, exclude=EXCLUDED_COMPONENTS)
+                _models[name] = nlp
+    return nlp
+
+
+def release_model(name: str):
+    """Forget a model, it's freed once nothing else holds on to it"""
+    with _lock:
+        _models.pop(name, None)
+
+
+def loaded_models() -> List[str]:
+    return list(_models)
+
+
+class PosLemmaTagger(tagging.PosLemmaTagger):
+    """PosLemmaTagger that gets its pipeline from the registry on first use"""
+
+    def __init__(self, language=None):
+        self.language = language or languages.ENG
+        self.punctuation_table = str.maketrans(dict.fromkeys(string.punctuation))
+
+    @property
+    def nlp(self):
+        return get_model(self.language.ISO_639_1.lower())
+
+
+class SpacySimilarity(comparisons.SpacySimilarity):
+    """SpacySimilarity that gets its pipeline from the registry on first use"""
+
+    def __init__(self, language):
+        comparisons.Comparator.__init__(self, language)
+
+    @property
+    def nlp(self):
+        return get_model(self.language.ISO_639_1)
+
+
+class JaccardSimilarity(comparisons.JaccardSimilarity):
+    """JaccardSimilarity that gets its pipeline from the registry on first use"""
+
+    def __init__(self, language):
+        comparisons.Comparator.__init__(self, language)
+
+    @property
+    def nlp(self):
+        return get_model(self.language.ISO_639_1)
@@ -0,0 +1,111 @@
+from chatterbot.comparisons import LevenshteinDistance
+
+from chatter.vectors import VectorSimilarity, embed_texts
+
+
+class CandidateSearch:
+    """
+    Search that only compares statements sharing search_text tokens with the input
+
+    The candidates come from the storage adapter's inverted index, see chatter.index.
+    Scoring works the same as chatterbot's IndexedTextSearch,
+    it just never looks at more than `candidate_limit` statements.
+    """
+
+    name = "chatter_candidate_search"
+
+    def __init__(self, chatbot, **kwargs):
+        self.chatbot = chatbot
+
+        statement_comparison_function = kwargs.get(
+            "statement_comparison_function", LevenshteinDistance
+        )
+
+        self.compare_statements = statement_comparison_function(
+            language=self.chatbot.storage.tagger.language
+        )
+
+        self.candidate_limit = kwargs.get("candidate_limit", 250)
+
+    def get_candidates(self, input_statement, **additional_parameters):
+        storage = self.chatbot.storage
+
+        input_search_text = input_statement.search_text
+
+        if not input_search_text:
+            self.chatbot.logger.warning(
+                "No value for search_text was available on the provided input"
+            )
+
+            input_search_text = storage.tagger.get_text_index_string(input_statement.text)
+
+        statement_ids = storage.ensure_index().candidates(input_search_text, self.candidate_limit)
+
+        return storage.get_many(statement_ids, **additional_parameters)
+
+    def search(self, input_statement, **additional_parameters):
+        """
+        Search for close matches to the input. Confidence scores for
+        subsequent results will order of increasing value.
+        """
+        self.chatbot.logger.info("Beginning indexed search for close text match")
+
+        statement_list = self.get_candidates(input_statement, **additional_parameters)
+
+        self.chatbot.logger.info(f"Processing {len(statement_list)} candidates")
+
+        best_confidence_so_far = 0
+
+        # Find the closest matching known statement
+        for statement in statement_list:
+            confidence = self.compare_statements(input_statement, statement)
+
+            if confidence > best_confidence_so_far:
+                best_confidence_so_far = confidence
+                statement.confidence = confidence
+
+                self.chatbot.logger.info(f"Similar text found: {statement.text} {confidence}")
+
+                yield statement
+
+
+class VectorSearch:
+    """
+    Search that scores every statement at once against precomputed document vectors
+
+    The input is embedded once, then compared with a single matrix-vector product
+    against the storage adapter's VectorStore.
+    """
+
+    name = VectorSimilarity.search_algorithm_name
+
+    def __init__(self, chatbot, **kwargs):
+        self.chatbot = chatbot
+        self.candidate_limit = kwargs.get("candidate_limit", 250)
+
+    def search(self, input_statement, **additional_parameters):
+        """
+        Search for close matches to the input. Confidence scores for
+        subsequent results will order of increasing value.
+        """
+        self.chatbot.logger.info("Beginning vector search for close text match")
+        storage = self.chatbot.storage
+
+        vectors = storage.ensure_vectors()
+        query = embed_texts(storage.tagger.nlp, [input_statement.text])[0]
+        statement_ids, scores = vectors.most_similar(query, self.candidate_limit)
+
+        confidences = dict(zip(statement_ids.tolist(), scores.tolist()))
+        statement_list = storage.get_many(list(confidences), **additional_parameters)
+
+        self.chatbot.logger.info(f"Processing {len(statement_list)} candidates")
+
+        # Already sorted by increasing confidence
+        for statement in statement_list:
+            statement.confidence = confidences[statement.id]
+
+            self.chatbot.logger.info(
+                f"Similar text found: {statement.text} {statement.confidence}"
+            )
+
+            yield statement
@@ -0,0 +1,130 @@
+import logging
+import pathlib
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+from chatterbot import ChatBot
+
+log = logging.getLogger("red.fox_v3.chatter.shards")
+
+T = TypeVar("T")
+
+
+class GuildShards:
+    """
+    One ChatBot per guild, each with its own database file in `directory`
+
+    ChatBots are opened on first use by `open_chatbot(guild_id)`.
+    Only the `max_open` most recently used stay open. Used from executor threads.
+    `open_chatbot(guild_id, warm_up=False)` opens one for `each` that isn't kept.
+    """
+
+    def __init__(self, directory: pathlib.Path, open_chatbot: Callable[..., ChatBot], max_open=32):
+        self.directory = directory
+        self.open_chatbot = open_chatbot
+        self.max_open = max_open
+
+        self._lock = threading.Lock()  # Only held to look at or change _open
+        self._open: "OrderedDict[int, ChatBot]" = OrderedDict()
+        # Held while that guild's shard opens or `each` has it. Never removed, so everyone
+        # waiting on a guild waits on the same lock
+        self._opening: Dict[int, threading.Lock] = {}
+        self._generation = 0  # Shards opened before close_all aren't kept
+
+    def __len__(self):
+        return len(self._open)
+
+    def path(self, guild_id: int) -> pathlib.Path:
+        return self.directory / f"{guild_id}.sqlite3"
+
+    def _cached(self, guild_id: int) -> Optional[ChatBot]:
+        chatbot = self._open.get(guild_id, None)
+        if chatbot is not None:
+            self._open.move_to_end(guild_id)
+        return chatbot
+
+    def get(self, guild_id: int) -> ChatBot:
+        """
+        The guild's ChatBot, opening it if needed
+
+        Opening a shard warms it up, which can be slow, so it only blocks
+        other threads asking for the same guild.
+        """
+        with self._lock:
+            chatbot = self._cached(guild_id)
+            if chatbot is not None:
+                return chatbot
+            opening = self._opening.setdefault(guild_id, threading.Lock())
+
+        with opening:
+            with self._lock:  # Another thread may have opened it meanwhile
+                chatbot = self._cached(guild_id)
+                if chatbot is not None:
+                    return chatbot
+                generation = self._generation
+
+            self.directory.mkdir(parents=True, exist_ok=True)
+            log.debug(f"Opening shard for {guild_id}")
+            chatbot = self.open_chatbot(guild_id)
+
+            closing = []
+            with self._lock:
+                if generation == self._generation:
+                    self._open[guild_id] = chatbot
+                    while len(self._open) > self.max_open:
+                        closing.append(self._open.popitem(last=False)[1])
+
+        for chatbot_ in closing:
+            chatbot_.storage.engine.dispose()
+        return chatbot
+
+    def existing(self) -> List[int]:
+        """Ids of every guild with a database, open or not"""
+        if not self.directory.exists():
+            return []
+        return [int(path.stem) for path in self.directory.glob("*.sqlite3")]
+
+    def each(self, func: Callable[[ChatBot], T]) -> Iterator[T]:
+        """
+        Yields `func(chatbot)` for every guild with a database, without filling the cache
+
+        Open shards are used as they are. The rest are opened cold just for `func` and closed
+        after, asking for that guild meanwhile waits for it. Blocks, only call from an executor.
+        """
+        for guild_id in self.existing():
+            with self._lock:
+                chatbot = self._open.get(guild_id, None)
+                opening = self._opening.setdefault(guild_id, threading.Lock())
+            if chatbot is not None:
+                yield func(chatbot)
+                continue
+
+            with opening:
+                with self._lock:
+                    chatbot = self._open.get(guild_id, None)
+                if chatbot is not None:
+                    result = func(chatbot)
+                else:
+                    chatbot = self.open_chatbot(guild_id, warm_up=False)
+                    try:
+                        result = func(chatbot)
+                    finally:
+                        chatbot.storage.engine.dispose()
+            yield result
+
+    def close_all(self):
+        """Blocks while engines are disposed, only call from an executor"""
+        with self._lock:
+            closing = list(self._open.values())
+            self._open.clear()
+            self._generation += 1
+        for chatbot in closing:
+            chatbot.storage.engine.dispose()
+
+    def remove_all(self):
+        """Closes and deletes every guild's database. Blocks, only call from an executor"""
+        self.close_all()
+        if self.directory.exists():
+            shutil.rmtree(self.directory)
@@ -1,5 +1,22 @@
+import logging
+import threading
+from contextlib import contextmanager
+
 from chatterbot.storage import StorageAdapter, SQLStorageAdapter
 
+from chatter.index import StatementIndex
+from chatter.vectors import VectorStore, embed_texts
+
+log = logging.getLogger("red.fox_v3.chatter.storage")
+
+# Indexes chatterbot doesn't make. Dropped during bulk loads and rebuilt after
+STATEMENT_INDEXES = {
+    "ix_statement_search_in_response_to": "search_in_response_to",
+    "ix_statement_text": "text",
+}
+
+BULK_CACHE_SIZE = -262144  # Negative is KiB, so 256MB
+
 
 class MyDumbSQLStorageAdapter(SQLStorageAdapter):
     def __init__(self, **kwargs):
@@ -21,10 +38,10 @@ class MyDumbSQLStorageAdapter(SQLStorageAdapter):
         self.engine = create_engine(self.database_uri, connect_args={"check_same_thread": False})
 
         if self.database_uri.startswith("sqlite://"):
-            from sqlalchemy.engine import Engine
             from sqlalchemy import event
 
-            @event.listens_for(Engine, "connect")
+            # On this engine only, Engine would add a listener for every adapter ever made
+            @event.listens_for(self.engine, "connect")
             def set_sqlite_pragma(dbapi_connection, connection_record):
                 dbapi_connection.execute("PRAGMA journal_mode=WAL")
                 dbapi_connection.execute("PRAGMA synchronous=NORMAL")
@@ -32,8 +49,349 @@ class MyDumbSQLStorageAdapter(SQLStorageAdapter):
         if not inspect(self.engine).has_table("Statement"):
             self.create_database()
 
+        self._bulk_loads = 0
+        self._maintaining = False
+        self._bulk_state = threading.Condition()  # Guards _bulk_loads and _maintaining
+
+        if self.database_uri.startswith("sqlite://"):
+            from sqlalchemy import event
+
+            @event.listens_for(self.engine, "checkout")
+            def set_bulk_pragma(dbapi_connection, connection_record, connection_proxy):
+                bulk = self._bulk_loads > 0
+                if connection_record.info.get("bulk", False) == bulk:
+                    return
+                if bulk:
+                    dbapi_connection.execute("PRAGMA synchronous=OFF")
+                    dbapi_connection.execute(f"PRAGMA cache_size={BULK_CACHE_SIZE}")
+                else:
+                    dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+                    dbapi_connection.execute("PRAGMA cache_size=-2000")  # sqlite default
+                connection_record.info["bulk"] = bulk
+
         self.Session = sessionmaker(bind=self.engine, expire_on_commit=True)
 
+        self.index = StatementIndex()
+
+        # Only kept up to date when the vector search is in use
+        vector_path = kwargs.get("vector_path", None)
+        self.vectors = VectorStore(vector_path) if vector_path is not None else None
+
+    def _iter_column(self, column_name, after=0):
+        """Yields (id, value) of every statement after the given id, in id order"""
+        from sqlalchemy import select
+
+        Statement = self.get_model("statement")
+
+        query = (
+            select(Statement.id, getattr(Statement, column_name))
+            .where(Statement.id > after)
+            .order_by(Statement.id)
+        )
+        with self.engine.connect() as conn:
+            for row in conn.execute(query):
+                yield row[0], row[1]
+
+    def _iter_search_text(self, after=0):
+        return self._iter_column("search_text", after)
+
+    def warm_up(self):
+        """Get the search structures ready before the first message needs them"""
+        self.create_indexes()
+        self.ensure_index()
+        if self.vectors is not None:
+            self.ensure_vectors()
+
+    def ensure_index(self):
+        """Builds the inverted index the first time it is needed"""
+        index = self.index  # forget() may swap in a new one
+        with index.lock:
+            if not index.ready:
+                index.build(self._iter_search_text())
+        return index
+
+    def sync_index(self):
+        """Picks up any statements written since the index last looked"""
+        index = self.index
+        with index.lock:
+            if index.ready:
+                index.update(self._iter_search_text(after=index.last_id))
+
+    def ensure_vectors(self):
+        self.sync_vectors()
+        return self.vectors
+
+    def sync_vectors(self, batch_size=1000):
+        """Embeds every statement written since the vectors were last updated"""
+        if self.vectors is None:
+            return
+
+        with self.vectors.lock:
+            batch = []
+            for row in self._iter_column("text", after=self.vectors.last_id):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self._write_vectors(batch)
+                    batch = []
+            if batch:
+                self._write_vectors(batch)
+
+    def _write_vectors(self, rows):
+        statement_ids = [statement_id for statement_id, _ in rows]
+        texts = [text or "" for _, text in rows]
+        self.vectors.write(statement_ids, embed_texts(self.tagger.nlp, texts))
+
+    def get_many(self, statement_ids, **kwargs):
+        """
+        Returns the statements with the given ids, in the same order as `statement_ids`
+
+        Bot statements are skipped, same as the search_text search
+        """
+        Statement = self.get_model("statement")
+
+        if not statement_ids:
+            return []
+
+        session = self.Session()
+
+        statements = session.query(Statement).filter(Statement.id.in_(statement_ids))
+        if kwargs:
+            statements = statements.filter_by(**kwargs)
+        statements = statements.filter(~Statement.persona.startswith("bot:"))
+
+        found = {statement.id: self.model_to_object(statement) for statement in statements}
+
+        session.close()
+        return [found[i] for i in statement_ids if i in found]
+
+    def create_indexes(self):
+        with self.engine.begin() as conn:
+            for name, column in STATEMENT_INDEXES.items():
+                conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON statement ({column})")
+
+    def drop_indexes(self):
+        with self.engine.begin() as conn:
+            for name in STATEMENT_INDEXES:
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+    def begin_bulk_load(self):
+        """
+        Trade durability for speed until end_bulk_load is called
+
+        Turns off syncing to disk, grows the page cache and drops the extra indexes,
+        which are rebuilt once at the end instead of on every insert.
+        Waits for maintenance to finish first, none can start until the bulk load ends.
+        """
+        with self._bulk_state:
+            self._bulk_state.wait_for(lambda: not self._maintaining)
+            self._bulk_loads += 1
+            if self._bulk_loads == 1:
+                self.drop_indexes()
+
+    def end_bulk_load(self):
+        with self._bulk_state:
+            self._bulk_loads -= 1
+            if self._bulk_loads == 0:
+                log.info("Rebuilding indexes after bulk load")
+                self.create_indexes()
+                self._bulk_state.notify_all()
+
+    def begin_maintenance(self) -> bool:
+        """
+        Keeps bulk loads from starting until end_maintenance is called
+
+        Returns False without waiting if a bulk load is running. A bulk load can span many
+        executor jobs, so waiting for it here could hold the thread it needs to finish.
+        """
+        with self._bulk_state:
+            if self._bulk_loads or self._maintaining:
+                return False
+            self._maintaining = True
+            return True
+
+    def end_maintenance(self):
+        with self._bulk_state:
+            self._maintaining = False
+            self._bulk_state.notify_all()
+
+    @contextmanager
+    def bulk_load(self):
+        self.begin_bulk_load()
+        try:
+            yield self
+        finally:
+            self.end_bulk_load()
+
+    def _get_tag_ids(self, conn, tag_names):
+        from sqlalchemy import insert, select
+
+        Tag = self.get_model("tag").__table__
+
+        query = select(Tag.c.name, Tag.c.id).where(Tag.c.name.in_(tag_names))
+        tag_ids = dict(conn.execute(query).all())
+
+        missing = set(tag_names) - set(tag_ids)
+        if missing:
+            conn.execute(insert(Tag), [{"name": name} for name in missing])
+            tag_ids = dict(conn.execute(query).all())
+        return tag_ids
+
+    def create(self, **kwargs):
+        # Statement.serialize() passes these as empty strings, which chatterbot leaves empty
+        if not kwargs.get("search_text"):
+            kwargs["search_text"] = self.tagger.get_text_index_string(kwargs["text"])
+        if not kwargs.get("search_in_response_to") and kwargs.get("in_response_to"):
+            kwargs["search_in_response_to"] = self.tagger.get_text_index_string(
+                kwargs["in_response_to"]
+            )
+
+        statement = super().create(**kwargs)
+        self.sync_index()
+        self.sync_vectors()
+        return statement
+
+    def create_many(self, statements):
+        """
+        Creates multiple statement entries.
+
+        Skips the ORM and inserts with executemany, all in one transaction
+        """
+        from sqlalchemy import insert
+        from chatterbot.ext.sqlalchemy_app.models import tag_association_table
+
+        Statement = self.get_model("statement").__table__
+
+        rows = []
+        tagged_rows = []
+        for statement in statements:
+            search_text = statement.search_text
+            if not search_text:
+                search_text = self.tagger.get_text_index_string(statement.text)
+
+            search_in_response_to = statement.search_in_response_to
+            if not search_in_response_to and statement.in_response_to:
+                search_in_response_to = self.tagger.get_text_index_string(statement.in_response_to)
+
+            row = {
+                "text": statement.text,
+                "search_text": search_text,
+                "conversation": statement.conversation,
+                "persona": statement.persona,
+                "in_response_to": statement.in_response_to,
+                "search_in_response_to": search_in_response_to or "",
+                "created_at": statement.created_at,
+            }
+
+            tags = statement.get_tags()
+            if tags:
+                tagged_rows.append((row, set(tags)))
+            else:
+                rows.append(row)
+
+        with self.engine.begin() as conn:
+            if rows:
+                conn.execute(insert(Statement), rows)
+
+            if tagged_rows:
+                # Need the new ids for the tags, so these go one at a time
+                tag_ids = self._get_tag_ids(conn, set().union(*(t for _, t in tagged_rows)))
+                for row, tags in tagged_rows:
+                    result = conn.execute(insert(Statement), row)
+                    statement_id = result.inserted_primary_key[0]
+                    conn.execute(
+                        insert(tag_association_table),
+                        [{"tag_id": tag_ids[t], "statement_id": statement_id} for t in tags],
+                    )
+
+        self.sync_index()
+        self.sync_vectors()
+
+    def _max_id(self) -> int:
+        from sqlalchemy import func, select
+
+        Statement = self.get_model("statement")
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.max(Statement.id))).scalar() or 0
+
+    def update(self, statement):
+        if statement is not None and getattr(statement, "id", None) is not None:
+            # Existing record, search_text may have changed
+            from sqlalchemy import select
+
+            Statement = self.get_model("statement")
+            with self.engine.connect() as conn:
+                old_search_text = conn.execute(
+                    select(Statement.search_text).where(Statement.id == statement.id)
+                ).scalar()
+
+            super().update(statement)
+            self.index.replace(
+                statement.id, old_search_text, self.tagger.get_text_index_string(statement.text)
+            )
+            if self.vectors is not None:
+                self._write_vectors([(statement.id, statement.text)])
+        else:
+            super().update(statement)
+            self.sync_index()
+            self.sync_vectors()
+
+    def remove(self, statement_text):
+        """Removes every statement with the given text, chatterbot only removed the first"""
+        from sqlalchemy import delete, select
+        from chatterbot.ext.sqlalchemy_app.models import tag_association_table
+
+        Statement = self.get_model("statement").__table__
+
+        with self.engine.begin() as conn:
+            statement_ids = [
+                row[0]
+                for row in conn.execute(
+                    select(Statement.c.id).where(Statement.c.text == statement_text)
+                )
+            ]
+            if statement_ids:
+                conn.execute(
+                    delete(tag_association_table).where(
+                        tag_association_table.c.statement_id.in_(statement_ids)
+                    )
+                )
+                conn.execute(delete(Statement).where(Statement.c.id.in_(statement_ids)))
+
+        if not statement_ids:
+            return
+        if max(statement_ids) > self._max_id():
+            self.forget(statement_ids)  # sqlite will hand the id out again
+            return
+        for statement_id in statement_ids:
+            self.index.discard(statement_id)
+        if self.vectors is not None:
+            self.vectors.erase(statement_ids)
+
+    def forget(self, statement_ids):
+        """
+        Drops statements deleted outside of the adapter from the search structures
+
+        Rebuilds the index right away so the next reply doesn't have to. Blocks, run it in an
+        executor. The new index is built aside and swapped in, searches use the old one meanwhile.
+        """
+        if not statement_ids:
+            return
+        if self.index.ready:
+            index = StatementIndex(self.index.max_postings)
+            index.build(self._iter_search_text())
+            self.index = index
+            self.sync_index()  # Anything written while it was building
+        if self.vectors is not None:
+            self.vectors.erase(statement_ids)
+            # New statements get max(id) + 1, which can be the id of one just deleted
+            self.vectors.rewind(self._max_id())
+
+    def drop(self):
+        super().drop()
+        self.index.clear()
+        if self.vectors is not None:
+            self.vectors.clear()
+
 
 class AsyncSQLStorageAdapter(SQLStorageAdapter):
     def __init__(self, **kwargs):
@@ -57,10 +415,10 @@ class AsyncSQLStorageAdapter(SQLStorageAdapter):
         self.engine = await create_engine(self.database_uri, convert_unicode=True)
 
         if self.database_uri.startswith("sqlite://"):
-            from sqlalchemy.engine import Engine
             from sqlalchemy import event
 
-            @event.listens_for(Engine, "connect")
+            # On this engine only, Engine would add a listener for every adapter ever made
+            @event.listens_for(self.engine, "connect")
             def set_sqlite_pragma(dbapi_connection, connection_record):
                 dbapi_connection.execute("PRAGMA journal_mode=WAL")
                 dbapi_connection.execute("PRAGMA synchronous=NORMAL")
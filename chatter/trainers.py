@@ -1,22 +1,216 @@
 import asyncio
 import csv
 import html
+import itertools
+import json
 import logging
+import multiprocessing
 import os
 import pathlib
+import sqlite3
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
+from operator import itemgetter
+from types import SimpleNamespace
+from typing import Iterable, List, Optional, Tuple
 
 from chatterbot import utils
 from chatterbot.conversation import Statement
-from chatterbot.tagging import PosLemmaTagger
 from chatterbot.trainers import Trainer
 from redbot.core.bot import Red
 from dateutil import parser as date_parser
 from redbot.core.utils import AsyncIter
 
+from chatter.models import PosLemmaTagger, get_model
+
 log = logging.getLogger("red.fox_v3.chatter.trainers")
 
+CHECKPOINT_FILE = "checkpoint.json"  # In each KaggleTrainer's data directory
+
+# One per worker process, see _init_tagging_worker
+_worker_tagger: Optional[PosLemmaTagger] = None
+_worker_preprocessors = []
+
+
+def _init_tagging_worker(model_name, preprocessors):
+    global _worker_tagger, _worker_preprocessors
+    # Only the model name is needed, no reason to import the cog in every worker
+    _worker_tagger = PosLemmaTagger(language=SimpleNamespace(ISO_639_1=model_name))
+    get_model(model_name)  # Load it now rather than in the middle of the first chunk
+    _worker_preprocessors = preprocessors
+
+
+def _tag_conversations(conversations: List[List[Tuple[str, str]]]):
+    """
+    Runs the preprocessors and tagger over a chunk of conversations in a worker process
+
+    Each conversation is a list of (text, persona). Returns a list of statement kwargs.
+    """
+    out = []
+    for conversation in conversations:
+        previous_statement_text = None
+        previous_statement_search_text = ""
+
+        for text, persona in conversation:
+            statement = Statement(
+                text=text,
+                in_response_to=previous_statement_text,
+                conversation="training",
+                persona=persona or "",
+            )
+
+            for preprocessor in _worker_preprocessors:
+                statement = preprocessor(statement)
+
+            statement.search_text = _worker_tagger.get_text_index_string(statement.text)
+            statement.search_in_response_to = previous_statement_search_text
+
+            previous_statement_text = statement.text
+            previous_statement_search_text = statement.search_text
+
+            out.append(
+                {
+                    "text": statement.text,
+                    "in_response_to": statement.in_response_to,
+                    "conversation": statement.conversation,
+                    "persona": statement.persona,
+                    "search_text": statement.search_text,
+                    "search_in_response_to": statement.search_in_response_to,
+                }
+            )
+    return out
+
+
+class ParallelTrainer:
+    """
+    Tags conversations in a pool of worker processes, one spaCy model per worker
+
+    Results come back in order to a single writer that saves them with `create_many`.
+    The number of committed conversations is saved to a checkpoint file after every write,
+    so an interrupted run skips what was already saved next time.
+    """
+
+    def __init__(
+        self,
+        chatbot,
+        checkpoint_path: pathlib.Path,
+        workers: Optional[int] = None,
+        chunk_size=50,
+        save_every=5000,
+        executor=None,
+    ):
+        self.chatbot = chatbot
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.chunk_size = chunk_size  # Conversations per worker job
+        self.save_every = save_every  # Statements per create_many
+        self.executor = executor  # Reads the corpus and writes, the tagging has its own processes
+
+    def _load_checkpoint(self) -> dict:
+        if not self.checkpoint_path.exists():
+            return {}
+        with self.checkpoint_path.open() as f:
+            return json.load(f)
+
+    def _save_checkpoint(self, name, committed):
+        checkpoint = self._load_checkpoint()
+        if committed is None:
+            checkpoint.pop(name, None)
+        else:
+            checkpoint[name] = committed
+        with self.checkpoint_path.open("w") as f:
+            json.dump(checkpoint, f)
+
+    async def train(self, conversations: Iterable[List[Tuple[str, str]]], name: str):
+        """
+        Train on an iterable of conversations, each a list of (text, persona)
+
+        `name` identifies the data set in the checkpoint file
+        """
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+
+        conversations = iter(conversations)
+
+        committed = self._load_checkpoint().get(name, 0)
+        if committed:
+            log.info(f"Resuming {name} after {committed} conversations")
+            conversations = itertools.islice(conversations, committed, None)
+
+        def next_chunk():
+            # Reading the corpus parses files, skipping on resume too, so it runs in an executor
+            return list(itertools.islice(conversations, self.chunk_size))
+
+        statements = []
+        chunks_done = deque()  # Conversation count of each chunk waiting on a write
+        rows = 0
+
+        async def write():
+            nonlocal committed, statements, rows
+            if statements:
+                await loop.run_in_executor(
+                    self.executor, self.chatbot.storage.create_many, statements
+                )
+            rows += len(statements)
+            committed += sum(chunks_done)
+            chunks_done.clear()
+            statements = []
+            self._save_checkpoint(name, committed)
+
+            elapsed = time.time() - start_time
+            log.info(
+                f"{name}: {committed} conversations, {rows} statements "
+                f"({rows / elapsed:.0f} rows/sec)"
+            )
+
+        storage = self.chatbot.storage
+        bulk = hasattr(storage, "begin_bulk_load")  # Only MyDumbSQLStorageAdapter can
+        if bulk:
+            await loop.run_in_executor(self.executor, storage.begin_bulk_load)
+
+        # Forking a process with other threads running can copy a lock one of them held,
+        # the workers build their tagger from scratch anyway
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_tagging_worker,
+            initargs=(storage.tagger.language.ISO_639_1, self.chatbot.preprocessors),
+        )
+        try:
+            pending = deque()
+
+            async def collect():
+                chunk_len, future = pending.popleft()
+                results = await future
+                statements.extend(Statement(**kwargs) for kwargs in results)
+                chunks_done.append(chunk_len)
+                if len(statements) >= self.save_every:
+                    await write()
+
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next_chunk)
+                if not chunk:
+                    break
+                pending.append((len(chunk), loop.run_in_executor(pool, _tag_conversations, chunk)))
+                if len(pending) >= self.workers * 2:  # Keep every worker busy, but no more
+                    await collect()
+
+            while pending:
+                await collect()
+
+            await write()
+        finally:
+            # Waiting on the workers would block the event loop, on an error or cancel
+            # the queued chunks are dropped instead of tagged for nothing
+            pool.shutdown(wait=False, cancel_futures=True)
+            if bulk:
+                await loop.run_in_executor(self.executor, storage.end_bulk_load)
+
+        self._save_checkpoint(name, None)  # Finished, next run starts over
+        return rows
+
 
 class KaggleTrainer(Trainer):
     def __init__(self, chatbot, datapath: pathlib.Path, **kwargs):
@@ -29,10 +223,22 @@ class KaggleTrainer(Trainer):
             "Cornell-University/movie-dialog-corpus",
         )
 
+        self.workers = kwargs.get("workers", None)
+        self.executor = kwargs.get("executor", None)
+
         # Create the data directory if it does not already exist
         if not os.path.exists(self.data_directory):
             os.makedirs(self.data_directory)
 
+    async def train_conversations(self, conversations, name):
+        trainer = ParallelTrainer(
+            self.chatbot,
+            self.data_directory / CHECKPOINT_FILE,
+            workers=self.workers,
+            executor=self.executor,
+        )
+        return await trainer.train(conversations, name)
+
     def is_downloaded(self, file_path):
         """
         Check if the data file is already downloaded.
@@ -47,7 +253,7 @@ class KaggleTrainer(Trainer):
         import kaggle  # This triggers the API token check
 
         future = await asyncio.get_event_loop().run_in_executor(
-            None,
+            self.executor,
             partial(
                 kaggle.api.dataset_download_files,
                 dataset=dataset,
@@ -75,6 +281,97 @@ class SouthParkTrainer(KaggleTrainer):
         )
 
 
+def _iter_movie_lines(lines_tsv):
+    """
+    Yields (lineID, text) from movie_lines.tsv
+
+    [lineID, characterID, movieID, character name, text of utterance]
+    File parsing from https://www.kaggle.com/mushaya/conversation-chatbot
+    """
+    for line in lines_tsv:
+        _line = line.rstrip("\n").strip('"').split("\t")
+        if len(_line) >= 5:  # Only good lines
+            yield _line[0], (
+                html.unescape(("".join(_line[4:])).strip())
+                .replace("<u>", "__")
+                .replace("</u>", "__")
+                .replace('""', '"')
+            )
+        else:
+            log.debug(f"Bad line {_line}")
+
+
+def _iter_movie_conversations(conv_tsv):
+    """
+    Yields the list of lineIDs of each conversation in movie_conversations.tsv
+
+    [characterID of first, characterID of second, movieID, list of utterances]
+    The last line of the file is skipped, same as the readlines()[:-1] this replaced.
+    """
+    lines = iter(conv_tsv)
+    line = next(lines, None)
+    for next_line in lines:
+        _line = line.rstrip("\n").split("\t")[-1][1:-1].replace("'", "").replace(" ", ",")
+        if _line:
+            yield _line.split(",")
+        line = next_line
+
+
+class LineLookup:
+    """
+    Line id to text lookup stored in sqlite3 instead of a dict
+
+    Keeps memory flat no matter how big the dialogue file is.
+    Use as a context manager to open it for reading, from any one thread at a time.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def build(self, lines_path: pathlib.Path, batch_size=10000):
+        """Builds the lookup from the dialogue file, unless it's already up to date"""
+        if self.path.exists() and self.path.stat().st_mtime >= lines_path.stat().st_mtime:
+            log.info(f"Using existing {self.path.name}")
+            return
+
+        # Built aside and moved into place when complete, so an interrupted build
+        # never leaves a partial lookup that looks newer than the dialogue file
+        temp_path = self.path.with_suffix(".tmp")
+        if temp_path.exists():
+            os.remove(temp_path)
+        conn = sqlite3.connect(temp_path)
+        try:
+            conn.execute("CREATE TABLE lines (id TEXT PRIMARY KEY, text TEXT) WITHOUT ROWID")
+            with open(lines_path, "r", encoding="utf-8-sig") as lines_tsv:
+                rows = _iter_movie_lines(lines_tsv)
+                for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+                    conn.executemany("INSERT OR REPLACE INTO lines VALUES (?, ?)", batch)
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(temp_path, self.path)
+
+    def __enter__(self):
+        # Training reads the conversations from executor threads
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._conn.close()
+        self._conn = None
+
+    def get_many(self, line_ids: List[str]) -> List[str]:
+        """Texts of the lines that exist, in the order of `line_ids`, with one query"""
+        placeholders = ",".join("?" * len(line_ids))
+        found = dict(
+            self._conn.execute(
+                f"SELECT id, text FROM lines WHERE id IN ({placeholders})", line_ids
+            )
+        )
+        return [found[line_id] for line_id in line_ids if line_id in found]
+
+
 class MovieTrainer(KaggleTrainer):
     def __init__(self, chatbot, datapath: pathlib.Path, **kwargs):
         super().__init__(
@@ -91,93 +388,22 @@ class MovieTrainer(KaggleTrainer):
         log.info(f"Beginning dialogue training on {dialogue_file}")
         start_time = time.time()
 
-        tagger = PosLemmaTagger(language=self.chatbot.storage.tagger.language)
-
-        # [lineID, characterID, movieID, character name, text of utterance]
-        # File parsing from https://www.kaggle.com/mushaya/conversation-chatbot
-
-        with open(self.data_directory / conversation_file, "r", encoding="utf-8-sig") as conv_tsv:
-            conv_lines = conv_tsv.readlines()
-        with open(self.data_directory / dialogue_file, "r", encoding="utf-8-sig") as lines_tsv:
-            dialog_lines = lines_tsv.readlines()
-
-        # trans_dict = str.maketrans({"<u>": "__", "</u>": "__", '""': '"'})
-
-        lines_dict = {}
-        for line in dialog_lines:
-            _line = line[:-1].strip('"').split("\t")
-            if len(_line) >= 5:  # Only good lines
-                lines_dict[_line[0]] = (
-                    html.unescape(("".join(_line[4:])).strip())
-                    .replace("<u>", "__")
-                    .replace("</u>", "__")
-                    .replace('""', '"')
-                )
-            else:
-                log.debug(f"Bad line {_line}")
-
-        # collecting line ids for each conversation
-        conv = []
-        for line in conv_lines[:-1]:
-            _line = line[:-1].split("\t")[-1][1:-1].replace("'", "").replace(" ", ",")
-            conv.append(_line.split(","))
+        lookup = LineLookup(self.data_directory / "movie_lines.sqlite3")
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor, lookup.build, self.data_directory / dialogue_file
+        )
 
-        # conversations = csv.reader(conv_tsv, delimiter="\t")
-        #
-        # reader = csv.reader(lines_tsv, delimiter="\t")
-        #
-        #
-        #
-        # lines_dict = {}
-        # for row in reader:
-        #     try:
-        #         lines_dict[row[0].strip('"')] = row[4]
-        #     except:
-        #         log.exception(f"Bad line: {row}")
-        #         pass
-        #     else:
-        #         # log.info(f"Good line: {row}")
-        #         pass
-        #
-        # # lines_dict = {row[0].strip('"'): row[4] for row in reader_list}
-
-        statements_from_file = []
-        save_every = 300
-        count = 0
-
-        # [characterID of first, characterID of second, movieID, list of utterances]
-        async for lines in AsyncIter(conv):
-            previous_statement_text = None
-            previous_statement_search_text = ""
-
-            for line in lines:
-                text = lines_dict[line]
-                statement = Statement(
-                    text=text,
-                    in_response_to=previous_statement_text,
-                    conversation="training",
+        with lookup:
+            with open(
+                self.data_directory / conversation_file, "r", encoding="utf-8-sig"
+            ) as conv_tsv:
+                # ParallelTrainer pulls these in an executor, lookups and all
+                conversations = (
+                    [(text, None) for text in lookup.get_many(line_ids)]
+                    for line_ids in _iter_movie_conversations(conv_tsv)
                 )
 
-                for preprocessor in self.chatbot.preprocessors:
-                    statement = preprocessor(statement)
-
-                statement.search_text = tagger.get_text_index_string(statement.text)
-                statement.search_in_response_to = previous_statement_search_text
-
-                previous_statement_text = statement.text
-                previous_statement_search_text = statement.search_text
-
-                statements_from_file.append(statement)
-
-            count += 1
-            if count >= save_every:
-                if statements_from_file:
-                    self.chatbot.storage.create_many(statements_from_file)
-                    statements_from_file = []
-                count = 0
-
-        if statements_from_file:
-            self.chatbot.storage.create_many(statements_from_file)
+                await self.train_conversations(conversations, conversation_file)
 
         log.info(f"Training took {time.time() - start_time} seconds.")
 
@@ -211,6 +437,16 @@ class MovieTrainer(KaggleTrainer):
         #     await self.run_dialogue_training(extracted_dir, "dialogueText_301.csv")
 
 
+def _iter_ubuntu_dialogues(dg):
+    """Yields the (text, from) rows of each dialogue in a dialogueText csv"""
+    reader = csv.DictReader(dg)
+
+    next(reader)  # Skip the header
+
+    for dialogue_id, rows in itertools.groupby(reader, key=itemgetter("dialogueID")):
+        yield [(row["text"], row["from"]) for row in rows]
+
+
 class UbuntuCorpusTrainer2(KaggleTrainer):
     def __init__(self, chatbot, datapath: pathlib.Path, **kwargs):
         super().__init__(
@@ -251,56 +487,8 @@ class UbuntuCorpusTrainer2(KaggleTrainer):
         log.info(f"Beginning dialogue training on {dialogue_file}")
         start_time = time.time()
 
-        tagger = PosLemmaTagger(language=self.chatbot.storage.tagger.language)
-
         with open(extracted_dir / dialogue_file, "r", encoding="utf-8") as dg:
-            reader = csv.DictReader(dg)
-
-            next(reader)  # Skip the header
-
-            last_dialogue_id = None
-            previous_statement_text = None
-            previous_statement_search_text = ""
-            statements_from_file = []
-
-            save_every = 50
-            count = 0
-
-            async for row in AsyncIter(reader):
-                dialogue_id = row["dialogueID"]
-                if dialogue_id != last_dialogue_id:
-                    previous_statement_text = None
-                    previous_statement_search_text = ""
-                    last_dialogue_id = dialogue_id
-                    count += 1
-                    if count >= save_every:
-                        if statements_from_file:
-                            self.chatbot.storage.create_many(statements_from_file)
-                            statements_from_file = []
-                        count = 0
-
-                if len(row) > 0:
-                    statement = Statement(
-                        text=row["text"],
-                        in_response_to=previous_statement_text,
-                        conversation="training",
-                        # created_at=date_parser.parse(row["date"]),
-                        persona=row["from"],
-                    )
-
-                    for preprocessor in self.chatbot.preprocessors:
-                        statement = preprocessor(statement)
-
-                    statement.search_text = tagger.get_text_index_string(statement.text)
-                    statement.search_in_response_to = previous_statement_search_text
-
-                    previous_statement_text = statement.text
-                    previous_statement_search_text = statement.search_text
-
-                    statements_from_file.append(statement)
-
-            if statements_from_file:
-                self.chatbot.storage.create_many(statements_from_file)
+            await self.train_conversations(_iter_ubuntu_dialogues(dg), dialogue_file)
 
         log.info(f"Training took {time.time() - start_time} seconds.")
 
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import pathlib
+import threading
+from typing import Sequence, Tuple
+
+import numpy as np
+from chatterbot.comparisons import Comparator
+
+from chatter.models import get_model
+
+log = logging.getLogger("red.fox_v3.chatter.vectors")
+
+
+def embed_texts(nlp, texts: Sequence[str], batch_size=256) -> np.ndarray:
+    """Returns one float32 document vector per text"""
+    return np.array(
+        [doc.vector for doc in nlp.pipe(texts, batch_size=batch_size)], dtype=np.float32
+    )
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1  # Empty vectors stay zero and score 0 against everything
+    return vectors / norms
+
+
+class VectorStore:
+    """
+    Memory-mapped matrix of normalized statement vectors, one row per statement id
+
+    Rows that were never written are all zeros.
+    The id of the last embedded statement lives in a json file next to the matrix.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.meta_path = path.with_suffix(".json")
+        self.lock = threading.RLock()
+
+        self.last_id = 0
+        self._matrix = None
+
+        if self.path.exists() and self.meta_path.exists():
+            self._matrix = np.load(self.path, mmap_mode="r+")
+            with self.meta_path.open() as f:
+                self.last_id = json.load(f)["last_id"]
+
+    def __len__(self):
+        return self.last_id
+
+    def _save_meta(self):
+        with self.meta_path.open("w") as f:
+            json.dump({"last_id": self.last_id}, f)
+
+    def _reserve(self, max_id: int, dim: int):
+        rows = max_id + 1  # Row 0 is never used, ids start at 1
+        if self._matrix is None:
+            self._matrix = np.lib.format.open_memmap(
+                self.path, mode="w+", dtype=np.float32, shape=(max(rows, 1024), dim)
+            )
+            return
+
+        if rows <= self._matrix.shape[0]:
+            return
+
+        # Grow by doubling, copy into a new file and swap it in
+        tmp_path = self.path.with_suffix(".tmp.npy")
+        grown = np.lib.format.open_memmap(
+            tmp_path,
+            mode="w+",
+            dtype=np.float32,
+            shape=(max(rows, self._matrix.shape[0] * 2), self._matrix.shape[1]),
+        )
+        grown[: self._matrix.shape[0]] = self._matrix
+        grown.flush()
+        del grown
+        self._matrix = None  # Close the old map before replacing the file
+        os.replace(tmp_path, self.path)
+        self._matrix = np.load(self.path, mmap_mode="r+")
+
+    def write(self, statement_ids: Sequence[int], vectors: np.ndarray):
+        if not len(statement_ids):
+            return
+        with self.lock:
+            self._reserve(max(statement_ids), vectors.shape[1])
+            self._matrix[np.asarray(statement_ids)] = normalize(vectors)
+            self._matrix.flush()
+            self.last_id = max(self.last_id, max(statement_ids))
+            self._save_meta()
+
+    def erase(self, statement_ids: Sequence[int]):
+        """Zeroes the rows of deleted statements so they never score"""
+        with self.lock:
+            if self._matrix is None:
+                return
+            ids = np.asarray(statement_ids)
+            self._matrix[ids[ids < self._matrix.shape[0]]] = 0
+            self._matrix.flush()
+
+    def rewind(self, last_id: int):
+        """Embeds ids after `last_id` again on the next sync, for when sqlite hands them out again"""
+        with self.lock:
+            if last_id < self.last_id:
+                self.last_id = last_id
+                self._save_meta()
+
+    def clear(self):
+        with self.lock:
+            self._matrix = None
+            self.last_id = 0
+            for path in (self.path, self.meta_path):
+                if path.exists():
+                    os.remove(path)
+
+    def most_similar(self, vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the ids and scores of the `k` closest statements, in increasing order of score
+        """
+        with self.lock:
+            if self._matrix is None or not self.last_id:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+            query = normalize(vector.astype(np.float32))
+            scores = self._matrix[: self.last_id + 1] @ query
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[scores[top] > 0]
+        top = top[np.argsort(scores[top], kind="stable")]
+        return top, scores[top]
+
+
+class VectorSimilarity(Comparator):
+    """
+    Cosine similarity of spaCy document vectors
+
+    Searching is done by VectorSearch against precomputed vectors,
+    this is only used when two statements are compared directly.
+    """
+
+    search_algorithm_name = "chatter_vector_search"
+
+    @property
+    def nlp(self):
+        return get_model(self.language.ISO_639_1)
+
+    def compare(self, statement_a, statement_b):
+        vectors = normalize(embed_texts(self.nlp, [statement_a.text, statement_b.text]))
+        return float(vectors[0] @ vectors[1])
@@ -0,0 +1,216 @@
+"""
+Benchmarks Regioner against the pixel by pixel flood fill it replaced
+
+Runs both on each bundled map's blank image, checks labels.png has the same
+regions as the old masks, and the same numbers.png and mask_centers, and times them.
+Then times taking regions by combining mask files against a single label map lookup.
+
+    python -m conquest.benchmark --maps simple ck2 HoI --output bench.json
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
+
+from .regioner import Regioner, floodfill, get_center, label_regions
+
+ASSETS = pathlib.Path(__file__).parent / "data" / "assets"
+
+
+class FloodfillRegioner(Regioner):
+    """Regioner.execute as it was, one getpixel, floodfill and mask at a time"""
+
+    def execute(self):
+        base_img_path = self.filepath / self.filename
+        if not base_img_path.exists():
+            return None
+
+        masks_path = self.filepath / "masks"
+
+        if not masks_path.exists():
+            os.makedirs(masks_path)
+
+        black = ImageColor.getcolor("black", "L")
+
+        base_img: Image.Image = Image.open(base_img_path).convert("L")
+        already_processed = set()
+
+        mask_count = 0
+        mask_centers = {}
+
+        for y1 in range(base_img.height):
+            for x1 in range(base_img.width):
+                if (x1, y1) in already_processed:
+                    continue
+                if base_img.getpixel((x1, y1)) == self.region_color:
+                    filled = floodfill(base_img, (x1, y1), black, self.wall_color)
+                    if filled:  # Pixels were updated, make them into a mask
+                        mask = Image.new("L", base_img.size, 255)
+                        for x2, y2 in filled:
+                            mask.putpixel((x2, y2), 0)
+
+                        mask_count += 1
+                        mask = mask.convert("L")
+                        mask.save(masks_path / f"{mask_count}.png", "PNG")
+
+                        mask_centers[mask_count] = get_center(filled)
+
+                        already_processed.update(filled)
+
+        number_img = Image.new("L", base_img.size, 255)
+        fnt = ImageFont.load_default()
+        d = ImageDraw.Draw(number_img)
+        for mask_num, center in mask_centers.items():
+            d.text(center, str(mask_num), font=fnt, fill=0)
+
+        number_img.save(self.filepath / f"numbers.png", "PNG")
+
+        return mask_centers
+
+
+def blank_image(map_name) -> pathlib.Path:
+    return next((ASSETS / map_name).glob("blank.*"))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def same_image(a: pathlib.Path, b: pathlib.Path) -> bool:
+    return np.array_equal(np.asarray(Image.open(a)), np.asarray(Image.open(b)))
+
+
+def differences(new_path: pathlib.Path, old_path: pathlib.Path, new_centers, old_centers):
+    """Everything the two runs disagree on"""
+    found = []
+    if new_centers != old_centers:
+        found.append(f"mask_centers: {len(new_centers)} vs {len(old_centers)} regions")
+    if not same_image(new_path / "numbers.png", old_path / "numbers.png"):
+        found.append("numbers.png")
+    labels = np.asarray(Image.open(new_path / "labels.png"))
+    for n in old_centers:
+        old_mask = np.asarray(Image.open(old_path / "masks" / f"{n}.png")) == 0
+        if not np.array_equal(labels == n, old_mask):
+            found.append(f"masks/{n}.png")
+    return found
+
+
+def composite_masks(im, masks_path: pathlib.Path, regions, color) -> Image.Image:
+    """Conquest._composite_regions with one mask file per region"""
+    combined_mask = None
+    for region in regions:
+        mask = Image.open(masks_path / f"{region}.png").convert("L")
+        combined_mask = mask if combined_mask is None else ImageChops.multiply(combined_mask, mask)
+    return Image.composite(im, Image.new("RGB", im.size, color), combined_mask)
+
+
+def composite_labels(im, labels: np.ndarray, regions, color) -> Image.Image:
+    """Conquest._composite_regions with a label map"""
+    mask = Image.fromarray(np.where(np.isin(labels, regions), 0, 255).astype(np.uint8))
+    return Image.composite(im, Image.new("RGB", im.size, color), mask)
+
+
+def bench_composite(labels: np.ndarray, counts, masks_path: pathlib.Path):
+    """Seconds to take the first `count` regions each way, for each of `counts`"""
+    im = Image.new("RGB", (labels.shape[1], labels.shape[0]), "white")
+    mask = np.full(labels.shape, 255, dtype=np.uint8)
+    for n in range(1, max(counts) + 1):  # The masks Regioner used to write
+        Image.fromarray(np.where(labels == n, 0, mask)).save(masks_path / f"{n}.png", "PNG")
+
+    results = {}
+    for count in counts:
+        regions = list(range(1, count + 1))
+        masks_out, masks_seconds = timed(composite_masks, im, masks_path, regions, "red")
+        labels_out, labels_seconds = timed(composite_labels, im, labels, regions, "red")
+        if not np.array_equal(np.asarray(masks_out), np.asarray(labels_out)):
+            raise AssertionError(f"Taking {count} regions gave different maps")
+        results[count] = {"masks_seconds": masks_seconds, "labels_seconds": labels_seconds}
+    return results
+
+
+def bench_map(map_name, args):
+    blank = blank_image(map_name)
+    base_img = Image.open(blank).convert("L")
+    region_color = ImageColor.getcolor("white", "L")
+    wall_color = ImageColor.getcolor("black", "L")
+
+    (labels, count), label_seconds = timed(
+        label_regions, np.asarray(base_img), region_color, wall_color
+    )
+    result = {
+        "map": map_name,
+        "size": list(base_img.size),
+        "regions": count,
+        "label_seconds": label_seconds,
+    }
+
+    with tempfile.TemporaryDirectory() as new_dir, tempfile.TemporaryDirectory() as old_dir:
+        new_path, old_path = pathlib.Path(new_dir), pathlib.Path(old_dir)
+        shutil.copy(blank, new_path / blank.name)
+        new_centers, result["execute_seconds"] = timed(Regioner(new_path, blank.name).execute)
+
+        if not args.skip_floodfill:
+            shutil.copy(blank, old_path / blank.name)
+            old_centers, result["floodfill_seconds"] = timed(
+                FloodfillRegioner(old_path, blank.name).execute
+            )
+            result["differences"] = differences(new_path, old_path, new_centers, old_centers)
+
+        counts = [c for c in args.take_counts if c <= count]
+        if counts:
+            os.makedirs(old_path / "composite")
+            result["take"] = bench_composite(
+                np.asarray(Image.open(new_path / "labels.png")), counts, old_path / "composite"
+            )
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--maps", nargs="+", default=json.loads((ASSETS / "maps.json").read_text())["maps"]
+    )
+    parser.add_argument(
+        "--skip-floodfill", action="store_true", help="Only time Regioner, takes minutes on HoI"
+    )
+    parser.add_argument("--take-counts", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--output", default=None, help="Defaults to stdout")
+    args = parser.parse_args()
+
+    results = []
+    for map_name in args.maps:
+        result = bench_map(map_name, args)
+        results.append(result)
+        line = (
+            f"{map_name:>6} {result['size'][0]}x{result['size'][1]}, {result['regions']} regions: "
+            f"label {result['label_seconds']:.3f}s, execute {result['execute_seconds']:.3f}s"
+        )
+        if "floodfill_seconds" in result:
+            line += (
+                f", floodfill execute {result['floodfill_seconds']:.3f}s, "
+                f"{'same output' if not result['differences'] else result['differences']}"
+            )
+        print(line)
+        for take_count, take in result.get("take", {}).items():
+            print(
+                f"{'':>6} take {take_count:>4} regions: masks {take['masks_seconds']:.3f}s, "
+                f"label map {take['labels_seconds']:.3f}s"
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
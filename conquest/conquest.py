@@ -8,6 +8,7 @@ from shutil import copyfile
 from typing import Optional
 
 import discord
+import numpy as np
 from PIL import Image, ImageChops, ImageColor, ImageOps
 from discord.ext.commands import Greedy
 from redbot.core import Config, commands
@@ -43,6 +44,7 @@ class Conquest(commands.Cog):
         self.map_data = None
         self.ext = None
         self.ext_format = None
+        self.labels: Optional[np.ndarray] = None
 
     async def red_delete_data_for_user(self, **kwargs):
         """Nothing to delete"""
@@ -69,8 +71,33 @@ class Conquest(commands.Cog):
             self.map_data: dict = json.load(mapdata)
         self.ext = self.map_data["extension"]
         self.ext_format = "JPEG" if self.ext.upper() == "JPG" else self.ext.upper()
+
+        loop = asyncio.get_running_loop()
+        self.labels = await loop.run_in_executor(None, self._load_labels)
         return True
 
+    def _load_labels(self) -> Optional[np.ndarray]:
+        """
+        Memory maps the current map's region numbers, if it has a labels.png
+
+        The PNG is converted to a .npy once, maps without one use their masks folder
+        """
+        labels_png = self.asset_path / self.current_map / "labels.png"
+        if not labels_png.exists():
+            return None
+
+        labels_npy = self.data_path / self.current_map / "labels.npy"
+        if not labels_npy.exists() or labels_npy.stat().st_mtime < labels_png.stat().st_mtime:
+            if not labels_npy.parent.exists():
+                os.makedirs(labels_npy.parent)
+            # self.labels may still be mapped from the old file, so don't write over it
+            temp_npy = labels_npy.with_suffix(".npy.tmp")
+            with temp_npy.open("wb") as f:
+                np.save(f, np.asarray(Image.open(labels_png)).astype(np.uint16))
+            os.replace(temp_npy, labels_npy)
+
+        return np.load(labels_npy, mmap_mode="r")
+
     @commands.group()
     async def conquest(self, ctx: commands.Context):
         """
@@ -405,19 +432,26 @@ class Conquest(commands.Cog):
 
         loop = asyncio.get_running_loop()
 
-        combined_mask = None
-        for region in regions:
-            mask = Image.open(
-                self.asset_path / self.current_map / "masks" / f"{region}.{self.ext}"
-            ).convert("L")
-            if combined_mask is None:
-                combined_mask = mask
-            else:
-                # combined_mask = ImageChops.logical_or(combined_mask, mask)
-                combined_mask = await loop.run_in_executor(
-                    None, ImageChops.multiply, combined_mask, mask
-                )
+        if self.labels is not None:
+            combined_mask = await loop.run_in_executor(None, self._labels_mask, regions)
+        else:
+            combined_mask = None
+            for region in regions:
+                mask = Image.open(
+                    self.asset_path / self.current_map / "masks" / f"{region}.{self.ext}"
+                ).convert("L")
+                if combined_mask is None:
+                    combined_mask = mask
+                else:
+                    # combined_mask = ImageChops.logical_or(combined_mask, mask)
+                    combined_mask = await loop.run_in_executor(
+                        None, ImageChops.multiply, combined_mask, mask
+                    )
 
         out = await loop.run_in_executor(None, Image.composite, im, im2, combined_mask)
 
         return out
+
+    def _labels_mask(self, regions) -> Image.Image:
+        """Black where any of `regions` are, like their masks multiplied together"""
+        return Image.fromarray(np.where(np.isin(self.labels, regions), 0, 255).astype(np.uint8))
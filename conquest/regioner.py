@@ -1,5 +1,7 @@
-import os
 import pathlib
+from typing import Dict, Tuple
+
+import numpy as np
 from PIL import Image, ImageColor, ImageFont, ImageOps, ImageDraw
 from PIL.ImageDraw import _color_diff
 
@@ -74,6 +76,77 @@ def floodfill(image, xy, value, border=None, thresh=0) -> set:
     return filled_pixels
 
 
+def label_regions(pixels: np.ndarray, region_color, wall_color) -> Tuple[np.ndarray, int]:
+    """
+    Numbers every region in a greyscale image array, in one pass
+
+    A region is the 4-connected pixels that aren't black or `wall_color`
+    around at least one `region_color` pixel, like `floodfill` fills them.
+    Regions are numbered from 1 in the order their first `region_color` pixel is read,
+    left to right then top to bottom. Pixels in no region are 0.
+
+    Rows are split into runs of fillable pixels, runs that touch vertically are joined
+    with a union-find over whole arrays, then each run gets its region's number.
+
+    :return: The array of region numbers and how many regions there are
+    """
+    black = ImageColor.getcolor("black", "L")
+    fillable = (pixels != black) & (pixels != wall_color)
+
+    starts = fillable.copy()
+    starts[:, 1:] &= ~fillable[:, :-1]
+    run_ids = np.cumsum(starts, dtype=np.int32).reshape(pixels.shape) - 1
+    run_count = int(run_ids[-1, -1]) + 1 if run_ids.size else 0
+    if not run_count:
+        return np.zeros(pixels.shape, dtype=np.uint16), 0
+
+    # One join for each pair of touching runs, where they start to touch
+    touching = fillable[:-1] & fillable[1:]
+    repeated = np.zeros_like(touching)
+    repeated[:, 1:] = touching[:, :-1] & ~starts[:-1, 1:] & ~starts[1:, 1:]
+    joins = touching & ~repeated
+    upper = run_ids[:-1][joins]
+    lower = run_ids[1:][joins]
+
+    parent = np.arange(run_count, dtype=np.int32)
+    while upper.size:
+        a, b = parent[upper], parent[lower]
+        apart = a != b
+        if not apart.any():
+            break
+        upper, lower, a, b = upper[apart], lower[apart], a[apart], b[apart]
+        np.minimum.at(parent, np.maximum(a, b), np.minimum(a, b))  # Always toward lower ids
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    roots = parent[run_ids]
+    seeds = np.flatnonzero(fillable & (pixels == region_color))
+    seed_roots, first_seen = np.unique(roots.ravel()[seeds], return_index=True)
+    region_roots = seed_roots[np.argsort(first_seen)]
+    count = len(region_roots)
+
+    number_of_root = np.zeros(run_count, dtype=np.uint16 if count <= 0xFFFF else np.uint32)
+    number_of_root[region_roots] = np.arange(1, count + 1)
+    labels = np.where(fillable, number_of_root[roots], 0).astype(number_of_root.dtype)
+    return labels, count
+
+
+def region_centers(labels: np.ndarray, count: int) -> Dict[int, Tuple[float, float]]:
+    """The mean x and y of each region's pixels, same as `get_center`"""
+    indexes = np.flatnonzero(labels)
+    numbers = labels.ravel()[indexes]
+    y, x = np.divmod(indexes, labels.shape[1])
+    sizes = np.bincount(numbers, minlength=count + 1)
+    sum_x = np.bincount(numbers, weights=x, minlength=count + 1)
+    sum_y = np.bincount(numbers, weights=y, minlength=count + 1)
+    return {
+        n: (float(sum_x[n] / sizes[n]), float(sum_y[n] / sizes[n])) for n in range(1, count + 1)
+    }
+
+
 class Regioner:
     def __init__(
         self,
@@ -92,38 +165,16 @@ class Regioner:
         if not base_img_path.exists():
             return None
 
-        masks_path = self.filepath / "masks"
-
-        if not masks_path.exists():
-            os.makedirs(masks_path)
-
-        black = ImageColor.getcolor("black", "L")
-        white = ImageColor.getcolor("white", "L")
-
         base_img: Image.Image = Image.open(base_img_path).convert("L")
-        already_processed = set()
-
-        mask_count = 0
-        mask_centers = {}
-
-        for y1 in range(base_img.height):
-            for x1 in range(base_img.width):
-                if (x1, y1) in already_processed:
-                    continue
-                if base_img.getpixel((x1, y1)) == self.region_color:
-                    filled = floodfill(base_img, (x1, y1), black, self.wall_color)
-                    if filled:  # Pixels were updated, make them into a mask
-                        mask = Image.new("L", base_img.size, 255)
-                        for x2, y2 in filled:
-                            mask.putpixel((x2, y2), 0)
-
-                        mask_count += 1
-                        mask = mask.convert("L")
-                        mask.save(masks_path / f"{mask_count}.png", "PNG")
-
-                        mask_centers[mask_count] = get_center(filled)
-
-                        already_processed.update(filled)
+        labels, mask_count = label_regions(
+            np.asarray(base_img), self.region_color, self.wall_color
+        )
+        if mask_count > 0xFFFF:
+            raise ValueError(f"Found {mask_count} regions, a label map holds at most 65535")
+        mask_centers = region_centers(labels, mask_count)
+
+        # Every region in one 16-bit image, pixel values are region numbers
+        Image.fromarray(labels.astype(np.uint16)).save(self.filepath / "labels.png", "PNG")
 
         number_img = Image.new("L", base_img.size, 255)
         fnt = ImageFont.load_default()
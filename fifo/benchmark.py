@@ -0,0 +1,243 @@
+"""
+Benchmarks HeapJobStore against APScheduler's MemoryJobStore
+
+Times loading every job, rescheduling jobs and the scheduler's
+get_due_jobs / update_job / get_next_run_time loop at each size.
+Also compares jobcodec with the old pickle+base64 encoding, by size and speed.
+
+    python -m fifo.benchmark --sizes 10000 50000 100000 --output bench.json
+"""
+
+import argparse
+import base64
+import json
+import pickle
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytz
+from apscheduler.job import Job
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.triggers.combining import OrTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.util import datetime_to_utc_timestamp
+
+from .date_trigger import CustomDateTrigger
+from .heapjobstore import HeapJobStore
+from .jobcodec import decode_job_state, decode_pickled_job_state, encode_job
+
+
+class FakeJob:
+    """The job stores only look at id and next_run_time"""
+
+    __slots__ = ("id", "next_run_time")
+
+    def __init__(self, job_id, next_run_time):
+        self.id = job_id
+        self.next_run_time = next_run_time
+
+
+def make_jobs(count, start, seed=0):
+    rng = random.Random(seed)
+    return [
+        FakeJob(
+            f"task{i}_{rng.randint(1, 1000)}", start + timedelta(seconds=rng.randint(0, 86400))
+        )
+        for i in range(count)
+    ]
+
+
+def load_memory(jobs):
+    """How RedConfigJobStore used to load, one sorted insert at a time"""
+    store = MemoryJobStore()
+    for job in jobs:
+        store.add_job(job)
+    return store
+
+
+def load_heap(jobs):
+    store = HeapJobStore()
+    store.bulk_load((job, datetime_to_utc_timestamp(job.next_run_time)) for job in jobs)
+    return store
+
+
+def timed(func, *args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+
+def reschedule(store, jobs, count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        job = rng.choice(jobs)
+        job.next_run_time += timedelta(seconds=rng.randint(1, 3600))
+        store.update_job(job)
+
+
+def run_scheduler(store, start, ticks, tick_seconds):
+    """What the scheduler does each wakeup: run what's due, reschedule it, find the next wakeup"""
+    now = start
+    for _ in range(ticks):
+        now += timedelta(seconds=tick_seconds)
+        for job in store.get_due_jobs(now):
+            job.next_run_time += timedelta(hours=24)
+            store.update_job(job)
+        store.get_next_run_time()
+
+
+def bench_store(name, load, size, args):
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+    jobs = make_jobs(size, start, args.seed)
+    store, load_seconds = timed(load, jobs)
+    _, reschedule_seconds = timed(reschedule, store, jobs, args.reschedules, args.seed)
+
+    jobs = make_jobs(size, start, args.seed)  # Fresh times for the scheduler loop
+    store = load(jobs)
+    _, scheduler_seconds = timed(run_scheduler, store, start, args.ticks, 86400 / args.ticks)
+
+    return {
+        "store": name,
+        "jobs": size,
+        "load_seconds": load_seconds,
+        "reschedules": args.reschedules,
+        "reschedule_seconds": reschedule_seconds,
+        "scheduler_ticks": args.ticks,
+        "scheduler_seconds": scheduler_seconds,
+    }
+
+
+async def noop_task(**task_state):
+    """Stands in for fifo.fifo._execute_task, which needs discord to import"""
+
+
+def make_trigger(rng, start):
+    kind = rng.randrange(4)
+    tz = pytz.timezone(rng.choice(["UTC", "America/New_York", "Europe/Berlin", "Asia/Tokyo"]))
+    if kind == 0:
+        return IntervalTrigger(seconds=rng.randint(60, 86400), start_date=start, timezone=tz)
+    if kind == 1:
+        return CronTrigger.from_crontab(f"{rng.randint(0, 59)} {rng.randint(0, 23)} * * *", tz)
+    if kind == 2:
+        return CustomDateTrigger(start + timedelta(seconds=rng.randint(0, 86400)), timezone=tz)
+    return OrTrigger(
+        [
+            CronTrigger.from_crontab(f"*/{rng.randint(2, 30)} * * * mon-fri", tz),
+            CustomDateTrigger(start + timedelta(days=rng.randint(1, 30)), timezone=tz),
+        ]
+    )
+
+
+def make_real_jobs(count, start, seed=0):
+    """Jobs shaped like the ones FIFO._add_job makes"""
+    rng = random.Random(seed)
+    jobs = []
+    for i in range(count):
+        name = f"task{i}"
+        guild_id = rng.randint(10**17, 10**18)
+        trigger = make_trigger(rng, start)
+        job = Job.__new__(Job)
+        job.__setstate__(
+            {
+                "version": 1,
+                "id": f"{name}_{guild_id}",
+                "func": f"{__name__}:noop_task",
+                "trigger": trigger,
+                "executor": "default",
+                "args": (),
+                "kwargs": {"name": name, "guild_id": guild_id, "config": None, "bot": None},
+                "name": name,
+                "misfire_grace_time": 1,
+                "coalesce": True,
+                "max_instances": 1,
+                "next_run_time": trigger.get_next_fire_time(None, start),
+            }
+        )
+        jobs.append(job)
+    return jobs
+
+
+def encode_pickled(job):
+    """How RedConfigJobStore saved jobs before jobcodec"""
+    job_state = job.__getstate__()
+    return {
+        "_id": job.id,
+        "next_run_time": datetime_to_utc_timestamp(job.next_run_time),
+        "job_state": base64.b64encode(pickle.dumps(job_state, pickle.HIGHEST_PROTOCOL)).decode(
+            "ascii"
+        ),
+    }
+
+
+def decode_job(job_state):
+    job = Job.__new__(Job)
+    job.__setstate__(job_state)
+    return job
+
+
+def bench_codec(size, args):
+    """Config saves each encoded job as JSON, so that's the size that counts"""
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    jobs = make_real_jobs(size, start, args.seed)
+
+    results = []
+    for name, encode, decode_state in (
+        ("pickle", encode_pickled, decode_pickled_job_state),
+        ("jobcodec", encode_job, decode_job_state),
+    ):
+        encoded, encode_seconds = timed(lambda: [encode(job) for job in jobs])
+        saved, dump_seconds = timed(lambda: [json.dumps(data) for data in encoded])
+        loaded, load_seconds = timed(lambda: [json.loads(text) for text in saved])
+        _, decode_seconds = timed(lambda: [decode_job(decode_state(data)) for data in loaded])
+        results.append(
+            {
+                "codec": name,
+                "jobs": size,
+                "mean_bytes": sum(map(len, saved)) / size,
+                "encode_seconds": encode_seconds + dump_seconds,
+                "decode_seconds": load_seconds + decode_seconds,
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--reschedules", type=int, default=10000)
+    parser.add_argument("--ticks", type=int, default=1000, help="Scheduler wakeups over a day")
+    parser.add_argument("--codec-jobs", type=int, default=10000, help="0 to skip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Defaults to stdout")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for name, load in (("memory", load_memory), ("heap", load_heap)):
+            result = bench_store(name, load, size, args)
+            results.append(result)
+            print(
+                f"{name:>6} {size:>7} jobs: load {result['load_seconds']:.3f}s, "
+                f"reschedule {result['reschedule_seconds']:.3f}s, "
+                f"scheduler {result['scheduler_seconds']:.3f}s"
+            )
+
+    if args.codec_jobs:
+        for result in bench_codec(args.codec_jobs, args):
+            results.append(result)
+            print(
+                f"{result['codec']:>8} {result['jobs']:>7} jobs: "
+                f"{result['mean_bytes']:.0f} bytes/job, "
+                f"encode {result['encode_seconds']:.3f}s, decode {result['decode_seconds']:.3f}s"
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+log = logging.getLogger("red.fox_v3.fifo.catchup")
+
+SKIP = "skip"  # Drop every missed run
+ONCE = "once"  # Run once for all of them
+ALL = "all"  # Run each missed run, up to `limit`
+SPREAD = "spread"  # Like ALL, `spacing` seconds apart
+POLICIES = (SKIP, ONCE, ALL, SPREAD)
+
+MAX_ITERATIONS = 10000  # Stop counting missed runs of triggers that can't be skipped ahead
+
+
+class CatchUpPolicy:
+    """What to do with a task's runs that were missed while the bot was down"""
+
+    def __init__(self, policy=SKIP, limit=10, spacing=60.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown catch-up policy {policy!r}")
+        self.policy = policy
+        self.limit = limit
+        self.spacing = spacing
+
+    @classmethod
+    def from_data(cls, data: Optional[Dict]) -> "CatchUpPolicy":
+        if not data:
+            return cls()
+        return cls(**data)
+
+    def to_data(self) -> Dict:
+        return {"policy": self.policy, "limit": self.limit, "spacing": self.spacing}
+
+    def __str__(self):
+        if self.policy == ALL:
+            return f"run up to {self.limit} missed runs"
+        if self.policy == SPREAD:
+            return f"run up to {self.limit} missed runs, {self.spacing:g} seconds apart"
+        if self.policy == ONCE:
+            return "run once"
+        return "skip missed runs"
+
+    def keep(self) -> int:
+        """How many of the most recent missed runs plan() needs"""
+        return {SKIP: 0, ONCE: 1}.get(self.policy, self.limit)
+
+    def plan(self, missed: List[datetime]) -> List[Tuple[float, datetime]]:
+        """(seconds from now, scheduled time) for each run to make up"""
+        if self.policy == SKIP or not missed:
+            return []
+        if self.policy == ONCE:
+            return [(0.0, missed[-1])]
+
+        missed = missed[-self.limit :]
+        spacing = self.spacing if self.policy == SPREAD else 0.0
+        return [(i * spacing, scheduled) for i, scheduled in enumerate(missed)]
+
+
+def missed_fire_times(
+    trigger: BaseTrigger, first: datetime, now: datetime, keep: int
+) -> Tuple[int, List[datetime]]:
+    """
+    How many fire times there were from `first` to `now`, and the last `keep` of them
+
+    Interval triggers are counted without stepping through every fire time,
+    other triggers stop counting after MAX_ITERATIONS.
+    """
+    if first > now:
+        return 0, []
+
+    if isinstance(trigger, IntervalTrigger) and trigger.end_date is None:
+        count = int((now - first) / trigger.interval) + 1
+        start = max(count - keep, 0)
+        return count, [first + trigger.interval * i for i in range(start, count)]
+
+    count = 0
+    latest = deque(maxlen=max(keep, 1))
+    fire_time = first
+    while fire_time is not None and fire_time <= now and count < MAX_ITERATIONS:
+        count += 1
+        latest.append(fire_time)
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time)
+    return count, list(latest)[-keep:] if keep else []
+
+
+class CatchUpQueue:
+    """
+    Makes up missed runs in the background, starting at most one every `interval` seconds
+
+    Runs still go through the ExecutionLimiter once they start.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[Dict, datetime], Awaitable],
+        interval=1.0,
+    ):
+        self.run = run
+        self.interval = interval
+        self.started = 0
+
+        self._heap: List[Tuple[float, int, Dict, datetime]] = []
+        self._sequence = itertools.count()
+        self._added = asyncio.Event()
+        self._consumer: Optional[asyncio.Task] = None
+        self._running = set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, delay: float, task_state: Dict, scheduled: datetime):
+        heapq.heappush(
+            self._heap, (time.monotonic() + delay, next(self._sequence), task_state, scheduled)
+        )
+        self._added.set()
+
+    def start(self):
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.create_task(self._consume())
+
+    def stop(self):
+        if self._consumer is not None:
+            self._consumer.cancel()
+        self._heap.clear()
+
+    async def _consume(self):
+        while True:
+            if not self._heap:
+                self._added.clear()
+                await self._added.wait()
+                continue
+
+            wait = self._heap[0][0] - time.monotonic()
+            if wait > 0:
+                self._added.clear()
+                try:  # Something due sooner may be added meanwhile
+                    await asyncio.wait_for(self._added.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, task_state, scheduled = heapq.heappop(self._heap)
+            self.started += 1
+            run = asyncio.create_task(self.run(task_state, scheduled))
+            self._running.add(run)  # Keeps a reference until it's done
+            run.add_done_callback(self._finished)
+            await asyncio.sleep(self.interval)
+
+    def _finished(self, run: asyncio.Task):
+        self._running.discard(run)
+        if not run.cancelled() and run.exception() is not None:
+            log.error("Catch-up run failed", exc_info=run.exception())
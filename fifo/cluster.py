@@ -0,0 +1,213 @@
+"""
+Splitting task executions between bot processes
+
+Guilds are split into partitions the same way Discord splits them into shards.
+Each process takes leases on the partitions of guilds it can see, in a SQLite file they share.
+Every process schedules every job, but only runs the ones in partitions it holds.
+A lease that isn't renewed expires after `ttl` seconds, then another process can take it.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+log = logging.getLogger("red.fox_v3.fifo.cluster")
+
+
+def partition_for(guild_id: int, partitions: int) -> int:
+    """Discord's shard formula, so partitions match shards when there are as many of them"""
+    return (guild_id >> 22) % partitions
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class SQLiteLeaseStore:
+    """
+    Leases on partitions, in a SQLite file every process can open
+
+    Each lease is taken or renewed in a single statement, so two processes can't both get it.
+    """
+
+    def __init__(self, path: str, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "partition INTEGER PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._connection = connection
+        return self._connection
+
+    def claim(self, owner: str, partitions: Iterable[int], ttl: float) -> Dict[int, float]:
+        """
+        Takes or renews the lease on each of `partitions` that's free, expired or already ours
+
+        Returns every partition `owner` holds, with when each lease expires.
+        """
+        connection = self._connect()
+        now = time.time()
+        expires = now + ttl
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO leases (partition, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (partition) DO UPDATE SET owner = excluded.owner, "
+                "expires = excluded.expires "
+                "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                [(partition, owner, expires, now) for partition in partitions],
+            )
+            held = dict(
+                connection.execute(
+                    "SELECT partition, expires FROM leases WHERE owner = ?", (owner,)
+                ).fetchall()
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return held
+
+    def release(self, owner: str, partitions: Optional[Iterable[int]] = None):
+        """Lets go of `partitions`, or all of them, so others don't wait for them to expire"""
+        connection = self._connect()
+        if partitions is None:
+            connection.execute("DELETE FROM leases WHERE owner = ?", (owner,))
+        else:
+            connection.executemany(
+                "DELETE FROM leases WHERE owner = ? AND partition = ?",
+                [(owner, partition) for partition in partitions],
+            )
+
+    def leases(self) -> Dict[int, Tuple[str, float]]:
+        """Partition -> (owner, expires) of every lease, including expired ones"""
+        rows = self._connect().execute("SELECT partition, owner, expires FROM leases")
+        return {partition: (owner, expires) for partition, owner, expires in rows}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class ClusterCoordinator:
+    """
+    Keeps the leases of the partitions this process wants, and says which guilds it runs
+
+    Until `start` is called there's no cluster, and this process runs every guild.
+    A lease only counts until it expires, even if renewing it failed,
+    so a process that stalls stops running a partition before anyone else can take it.
+    """
+
+    def __init__(self):
+        self.store: Optional[SQLiteLeaseStore] = None
+        self.node_id: Optional[str] = None
+        self.partitions = 1
+        self.ttl = 30.0
+        self.skipped = 0  # Executions left to the partition's owner
+
+        self._wanted: Optional[Callable[[], Iterable[int]]] = None
+        self._held: Dict[int, float] = {}  # Partition -> when our lease expires
+        self._renewer: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None
+
+    def partition(self, guild_id: int) -> int:
+        return partition_for(guild_id, self.partitions)
+
+    def owns(self, guild_id: int) -> bool:
+        """Whether this process should run `guild_id`'s tasks right now"""
+        if not self.enabled:
+            return True
+        return self._held.get(self.partition(guild_id), 0.0) > time.time()
+
+    def held(self) -> Set[int]:
+        now = time.time()
+        return {partition for partition, expires in self._held.items() if expires > now}
+
+    async def start(
+        self,
+        store: SQLiteLeaseStore,
+        partitions: int,
+        guild_ids: Callable[[], Iterable[int]],
+        ttl=30.0,
+        node_id: Optional[str] = None,
+    ):
+        """Takes the leases for `guild_ids`' partitions, then keeps renewing them"""
+        await self.stop()
+        self.store = store
+        self.partitions = partitions
+        self.ttl = ttl
+        self.node_id = node_id or default_node_id()
+        self._wanted = lambda: {self.partition(guild_id) for guild_id in guild_ids()}
+
+        try:
+            await self.renew()
+        except Exception:
+            await self.stop()
+            raise
+        self._renewer = asyncio.create_task(self._renew_forever())
+        log.info(f"Joined cluster as {self.node_id}, holding {len(self.held())} partitions")
+
+    async def stop(self):
+        """Releases every lease and goes back to running every guild"""
+        if self._renewer is not None:
+            self._renewer.cancel()
+            self._renewer = None
+        if self.store is not None:
+            store, self.store = self.store, None
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, store.release, self.node_id)
+            except sqlite3.Error:
+                log.exception("Failed to release leases, they'll expire instead")
+            store.close()
+        self._held.clear()
+
+    async def renew(self):
+        wanted = self._wanted()
+        held = await asyncio.get_running_loop().run_in_executor(
+            None, self.store.claim, self.node_id, wanted, self.ttl
+        )
+        gained = held.keys() - self.held()
+        lost = self.held() - held.keys()
+        if gained:
+            log.info(f"Now running partitions {sorted(gained)}")
+        if lost:
+            log.warning(f"Partitions {sorted(lost)} were taken over")
+
+        unwanted = held.keys() - wanted
+        if unwanted:  # No guilds we can see in them anymore
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.store.release, self.node_id, unwanted
+            )
+            held = {p: expires for p, expires in held.items() if p not in unwanted}
+        self._held = held
+
+    async def _renew_forever(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.renew()
+            except Exception:  # Giving up would quietly stop every task here
+                log.exception("Failed to renew leases, retrying")
+
+    async def leases(self) -> Dict[int, Tuple[str, float]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.store.leases)
+
+
+cluster = ClusterCoordinator()
@@ -1,12 +1,12 @@
 from datetime import datetime, tzinfo
 from typing import TYPE_CHECKING
 
-from apscheduler.triggers.cron import CronTrigger
 from dateutil import parser
 from discord.ext.commands import BadArgument, Converter
 from pytz import timezone
 
 from fifo.timezones import assemble_timezones
+from fifo.trigger_cache import crontab_fields
 
 if TYPE_CHECKING:
     DatetimeConverter = datetime
@@ -35,7 +35,7 @@ else:
     class CronConverter(Converter):
         async def convert(self, ctx, argument) -> str:
             try:
-                CronTrigger.from_crontab(argument)
+                crontab_fields(argument)
             except ValueError:
                 raise BadArgument()
 
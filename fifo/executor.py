@@ -0,0 +1,25 @@
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+from apscheduler.executors.asyncio import AsyncIOExecutor
+
+# The trigger time the running job was submitted for, None outside of the scheduler's runs
+scheduled_run_time: ContextVar[Optional[datetime]] = ContextVar("scheduled_run_time", default=None)
+
+
+class RunTimeExecutor(AsyncIOExecutor):
+    """
+    AsyncIOExecutor that tells each run which trigger time it's for, in `scheduled_run_time`
+
+    The time is set in the asyncio task that runs the job, so it belongs to that run alone.
+    FIFO's jobs coalesce, so each submission has a single run time.
+    When there's more than one they share a task, and no run gets a time.
+    """
+
+    def _do_submit_job(self, job, run_times):
+        token = scheduled_run_time.set(run_times[0] if len(run_times) == 1 else None)
+        try:
+            super()._do_submit_job(job, run_times)  # The task it makes copies our context
+        finally:
+            scheduled_run_time.reset(token)
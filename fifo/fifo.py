@@ -1,10 +1,22 @@
-import itertools
+import asyncio
+import functools
 import logging
-from datetime import MAXYEAR, datetime, timedelta, tzinfo
-from typing import Optional, Union
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, tzinfo
+from typing import Dict, Optional, Union
 
 import discord
 import pytz
+from apscheduler.events import (
+    EVENT_JOB_ERROR,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_MISSED,
+    JobExecutionEvent,
+    JobSubmissionEvent,
+)
 from apscheduler.job import Job
 from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -13,15 +25,21 @@ from apscheduler.util import localize
 from redbot.core import Config, checks, commands
 from redbot.core.bot import Red
 from redbot.core.commands import TimedeltaConverter
-from redbot.core.utils.chat_formatting import humanize_timedelta, pagify
+from redbot.core.utils.chat_formatting import box, humanize_timedelta, pagify
 from tzlocal import get_localzone
 
+from .catchup import POLICIES, SKIP, CatchUpPolicy, CatchUpQueue, missed_fire_times
+from .cluster import SQLiteLeaseStore, cluster
 from .datetime_cron_converters import (
     CronConverter,
     DatetimeConverter,
     TimezoneConverter,
 )
-from .task import Task
+from .executor import RunTimeExecutor, scheduled_run_time
+from .history import ERROR, FAILED, OK, SKIPPED, run_history
+from .limiter import RateLimited, execution_limiter
+from .task import ExecutionResult, Task, execution_contexts, task_repository
+from .trigger_cache import fire_times
 
 schedule_log = logging.getLogger("red.fox_v3.fifo.scheduler")
 schedule_log.setLevel(logging.DEBUG)
@@ -29,13 +47,70 @@ schedule_log.setLevel(logging.DEBUG)
 log = logging.getLogger("red.fox_v3.fifo")
 
 
+LEFT_TO_OWNER = "left to owner"  # _run_task's result when another process runs the guild
+
+# Held while a job runs, by the scheduler or catching up. One per job that ever ran
+_job_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
 async def _execute_task(**task_state):
+    return await _run_task(task_state, scheduled_run_time.get())
+
+
+async def _run_task(task_state, scheduled: Optional[datetime], wait_turn=False):
+    """
+    Runs a task for its trigger's `scheduled` time, the scheduler's runs and catch-up runs
+
+    Only one run of a job goes at a time. Catch-up runs bypass the scheduler's max_instances,
+    so they pass `wait_turn` and wait for the run before them, while scheduler runs are skipped.
+    """
+    if not cluster.owns(task_state.get("guild_id")):
+        cluster.skipped += 1  # Another process holds this guild's partition
+        return LEFT_TO_OWNER
+
+    job_id = _assemble_job_id(task_state.get("name"), task_state.get("guild_id"))
+    job_lock = _job_locks[job_id]
+    if job_lock.locked() and not wait_turn:
+        log.warning(f"Skipped a run of {job_id}, the last one is still going")
+        run_history.record(job_id, scheduled, None, None, SKIPPED, "Last run still going")
+        return False
+
+    async with job_lock:
+        try:
+            async with execution_limiter.slot(task_state.get("guild_id")):
+                return await _run_in_slot(task_state, scheduled, job_id)
+        except RateLimited as e:
+            log.warning(f"Dropped a run of {job_id}: {e}")
+            run_history.record(job_id, scheduled, None, None, SKIPPED, str(e))
+            return False
+
+
+async def _run_in_slot(task_state, scheduled: Optional[datetime], job_id):
     log.info(f"Executing {task_state.get('name')}")
-    task = Task(**task_state)
-    if await task.load_from_config():
-        return await task.execute()
-    log.warning(f"Failed to load data on {task_state=}")
-    return False
+    started = datetime.now(pytz.utc)
+    start_time = time.perf_counter()
+    task = await task_repository.get(task_state.get("guild_id"), task_state.get("name"))
+    try:
+        if task is not None and task.data:
+            result = await task.execute()  # The cached Task is shared, it's left as is
+        else:
+            log.warning(f"Failed to load data on {task_state=}")
+            result = ExecutionResult(False, "Task not found")
+    except Exception as e:
+        run_history.record(
+            job_id, scheduled, started, time.perf_counter() - start_time, ERROR, repr(e)
+        )
+        raise
+
+    run_history.record(
+        job_id,
+        scheduled,
+        started,
+        time.perf_counter() - start_time,
+        OK if result.ok else FAILED,
+        result.reason,
+    )
+    return result.ok
 
 
 def _assemble_job_id(task_name, guild_id):
@@ -46,25 +121,8 @@ def _disassemble_job_id(job_id: str):
     return job_id.split("_")
 
 
-def _get_run_times(job: Job, now: datetime = None):
-    """
-    Computes the scheduled run times between ``next_run_time`` and ``now`` (inclusive).
-
-    Modified to be asynchronous and yielding instead of all-or-nothing
-
-    """
-    if not job.next_run_time:
-        raise StopIteration()
-
-    if now is None:
-        now = datetime(MAXYEAR, 12, 31, 23, 59, 59, 999999, tzinfo=job.next_run_time.tzinfo)
-        yield from _get_run_times(job, now)  # Recursion
-        raise StopIteration()
-
-    next_run_time = job.next_run_time
-    while next_run_time and next_run_time <= now:
-        yield next_run_time
-        next_run_time = job.trigger.get_next_fire_time(next_run_time, now)
+def _format_seconds(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds:.2f}s"
 
 
 class CapturePrint:
@@ -89,7 +147,19 @@ class FIFO(commands.Cog):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=70737079, force_registration=True)
 
-        default_global = {"jobs": []}
+        default_global = {
+            "jobs": [],
+            "jobs_index": {},
+            "max_concurrent": 5,
+            "guild_per_minute": 0,  # Off until set with `[p]fifo limits guildrate`
+            "guild_burst": 5,
+            "guild_max_wait": 300.0,
+            "jitter": 10.0,
+            "catchup_interval": 1.0,
+            "cluster_path": None,
+            "cluster_partitions": None,  # None for one per shard
+            "cluster_ttl": 30.0,
+        }
         default_guild = {"tasks": {}}
 
         self.config.register_global(**default_global)
@@ -97,6 +167,8 @@ class FIFO(commands.Cog):
 
         self.scheduler: Optional[AsyncIOScheduler] = None
         self.jobstore = None
+        self.catch_up: Optional[CatchUpQueue] = None
+        self._cluster_startup: Optional[asyncio.Task] = None
 
         self.tz_cog = None
 
@@ -108,29 +180,166 @@ class FIFO(commands.Cog):
         # self.scheduler.remove_all_jobs()
         if self.scheduler is not None:
             self.scheduler.shutdown()
+        if self.catch_up is not None:
+            self.catch_up.stop()
+        if self._cluster_startup is not None:
+            self._cluster_startup.cancel()
+        if cluster.enabled:
+            asyncio.create_task(cluster.stop())
+        execution_contexts.clear()
+        task_repository.clear()
 
     async def initialize(self):
         job_defaults = {
             "coalesce": True,  # Multiple missed triggers within the grace time will only fire once
-            "max_instances": 5,  # This is probably way too high, should likely only be one
+            # A run waiting on the ExecutionLimiter counts as running, so this is also how many
+            # runs of one task can wait there. Later triggers are skipped as max instances
+            "max_instances": 1,
             "misfire_grace_time": 15,  # 15 seconds ain't much, but it's honest work
             "replace_existing": True,  # Very important for persistent data
         }
 
-        # executors = {"default": AsyncIOExecutor()}
+        # AsyncIOExecutor that lets each run know its scheduled time
+        executors = {"default": RunTimeExecutor()}
 
-        # Default executor is already AsyncIOExecutor
-        self.scheduler = AsyncIOScheduler(job_defaults=job_defaults, logger=schedule_log)
+        self.scheduler = AsyncIOScheduler(
+            job_defaults=job_defaults, executors=executors, logger=schedule_log
+        )
 
         from .redconfigjobstore import (
             RedConfigJobStore,
         )  # Wait to import to prevent cyclic import
 
+        task_repository.attach(self.config, self.bot)
+
         self.jobstore = RedConfigJobStore(self.config, self.bot)
         await self.jobstore.load_from_config()
         self.scheduler.add_jobstore(self.jobstore, "default")
 
-        self.scheduler.start()
+        execution_limiter.configure(
+            max_concurrent=await self.config.max_concurrent(),
+            guild_per_minute=await self.config.guild_per_minute(),
+            guild_burst=await self.config.guild_burst(),
+            max_wait=await self.config.guild_max_wait(),
+            jitter=await self.config.jitter(),
+        )
+
+        self.scheduler.add_listener(
+            self._on_job_event,
+            EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR,
+        )
+
+        self.catch_up = CatchUpQueue(
+            functools.partial(_run_task, wait_turn=True),
+            interval=await self.config.catchup_interval(),
+        )
+        self.catch_up.start()
+
+        # Paused so missed runs are handled by their policy before the scheduler sees them
+        self.scheduler.start(paused=True)
+        for job in self.scheduler.get_jobs():  # Saved with an older default
+            if job.max_instances != job_defaults["max_instances"]:
+                self.scheduler.modify_job(job.id, max_instances=job_defaults["max_instances"])
+
+        cluster_path = await self.config.cluster_path()
+        if cluster_path is None:
+            await self._catch_up_and_resume()
+        else:  # Leases follow bot.guilds, which is empty until the bot is ready
+            self._cluster_startup = asyncio.create_task(
+                self._join_cluster_and_resume(cluster_path)
+            )
+
+    async def _catch_up_and_resume(self):
+        try:
+            await self._catch_up_missed()
+        finally:
+            self.scheduler.resume()
+
+    async def _join_cluster_and_resume(self, path: str):
+        await self.bot.wait_until_red_ready()
+        try:
+            await self._join_cluster(path)
+        except Exception:
+            log.exception(f"Failed to join the cluster at {path}, running every guild")
+        await self._catch_up_and_resume()
+
+    async def _catch_up_missed(self):
+        """Queues up the runs each task's CatchUpPolicy wants, then moves its job past now"""
+        now = datetime.now(pytz.utc)
+        tasks_by_guild = await task_repository.all_tasks()
+        queued = 0
+        for job in self.scheduler.get_jobs():
+            if job.next_run_time is None:  # Paused
+                continue
+
+            first = job.next_run_time
+            last_run = self.jobstore.last_run(job.id)
+            if last_run is not None:  # Catches runs that were submitted and never finished
+                after_last_run = job.trigger.get_next_fire_time(last_run, last_run)
+                if after_last_run is not None and after_last_run < first:
+                    first = after_last_run
+            if first >= now - timedelta(seconds=job.misfire_grace_time or 0):
+                continue  # The scheduler will run it as usual
+
+            task = tasks_by_guild.get(job.kwargs.get("guild_id"), {}).get(job.kwargs.get("name"))
+            try:
+                policy = CatchUpPolicy.from_data(task.data.get("catchup") if task else None)
+            except (TypeError, ValueError):
+                log.exception(f"Bad catch-up policy on {job.id}, skipping missed runs")
+                policy = CatchUpPolicy()
+
+            if not cluster.owns(job.kwargs.get("guild_id")):
+                log.debug(f"{job.id} missed runs since {first}, left to its partition's owner")
+            elif policy.policy == SKIP:
+                log.info(f"{job.id} missed runs since {first}, skipping them")
+            else:
+                count, missed = missed_fire_times(job.trigger, first, now, policy.keep())
+                for delay, scheduled in policy.plan(missed):
+                    self.catch_up.add(delay, job.kwargs, scheduled)
+                    queued += 1
+                if missed:
+                    self.jobstore.record_run(job.id, missed[-1])
+                log.info(f"{job.id} missed {count} runs since {first}, will {policy}")
+
+            next_run_time = job.trigger.get_next_fire_time(None, now)
+            if next_run_time is None:
+                self.scheduler.remove_job(job.id)
+            else:
+                self.scheduler.modify_job(job.id, next_run_time=next_run_time)
+
+        if queued:
+            log.info(f"Queued {queued} catch-up runs")
+
+    async def _join_cluster(self, path: str):
+        partitions = await self.config.cluster_partitions() or self.bot.shard_count or 1
+        await cluster.start(
+            SQLiteLeaseStore(path),
+            partitions,
+            lambda: [guild.id for guild in self.bot.guilds],
+            ttl=await self.config.cluster_ttl(),
+        )
+
+    def _on_job_event(self, event: Union[JobSubmissionEvent, JobExecutionEvent]):
+        """Tells run_history and the jobstore's last runs what the scheduler did with each run"""
+        if event.code == EVENT_JOB_EXECUTED and event.retval == LEFT_TO_OWNER:
+            return  # The process that ran it keeps track of it
+
+        if event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED):
+            self.jobstore.record_run(event.job_id, event.scheduled_run_time)
+        if event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR):
+            return
+
+        job = self.scheduler.get_job(event.job_id)
+        if event.code == EVENT_JOB_MISSED:
+            run_history.missed(
+                event.job_id,
+                event.scheduled_run_time,
+                getattr(job, "misfire_grace_time", None),
+            )
+        elif event.code == EVENT_JOB_MAX_INSTANCES:
+            run_history.skipped(
+                event.job_id, event.scheduled_run_times, getattr(job, "max_instances", None)
+            )
 
     async def _check_parsable_command(self, ctx: commands.Context, command_to_parse: str):
         message: discord.Message = ctx.message
@@ -147,6 +356,8 @@ class FIFO(commands.Cog):
         if job is not None:
             job.remove()
 
+        execution_contexts.invalidate_task(task.guild_id, task.name)
+        run_history.forget(_assemble_job_id(task.name, task.guild_id))
         await task.delete_self()
 
     async def _process_task(self, task: Task):
@@ -216,15 +427,48 @@ class FIFO(commands.Cog):
         else:
             return None
 
+    # Tasks keep the message they copy and their prefix between runs, see ExecutionContextCache
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after):
+        execution_contexts.invalidate_channel(before.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        execution_contexts.invalidate_channel(channel.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        execution_contexts.invalidate_member(before.guild.id, before.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        execution_contexts.invalidate_member(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        execution_contexts.invalidate_guild(guild.id)
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx: commands.Context):
+        """Red doesn't dispatch an event when prefixes change"""
+        if ctx.command.qualified_name == "set serverprefix":
+            execution_contexts.invalidate_prefixes(ctx.guild.id if ctx.guild else None)
+        elif ctx.command.qualified_name == "set prefix":
+            execution_contexts.invalidate_prefixes()
+
     @checks.is_owner()
     @commands.guild_only()
     @commands.command()
     async def fifoclear(self, ctx: commands.Context):
         """Debug command to clear all current fifo data"""
         self.scheduler.remove_all_jobs()
+        execution_contexts.clear()
+        run_history.clear()
         await self.config.guild(ctx.guild).tasks.clear()
+        task_repository.invalidate(ctx.guild.id)
         await self.config.jobs.clear()
-        # await self.config.jobs_index.clear()
+        await self.config.jobs_index.clear()
         await ctx.tick()
 
     @checks.is_owner()  # Will be reduced when I figure out permissions later
@@ -247,9 +491,196 @@ class FIFO(commands.Cog):
         self.scheduler.wakeup()
         await ctx.tick()
 
-    @fifo.command(name="checktask", aliases=["checkjob", "check"])
-    async def fifo_checktask(self, ctx: commands.Context, task_name: str):
-        """Returns the next 10 scheduled executions of the task"""
+    @fifo.group(name="limits", invoke_without_command=True)
+    async def fifo_limits(self, ctx: commands.Context):
+        """
+        Show how task executions are being limited
+
+        Lag is how long executions waited to start after their trigger fired
+        """
+        stats = execution_limiter.stats()
+        if stats["guild_per_minute"]:
+            guild_rate = (
+                f"{stats['guild_per_minute']} per minute, bursts of {stats['guild_burst']},"
+                f" dropped after waiting {stats['max_wait']:g} seconds"
+            )
+        else:
+            guild_rate = "not limited"
+        await ctx.maybe_send_embed(
+            f"Concurrent executions: {stats['running']} of {stats['max_concurrent']},"
+            f" {stats['waiting']} waiting\n"
+            f"Per guild: {guild_rate}\n"
+            f"Jitter while busy: up to {stats['jitter']} seconds\n"
+            f"Completed: {stats['completed']}, jittered: {stats['jittered']},"
+            f" throttled: {stats['throttled']}, dropped: {stats['dropped']}\n"
+            f"Lag: {stats['avg_lag']:.2f}s average, {stats['p95_lag']:.2f}s p95,"
+            f" {stats['max_lag']:.2f}s max\n"
+            f"Catch-up runs: {len(self.catch_up)} queued, one every {self.catch_up.interval} seconds"
+        )
+
+    @fifo_limits.command(name="concurrency")
+    async def fifo_limits_concurrency(self, ctx: commands.Context, max_concurrent: int):
+        """Set how many tasks can execute at once across all guilds"""
+        if max_concurrent < 1:
+            await ctx.maybe_send_embed("Must be at least 1")
+            return
+        await self.config.max_concurrent.set(max_concurrent)
+        execution_limiter.configure(max_concurrent=max_concurrent)
+        await ctx.tick()
+
+    @fifo_limits.command(name="guildrate")
+    async def fifo_limits_guildrate(
+        self,
+        ctx: commands.Context,
+        per_minute: float,
+        burst: Optional[int] = None,
+        max_wait: Optional[float] = None,
+    ):
+        """
+        Set how many tasks each guild can execute per minute, 0 to not limit guilds
+
+        `burst` is how many can execute back to back before the rate applies
+        Executions that would wait over `max_wait` seconds for their turn are dropped
+        """
+        if per_minute < 0 or (burst is not None and burst < 1) or (max_wait or 0) < 0:
+            await ctx.maybe_send_embed(
+                "Rate and max wait can't be negative and burst must be at least 1"
+            )
+            return
+        await self.config.guild_per_minute.set(per_minute)
+        if burst is not None:
+            await self.config.guild_burst.set(burst)
+        if max_wait is not None:
+            await self.config.guild_max_wait.set(max_wait)
+        execution_limiter.configure(
+            guild_per_minute=per_minute, guild_burst=burst, max_wait=max_wait
+        )
+        await ctx.tick()
+
+    @fifo_limits.command(name="jitter")
+    async def fifo_limits_jitter(self, ctx: commands.Context, seconds: float):
+        """
+        Set the most an execution is delayed when every slot is busy
+
+        Spreads out triggers that fire at the same time. 0 to disable
+        """
+        if seconds < 0:
+            await ctx.maybe_send_embed("Can't be negative")
+            return
+        await self.config.jitter.set(seconds)
+        execution_limiter.configure(jitter=seconds)
+        await ctx.tick()
+
+    @fifo_limits.command(name="catchup")
+    async def fifo_limits_catchup(self, ctx: commands.Context, seconds: float):
+        """
+        Set the time between catch-up runs after a restart
+
+        Catch-up runs make up for the runs missed while the bot was down, see `[p]fifo catchup`
+        """
+        if seconds < 0:
+            await ctx.maybe_send_embed("Can't be negative")
+            return
+        await self.config.catchup_interval.set(seconds)
+        self.catch_up.interval = seconds
+        await ctx.tick()
+
+    @fifo.group(name="cluster", invoke_without_command=True)
+    async def fifo_cluster(self, ctx: commands.Context):
+        """
+        Show how tasks are split between bot processes
+
+        Guilds are split into partitions, each run by the process holding its lease
+        """
+        if not cluster.enabled:
+            await ctx.maybe_send_embed("Not in a cluster, this process runs every guild")
+            return
+
+        now = time.time()
+        try:
+            leases = await cluster.leases()
+        except sqlite3.Error as e:
+            await ctx.maybe_send_embed(f"Failed to read the leases: {e!r}")
+            return
+
+        owners = {}
+        for partition, (owner, expires) in sorted(leases.items()):
+            if expires > now:
+                owners.setdefault(owner, []).append(str(partition))
+        lines = [
+            f"{owner}{' (this process)' if owner == cluster.node_id else ''}:"
+            f" {', '.join(partitions)}"
+            for owner, partitions in owners.items()
+        ]
+        await ctx.maybe_send_embed(
+            f"Leases in `{cluster.store.path}`, {cluster.ttl:g} seconds long\n"
+            f"Partitions: {cluster.partitions}, this guild is in {cluster.partition(ctx.guild.id)}\n"
+            f"Executions left to other processes: {cluster.skipped}\n\n" + "\n".join(lines)
+        )
+
+    @fifo_cluster.command(name="join")
+    async def fifo_cluster_join(
+        self,
+        ctx: commands.Context,
+        path: str,
+        partitions: Optional[int] = None,
+        ttl: float = 30.0,
+    ):
+        """
+        Share tasks with the other bot processes using the lease file at `path`
+
+        Every process must use the same `path` and number of `partitions`.
+        Leave `partitions` out for one per shard.
+        A process that stops renewing its leases for `ttl` seconds is taken over.
+        """
+        if (partitions is not None and partitions < 1) or ttl <= 0:
+            await ctx.maybe_send_embed("Partitions must be at least 1 and ttl above 0")
+            return
+
+        await self.config.cluster_path.set(path)
+        await self.config.cluster_partitions.set(partitions)
+        await self.config.cluster_ttl.set(ttl)
+        try:
+            await self._join_cluster(path)
+        except sqlite3.Error as e:
+            await self.config.cluster_path.clear()
+            await ctx.maybe_send_embed(f"Failed to join the cluster: {e!r}")
+            return
+        await ctx.tick()
+
+    @fifo_cluster.command(name="leave")
+    async def fifo_cluster_leave(self, ctx: commands.Context):
+        """Stop sharing tasks, this process will run every guild"""
+        await self.config.cluster_path.clear()
+        await cluster.stop()
+        await ctx.tick()
+
+    @fifo.command(name="catchup")
+    async def fifo_catchup(
+        self,
+        ctx: commands.Context,
+        task_name: str,
+        policy: str,
+        limit: int = 10,
+        spacing: float = 60.0,
+    ):
+        """
+        Set what a task does with the runs it missed while the bot was down
+
+        Policies:
+        `skip` - drop them, the default
+        `once` - run once for all of them
+        `all` - run each missed run, up to `limit` of the most recent ones
+        `spread` - like `all`, but `spacing` seconds apart
+        """
+        policy = policy.lower()
+        if policy not in POLICIES:
+            await ctx.maybe_send_embed(f"Policy must be one of {', '.join(POLICIES)}")
+            return
+        if limit < 1 or spacing < 0:
+            await ctx.maybe_send_embed("Limit must be at least 1 and spacing can't be negative")
+            return
+
         task = Task(task_name, ctx.guild.id, self.config, bot=self.bot)
         await task.load_from_config()
 
@@ -259,6 +690,22 @@ class FIFO(commands.Cog):
             )
             return
 
+        catch_up_policy = CatchUpPolicy(policy, limit, spacing)
+        task.data["catchup"] = catch_up_policy.to_data()
+        await task.save_data()
+        await ctx.maybe_send_embed(f"Task `{task_name}` will {catch_up_policy} after a restart")
+
+    @fifo.command(name="checktask", aliases=["checkjob", "check"])
+    async def fifo_checktask(self, ctx: commands.Context, task_name: str):
+        """Returns the next 10 scheduled executions of the task"""
+        task = await task_repository.get(ctx.guild.id, task_name)
+
+        if task is None or task.data is None:
+            await ctx.maybe_send_embed(
+                f"Task by the name of {task_name} is not found in this guild"
+            )
+            return
+
         job = await self._get_job(task)
         if job is None:
             await ctx.maybe_send_embed("No job scheduled for this task")
@@ -270,7 +717,7 @@ class FIFO(commands.Cog):
 
         times = [
             humanize_timedelta(timedelta=x - now)
-            for x in itertools.islice(_get_run_times(job), 10)
+            for x in fire_times.upcoming(job.trigger, job.next_run_time, 10)
         ]
         await ctx.maybe_send_embed("\n\n".join(times))
 
@@ -373,10 +820,9 @@ class FIFO(commands.Cog):
         """
         Provide all the details on the specified task name
         """
-        task = Task(task_name, ctx.guild.id, self.config, bot=self.bot)
-        await task.load_from_config()
+        task = await task_repository.get(ctx.guild.id, task_name)
 
-        if task.data is None:
+        if task is None or task.data is None:
             await ctx.maybe_send_embed(
                 f"Task by the name of {task_name} is not found in this guild"
             )
@@ -412,12 +858,64 @@ class FIFO(commands.Cog):
         if expired_str:
             embed.add_field(name="Expired Triggers", value=expired_str, inline=False)
 
+        embed.add_field(
+            name="Missed runs",
+            value=str(CatchUpPolicy.from_data(task.data.get("catchup"))).capitalize(),
+            inline=False,
+        )
+
+        job_id = _assemble_job_id(task.name, task.guild_id)
+        summary = run_history.summary(job_id)
+        if summary["runs"]:
+            runs_str = (
+                f"{summary['runs']} recent runs, {summary['failures']} failed"
+                f" ({summary['missed']} missed)\n"
+                f"Lag: {_format_seconds(summary['p95_lag'])} p95,"
+                f" {_format_seconds(summary['max_lag'])} max\n"
+                f"Duration: {_format_seconds(summary['avg_duration'])} average"
+            )
+            last_failure = summary["last_failure"]
+            if last_failure is not None:
+                runs_str += (
+                    f"\nLast failure: {last_failure.outcome}, {last_failure.reason}"
+                    f" ({last_failure.scheduled or last_failure.started})"
+                )
+            embed.add_field(name="Run history", value=runs_str, inline=False)
+
         job = await self._get_job(task)
         if job and job.next_run_time:
             embed.timestamp = job.next_run_time
 
         await ctx.send(embed=embed)
 
+    @fifo.command(name="stats")
+    async def fifo_stats(self, ctx: commands.Context):
+        """
+        Show how this guild's tasks have been running
+
+        Lag is how late executions started compared to their trigger.
+        Runs later than the misfire grace time are missed and don't execute.
+        Only the recent runs since the cog loaded are kept
+        """
+        rows = []
+        for task_name in await self.config.guild(ctx.guild).tasks():
+            summary = run_history.summary(_assemble_job_id(task_name, ctx.guild.id))
+            rows.append(
+                f"{task_name[:20]:<20} {summary['runs']:>4} {summary['failure_rate']:>6.0%}"
+                f" {summary['missed']:>6} {_format_seconds(summary['p95_lag']):>8}"
+                f" {_format_seconds(summary['avg_duration']):>8}"
+            )
+
+        if not rows:
+            await ctx.maybe_send_embed("No tasks in this guild")
+            return
+
+        header = (
+            f"{'Task':<20} {'Runs':>4} {'Failed':>6} {'Missed':>6} {'p95 lag':>8} {'Duration':>8}"
+        )
+        for page in pagify("\n".join([header, *rows]), page_length=1900):
+            await ctx.send(box(page))
+
     @fifo.command(name="list")
     async def fifo_list(self, ctx: commands.Context, all_guilds: bool = False):
         """
@@ -426,21 +924,29 @@ class FIFO(commands.Cog):
         Do `[p]fifo list True` to see tasks from all guilds
         """
         if all_guilds:
-            pass  # TODO: All guilds
+            tasks_by_guild = await task_repository.all_tasks()
         else:
-            out = ""
-            all_tasks = await self.config.guild(ctx.guild).tasks()
-            for task_name, task_data in all_tasks.items():
-                out += f"{task_name}: {task_data}\n\n"
-
-            if out:
-                if len(out) > 2000:
-                    for page in pagify(out):
-                        await ctx.maybe_send_embed(page)
-                else:
-                    await ctx.maybe_send_embed(out)
+            tasks_by_guild = {ctx.guild.id: await task_repository.guild_tasks(ctx.guild.id)}
+
+        out = ""
+        for guild_id, tasks in tasks_by_guild.items():
+            if all_guilds:
+                guild = self.bot.get_guild(guild_id)
+                out += f"**{guild.name if guild is not None else guild_id}**\n"
+            for task_name, task in tasks.items():
+                out += f"{task_name}: {task.get_command_str()}\n"
+                for t in task.data.get("triggers", []):
+                    out += f"  {t['type']}: {t['time_data']} {t.get('tzinfo') or ''}\n"
+                out += "\n"
+
+        if out:
+            if len(out) > 2000:
+                for page in pagify(out):
+                    await ctx.maybe_send_embed(page)
             else:
-                await ctx.maybe_send_embed("No tasks to list")
+                await ctx.maybe_send_embed(out)
+        else:
+            await ctx.maybe_send_embed("No tasks to list")
 
     @fifo.command(name="printschedule")
     async def fifo_printschedule(self, ctx: commands.Context):
@@ -0,0 +1,126 @@
+import heapq
+import itertools
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp
+
+
+class HeapJobStore(BaseJobStore):
+    """
+    In-memory job store that keeps due jobs in a heap instead of a sorted list
+
+    Heap entries are (timestamp, job id, sequence). Changing or removing a job doesn't
+    touch the heap, the old entry goes stale and is skipped when it reaches the top.
+    Paused jobs have no timestamp and stay out of the heap.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._jobs_index: Dict[str, Tuple[Job, Optional[float]]] = {}  # id -> (job, timestamp)
+        self._heap: List[Tuple[float, str, int]] = []
+        self._current: Dict[str, int] = {}  # id -> sequence of its live heap entry
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._jobs_index)
+
+    def _push(self, job_id, timestamp):
+        if timestamp is None:
+            self._current.pop(job_id, None)
+            return
+        sequence = next(self._sequence)
+        self._current[job_id] = sequence
+        heapq.heappush(self._heap, (timestamp, job_id, sequence))
+
+        if len(self._heap) > 2 * len(self._current) + 64:
+            self._compact()
+
+    def _is_live(self, entry) -> bool:
+        return self._current.get(entry[1], None) == entry[2]
+
+    def _compact(self):
+        """Drop every stale entry at once, so the heap can't grow without bound"""
+        self._heap = [entry for entry in self._heap if self._is_live(entry)]
+        heapq.heapify(self._heap)
+
+    def _discard_stale_top(self):
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def bulk_load(self, jobs: Iterable[Tuple[Job, Optional[float]]]):
+        """Replaces every job with (job, timestamp) pairs, heapified once"""
+        self._jobs_index = {}
+        self._current = {}
+        self._heap = []
+        for job, timestamp in jobs:
+            self._jobs_index[job.id] = (job, timestamp)
+            if timestamp is not None:
+                sequence = next(self._sequence)
+                self._current[job.id] = sequence
+                self._heap.append((timestamp, job.id, sequence))
+        heapq.heapify(self._heap)
+
+    def lookup_job(self, job_id):
+        return self._jobs_index.get(job_id, (None, None))[0]
+
+    def get_due_jobs(self, now):
+        now_timestamp = datetime_to_utc_timestamp(now)
+        due = []
+        while self._heap and self._heap[0][0] <= now_timestamp:
+            entry = heapq.heappop(self._heap)
+            if self._is_live(entry):
+                due.append(entry)
+
+        # Only looking, the scheduler updates or removes them next
+        for entry in due:
+            heapq.heappush(self._heap, entry)
+        return [self._jobs_index[job_id][0] for _, job_id, _ in due]
+
+    def get_next_run_time(self):
+        self._discard_stale_top()
+        if not self._heap:
+            return None
+        return self._jobs_index[self._heap[0][1]][0].next_run_time
+
+    def get_all_jobs(self):
+        """Sorted by next run time, paused jobs last"""
+        pairs = sorted(
+            self._jobs_index.values(),
+            key=lambda pair: (float("inf") if pair[1] is None else pair[1], pair[0].id),
+        )
+        return [job for job, _ in pairs]
+
+    def add_job(self, job):
+        if job.id in self._jobs_index:
+            raise ConflictingIdError(job.id)
+
+        timestamp = datetime_to_utc_timestamp(job.next_run_time)
+        self._jobs_index[job.id] = (job, timestamp)
+        self._push(job.id, timestamp)
+
+    def update_job(self, job):
+        old_job, old_timestamp = self._jobs_index.get(job.id, (None, None))
+        if old_job is None:
+            raise JobLookupError(job.id)
+
+        timestamp = datetime_to_utc_timestamp(job.next_run_time)
+        self._jobs_index[job.id] = (job, timestamp)
+        if timestamp != old_timestamp:
+            self._push(job.id, timestamp)
+
+    def remove_job(self, job_id):
+        if job_id not in self._jobs_index:
+            raise JobLookupError(job_id)
+
+        del self._jobs_index[job_id]
+        self._current.pop(job_id, None)
+
+    def remove_all_jobs(self):
+        self._jobs_index = {}
+        self._current = {}
+        self._heap = []
+
+    def shutdown(self):
+        self.remove_all_jobs()
@@ -0,0 +1,103 @@
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+OK = "ok"
+FAILED = "failed"  # Task.execute returned False
+ERROR = "error"  # Raised an exception
+MISSED = "missed"  # Later than misfire_grace_time, never started
+SKIPPED = "skipped"  # Already running max_instances times
+
+
+class RunRecord:
+    """One scheduled execution of a task"""
+
+    __slots__ = ("scheduled", "started", "duration", "outcome", "reason")
+
+    def __init__(
+        self,
+        scheduled: Optional[datetime],
+        started: Optional[datetime],
+        duration: Optional[float],
+        outcome: str,
+        reason: Optional[str] = None,
+    ):
+        self.scheduled = scheduled
+        self.started = started
+        self.duration = duration
+        self.outcome = outcome
+        self.reason = reason
+
+    @property
+    def lag(self) -> Optional[float]:
+        """Seconds between the trigger's time and the actual start"""
+        if self.scheduled is None or self.started is None:
+            return None
+        return (self.started - self.scheduled).total_seconds()
+
+
+class RunHistory:
+    """
+    The last `size` RunRecords of each job, in memory
+
+    The scheduler's events say which runs were missed or skipped, _execute_task records
+    the runs that started, with the scheduled time RunTimeExecutor gave them.
+    """
+
+    def __init__(self, size=50):
+        self.size = size
+        self._records: Dict[str, Deque[RunRecord]] = {}
+
+    def _add(self, job_id, record: RunRecord):
+        records = self._records.get(job_id, None)
+        if records is None:
+            records = self._records[job_id] = deque(maxlen=self.size)
+        records.append(record)
+
+    def record(self, job_id, scheduled, started, duration, outcome, reason=None):
+        self._add(job_id, RunRecord(scheduled, started, duration, outcome, reason))
+
+    def missed(self, job_id, scheduled: datetime, grace_time):
+        self._add(
+            job_id,
+            RunRecord(scheduled, None, None, MISSED, f"Over {grace_time}s late"),
+        )
+
+    def skipped(self, job_id, run_times: List[datetime], max_instances):
+        for scheduled in run_times:
+            self._add(
+                job_id,
+                RunRecord(scheduled, None, None, SKIPPED, f"{max_instances} already running"),
+            )
+
+    def for_job(self, job_id) -> List[RunRecord]:
+        return list(self._records.get(job_id, ()))
+
+    def job_ids(self) -> List[str]:
+        return list(self._records)
+
+    def forget(self, job_id):
+        self._records.pop(job_id, None)
+
+    def clear(self):
+        self._records.clear()
+
+    def summary(self, job_id) -> dict:
+        records = self.for_job(job_id)
+        lags = sorted(r.lag for r in records if r.lag is not None)
+        durations = [r.duration for r in records if r.duration is not None]
+        failures = sum(r.outcome != OK for r in records)
+        last_failure = next((r for r in reversed(records) if r.outcome != OK), None)
+        return {
+            "runs": len(records),
+            "failures": failures,
+            "failure_rate": failures / len(records) if records else 0.0,
+            "missed": sum(r.outcome == MISSED for r in records),
+            "p95_lag": lags[int(len(lags) * 0.95)] if lags else None,
+            "max_lag": lags[-1] if lags else None,
+            "avg_duration": sum(durations) / len(durations) if durations else None,
+            "last_failure": last_failure,
+        }
+
+
+run_history = RunHistory()
@@ -0,0 +1,215 @@
+"""
+Plain JSON encoding for APScheduler jobs
+
+Jobs are saved as the task they run, their trigger and their run time,
+instead of a pickled Job. Triggers FIFO doesn't make are still pickled.
+"""
+
+import base64
+import pickle
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import pytz
+from apscheduler.job import Job
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.combining import AndTrigger, OrTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+from .date_trigger import CustomDateTrigger
+from .trigger_cache import cron_fields, cron_trigger
+
+CODEC_VERSION = 1
+
+# Left out of the saved kwargs, the job store puts them back
+UNSAVED_KWARGS = ("config", "bot")
+
+
+def _encode_tz(tz) -> Optional[str]:
+    if tz is None:
+        return None
+    name = getattr(tz, "zone", None) or getattr(tz, "key", None)  # pytz or zoneinfo
+    if name is not None:
+        return name
+    offset = tz.utcoffset(None)
+    if not offset:
+        return "UTC"
+    return f"{offset.total_seconds():+.0f}"  # Fixed offset in seconds
+
+
+def _decode_tz(name: Optional[str]):
+    if name is None:
+        return None
+    if name[0] in "+-":
+        return timezone(timedelta(seconds=int(name)))
+    return pytz.timezone(name)
+
+
+def _encode_datetime(dt: Optional[datetime]) -> Optional[str]:
+    return None if dt is None else dt.isoformat()
+
+
+def _decode_datetime(text: Optional[str], tz=None) -> Optional[datetime]:
+    if text is None:
+        return None
+    dt = datetime.fromisoformat(text)
+    return dt if tz is None else dt.astimezone(tz)
+
+
+def encode_trigger(trigger: BaseTrigger) -> Dict:
+    """The trigger as JSON-compatible fields"""
+    if isinstance(trigger, (OrTrigger, AndTrigger)):
+        return {
+            "type": "or" if isinstance(trigger, OrTrigger) else "and",
+            "triggers": [encode_trigger(t) for t in trigger.triggers],
+            "jitter": trigger.jitter,
+        }
+
+    if isinstance(trigger, IntervalTrigger):
+        return {
+            "type": "interval",
+            "seconds": trigger.interval.total_seconds(),
+            "timezone": _encode_tz(trigger.timezone),
+            "start_date": _encode_datetime(trigger.start_date),
+            "end_date": _encode_datetime(trigger.end_date),
+            "jitter": trigger.jitter,
+        }
+
+    if isinstance(trigger, CronTrigger):
+        return {
+            "type": "cron",
+            "fields": {f.name: str(f) for f in trigger.fields if not f.is_default},
+            "timezone": _encode_tz(trigger.timezone),
+            "start_date": _encode_datetime(trigger.start_date),
+            "end_date": _encode_datetime(trigger.end_date),
+            "jitter": trigger.jitter,
+        }
+
+    if isinstance(trigger, DateTrigger):
+        return {
+            "type": "date",
+            "run_date": _encode_datetime(trigger.run_date),
+            "timezone": _encode_tz(trigger.run_date.tzinfo),
+        }
+
+    return {
+        "type": "pickle",
+        "state": base64.b64encode(pickle.dumps(trigger, pickle.HIGHEST_PROTOCOL)).decode("ascii"),
+    }
+
+
+def decode_trigger(data: Dict) -> BaseTrigger:
+    """Rebuilds a trigger from encode_trigger's fields"""
+    trigger_type = data["type"]
+
+    if trigger_type in ("or", "and"):
+        cls = OrTrigger if trigger_type == "or" else AndTrigger
+        return cls([decode_trigger(t) for t in data["triggers"]], jitter=data["jitter"])
+
+    if trigger_type == "interval":
+        tz = _decode_tz(data["timezone"])
+        trigger = IntervalTrigger.__new__(IntervalTrigger)  # The constructor would move start_date
+        trigger.__setstate__(
+            {
+                "version": 2,
+                "timezone": tz,
+                "start_date": _decode_datetime(data["start_date"], tz),
+                "end_date": _decode_datetime(data["end_date"], tz),
+                "interval": timedelta(seconds=data["seconds"]),
+                "jitter": data["jitter"],
+            }
+        )
+        return trigger
+
+    if trigger_type == "cron":
+        tz = _decode_tz(data["timezone"])
+        return cron_trigger(
+            cron_fields(tuple(sorted(data["fields"].items()))),  # Many jobs share an expression
+            tz,
+            start_date=_decode_datetime(data["start_date"], tz),
+            end_date=_decode_datetime(data["end_date"], tz),
+            jitter=data["jitter"],
+        )
+
+    if trigger_type == "date":
+        trigger = CustomDateTrigger.__new__(CustomDateTrigger)
+        trigger.__setstate__(
+            {
+                "version": 1,
+                "run_date": _decode_datetime(data["run_date"], _decode_tz(data["timezone"])),
+            }
+        )
+        return trigger
+
+    if trigger_type == "pickle":
+        return pickle.loads(base64.b64decode(data["state"]))
+
+    raise ValueError(f"Unknown trigger type {trigger_type!r}")
+
+
+def encode_job(job: Job) -> Dict:
+    """
+    The job as JSON-compatible fields, kwargs must already be JSON-compatible
+
+    `next_run_time` is a UTC timestamp, None when paused.
+    """
+    return {
+        "_id": job.id,
+        "version": CODEC_VERSION,
+        "next_run_time": datetime_to_utc_timestamp(job.next_run_time),
+        "name": job.name,
+        "func": job.func_ref,
+        "args": list(job.args),
+        "kwargs": {k: v for k, v in job.kwargs.items() if k not in UNSAVED_KWARGS},
+        "trigger": encode_trigger(job.trigger),
+        "executor": job.executor,
+        "misfire_grace_time": job.misfire_grace_time,
+        "coalesce": job.coalesce,
+        "max_instances": job.max_instances,
+    }
+
+
+def decode_job_state(data: Dict) -> Dict:
+    """The state Job.__setstate__ takes, rebuilt from encode_job's fields"""
+    if data.get("version", 1) > CODEC_VERSION:
+        raise ValueError(
+            f"Job {data['_id']} was saved by codec version {data['version']}, "
+            f"only up to {CODEC_VERSION} can be loaded"
+        )
+
+    trigger = decode_trigger(data["trigger"])
+    next_run_time = utc_timestamp_to_datetime(data["next_run_time"])
+    tz = getattr(trigger, "timezone", None)
+    if next_run_time is not None and tz is not None:
+        next_run_time = next_run_time.astimezone(tz)
+
+    return {
+        "version": 1,
+        "id": data["_id"],
+        "func": data["func"],
+        "trigger": trigger,
+        "executor": data["executor"],
+        "args": tuple(data["args"]),
+        "kwargs": dict(data["kwargs"]),
+        "name": data["name"],
+        "misfire_grace_time": data["misfire_grace_time"],
+        "coalesce": data["coalesce"],
+        "max_instances": data["max_instances"],
+        "next_run_time": next_run_time,
+    }
+
+
+def is_pickled(data: Dict) -> bool:
+    """Jobs saved before this codec are a base64 pickle under `job_state`"""
+    return "job_state" in data
+
+
+def decode_pickled_job_state(data: Dict) -> Dict:
+    job_state = pickle.loads(base64.b64decode(data["job_state"]))
+    if job_state["args"]:  # Backwards compatibility on args to kwargs
+        job_state["kwargs"] = {**job_state["args"][0]}
+        job_state["args"] = []
+    return job_state
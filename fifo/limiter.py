@@ -0,0 +1,165 @@
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+
+class RateLimited(Exception):
+    """The guild's queue is already longer than the limiter lets executions wait"""
+
+
+class TokenBucket:
+    """
+    Allows `burst` runs at once, refilling at `per_minute`
+
+    `reserve` takes a token and returns how long to wait for it,
+    so callers are served in the order they arrived.
+    """
+
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """Seconds to wait for a token, None without taking one if that's over `max_wait`"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        wait = max(1 - self.tokens, 0.0) / self.rate
+        if max_wait is not None and wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+
+class ExecutionLimiter:
+    """
+    Decides when each task execution may start
+
+    Executions wait for their guild's TokenBucket, then for one of `max_concurrent` slots.
+    Guilds aren't rate limited while `guild_per_minute` is 0, the default.
+    An execution that would wait over `max_wait` seconds for its guild's bucket
+    is refused with RateLimited, so a guild's backlog can't grow forever.
+    Executions that arrive while every slot is taken are first spread over `jitter` seconds,
+    so a burst of triggers at the same instant doesn't all queue at once.
+    Lag is the time between arriving and starting.
+    """
+
+    def __init__(
+        self, max_concurrent=5, guild_per_minute=0, guild_burst=5, max_wait=300.0, jitter=10.0
+    ):
+        self.max_concurrent = max_concurrent
+        self.guild_per_minute = guild_per_minute
+        self.guild_burst = guild_burst
+        self.max_wait = max_wait
+        self.jitter = jitter
+
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.jittered = 0  # Executions delayed by jitter
+        self.throttled = 0  # Executions delayed by their guild's bucket
+        self.dropped = 0  # Executions refused by their guild's bucket
+
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._lags = deque(maxlen=500)
+        self._condition: Optional[asyncio.Condition] = None  # Made in the running loop
+
+    def configure(
+        self,
+        max_concurrent=None,
+        guild_per_minute=None,
+        guild_burst=None,
+        max_wait=None,
+        jitter=None,
+    ):
+        if max_concurrent is not None:
+            self.max_concurrent = max_concurrent
+        if guild_per_minute is not None or guild_burst is not None:
+            if guild_per_minute is not None:
+                self.guild_per_minute = guild_per_minute
+            if guild_burst is not None:
+                self.guild_burst = guild_burst
+            self._buckets.clear()
+        if max_wait is not None:
+            self.max_wait = max_wait
+        if jitter is not None:
+            self.jitter = jitter
+
+        if self._condition is not None:
+            asyncio.create_task(self._notify_all())  # Room for more if max_concurrent grew
+
+    async def _notify_all(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    def _bucket(self, guild_id) -> TokenBucket:
+        bucket = self._buckets.get(guild_id, None)
+        if bucket is None:
+            bucket = self._buckets[guild_id] = TokenBucket(self.guild_per_minute, self.guild_burst)
+        return bucket
+
+    @asynccontextmanager
+    async def slot(self, guild_id):
+        """Waits for a turn to execute in `guild_id`, raises RateLimited if it's too far off"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        arrived = time.monotonic()
+        self.waiting += 1
+        try:
+            if self.jitter and self.running >= self.max_concurrent:
+                self.jittered += 1
+                await asyncio.sleep(random.uniform(0, self.jitter))
+
+            delay = 0.0
+            if self.guild_per_minute:
+                delay = self._bucket(guild_id).reserve(self.max_wait)
+            if delay is None:
+                self.dropped += 1
+                raise RateLimited(f"Guild over {self.guild_per_minute:g} per minute")
+            if delay:
+                self.throttled += 1
+                await asyncio.sleep(delay)
+
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.running < self.max_concurrent)
+                self.running += 1
+        finally:
+            self.waiting -= 1
+
+        self._lags.append(time.monotonic() - arrived)
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.running -= 1
+                self.completed += 1
+                self._condition.notify()
+
+    def stats(self):
+        lags = sorted(self._lags)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "guild_per_minute": self.guild_per_minute,
+            "guild_burst": self.guild_burst,
+            "max_wait": self.max_wait,
+            "jitter": self.jitter,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "jittered": self.jittered,
+            "throttled": self.throttled,
+            "dropped": self.dropped,
+            "avg_lag": sum(lags) / len(lags) if lags else 0.0,
+            "p95_lag": lags[int(len(lags) * 0.95)] if lags else 0.0,
+            "max_lag": lags[-1] if lags else 0.0,
+        }
+
+
+execution_limiter = ExecutionLimiter()
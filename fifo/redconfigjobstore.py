@@ -1,111 +1,149 @@
 import asyncio
-import base64
 import logging
-import pickle
+from datetime import datetime
+from typing import Dict, Optional, Set
 
 from apscheduler.job import Job
-from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.asyncio import run_in_event_loop
-from apscheduler.util import datetime_to_utc_timestamp
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
 from redbot.core import Config
 
 # TODO: use get_lock on config maybe
 from redbot.core.bot import Red
 from redbot.core.utils import AsyncIter
 
+from .heapjobstore import HeapJobStore
+from .jobcodec import decode_job_state, decode_pickled_job_state, encode_job, is_pickled
+
 log = logging.getLogger("red.fox_v3.fifo.jobstore")
 log.setLevel(logging.DEBUG)
 
 save_task_objects = []
 
 
-class RedConfigJobStore(MemoryJobStore):
-    def __init__(self, config: Config, bot: Red):
+class RedConfigJobStore(HeapJobStore):
+    """
+    HeapJobStore that saves each job to Config as it changes
+
+    Jobs are stored by id under `jobs_index`, so a change only rewrites that job.
+    They're saved as plain fields by jobcodec, pickled jobs are converted on load.
+    Writes are batched for `flush_delay` seconds, since every run updates its job.
+    """
+
+    def __init__(self, config: Config, bot: Red, flush_delay=1.0):
         super().__init__()
         self.config = config
         self.bot = bot
-        self.pickle_protocol = pickle.HIGHEST_PROTOCOL
         self._eventloop = self.bot.loop  # Used for @run_in_event_loop
 
+        self.flush_delay = flush_delay
+        self._dirty: Set[str] = set()  # Ids of jobs to save, or delete if they're gone
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_runs: Dict[str, float] = {}  # Id -> timestamp of the last fire time handled
+
     @run_in_event_loop
     def start(self, scheduler, alias):
         super().start(scheduler, alias)
-        for job, timestamp in self._jobs:
+        for job, timestamp in self._jobs_index.values():
             job._scheduler = self._scheduler
             job._jobstore_alias = self._alias
 
     async def load_from_config(self):
-        _jobs = await self.config.jobs()
-        # self._jobs = [
-        #     (await self._decode_job(job), timestamp) async for (job, timestamp) in AsyncIter(_jobs)
-        # ]
-        async for job, timestamp in AsyncIter(_jobs, steps=5):
-            job = await self._decode_job(job)
-            index = self._get_job_index(timestamp, job.id)
-            self._jobs.insert(index, (job, timestamp))
-            self._jobs_index[job.id] = (job, timestamp)
+        jobs = {}
+        jobs_index = await self.config.jobs_index()
+        async for encoded in AsyncIter(jobs_index.values(), steps=100):
+            job = await self._decode_job(encoded)
+            jobs[job.id] = (job, encoded["next_run_time"])
+            if encoded.get("last_run") is not None:
+                self._last_runs[job.id] = encoded["last_run"]
+            if is_pickled(encoded):  # Resaved with jobcodec
+                self._dirty.add(job.id)
+
+        # Before jobs_index, every job was saved as one list
+        old_jobs = await self.config.jobs()
+        if old_jobs:
+            log.info(f"Moving {len(old_jobs)} jobs to jobs_index")
+            async for encoded, timestamp in AsyncIter(old_jobs, steps=100):
+                job = await self._decode_job(encoded)
+                jobs[job.id] = (job, timestamp)
+                self._dirty.add(job.id)
+
+        self.bulk_load(jobs.values())
+
+        if self._dirty:
+            log.info(f"Converting {len(self._dirty)} pickled jobs")
+            await self.flush()
+        if old_jobs:
+            await self.config.jobs.clear()
 
     async def save_to_config(self):
-        """Yea that's basically it"""
-        await self.config.jobs.set(
-            [(self._encode_job(job), timestamp) for job, timestamp in self._jobs]
-        )
+        """Everything is saved as it changes, this only saves what's waiting"""
+        await self.flush()
 
-        # self._jobs_index = await self.config.jobs_index.all()  # Overwritten by next
-        # self._jobs_index = {job.id: (job, timestamp) for job, timestamp in self._jobs}
+    def last_run(self, job_id) -> Optional[datetime]:
+        """The last fire time that was run or dropped as missed, saved across restarts"""
+        return utc_timestamp_to_datetime(self._last_runs.get(job_id, None))
 
-    def _encode_job(self, job: Job):
-        job_state = job.__getstate__()
-        job_state["kwargs"]["config"] = None
-        job_state["kwargs"]["bot"] = None
-        # new_kwargs = job_state["kwargs"]
-        # new_kwargs["config"] = None
-        # new_kwargs["bot"] = None
-        # job_state["kwargs"] = new_kwargs
-        encoded = base64.b64encode(pickle.dumps(job_state, self.pickle_protocol))
-        out = {
-            "_id": job.id,
-            "next_run_time": datetime_to_utc_timestamp(job.next_run_time),
-            "job_state": encoded.decode("ascii"),
-        }
-        job_state["kwargs"]["config"] = self.config
-        job_state["kwargs"]["bot"] = self.bot
-        # new_kwargs = job_state["kwargs"]
-        # new_kwargs["config"] = self.config
-        # new_kwargs["bot"] = self.bot
-        # job_state["kwargs"] = new_kwargs
-        # log.debug(f"Encoding job id: {job.id}\n"
-        #           f"Encoded as: {out}")
+    def record_run(self, job_id, run_time: datetime):
+        if job_id not in self._jobs_index:  # Removed after its last run
+            return
+        timestamp = datetime_to_utc_timestamp(run_time)
+        if timestamp > self._last_runs.get(job_id, float("-inf")):
+            self._last_runs[job_id] = timestamp
+            self._mark_dirty(job_id)
 
-        return out
+    def add_job(self, job):
+        super().add_job(job)
+        self._mark_dirty(job.id)
+
+    def update_job(self, job):
+        super().update_job(job)
+        self._mark_dirty(job.id)
+
+    def remove_job(self, job_id):
+        super().remove_job(job_id)
+        self._mark_dirty(job_id)
+
+    @run_in_event_loop
+    def _mark_dirty(self, job_id):
+        self._dirty.add(job_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while self._dirty:  # Catches anything that changed during the last flush
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self):
+        """Saves every job that changed since the last flush"""
+        dirty, self._dirty = self._dirty, set()
+        for job_id in dirty:
+            job, timestamp = self._jobs_index.get(job_id, (None, None))
+            if job is None:
+                self._last_runs.pop(job_id, None)
+                await self.config.jobs_index.clear_raw(job_id)
+            else:
+                await self.config.jobs_index.set_raw(job_id, value=self._encode_job(job))
+
+    def _encode_job(self, job: Job):
+        encoded = encode_job(job)
+        encoded["last_run"] = self._last_runs.get(job.id, None)
+        return encoded
 
     async def _decode_job(self, in_job):
         if in_job is None:
             return None
-        job_state = in_job["job_state"]
-        job_state = pickle.loads(base64.b64decode(job_state))
-        if job_state["args"]:  # Backwards compatibility on args to kwargs
-            job_state["kwargs"] = {**job_state["args"][0]}
-            job_state["args"] = []
+        if is_pickled(in_job):
+            job_state = decode_pickled_job_state(in_job)
+        else:
+            job_state = decode_job_state(in_job)
         job_state["kwargs"]["config"] = self.config
         job_state["kwargs"]["bot"] = self.bot
-        # new_kwargs = job_state["kwargs"]
-        # new_kwargs["config"] = self.config
-        # new_kwargs["bot"] = self.bot
-        # job_state["kwargs"] = new_kwargs
         job = Job.__new__(Job)
         job.__setstate__(job_state)
         job._scheduler = self._scheduler
         job._jobstore_alias = self._alias
-        # task_name, guild_id = _disassemble_job_id(job.id)
-        # task = Task(task_name, guild_id, self.config)
-        # await task.load_from_config()
-        # save_task_objects.append(task)
-        #
-        # job.func = task.execute
-
-        # log.debug(f"Decoded job id: {job.id}\n"
-        #           f"Decoded as {job_state}")
 
         return job
 
@@ -115,14 +153,15 @@ class RedConfigJobStore(MemoryJobStore):
         asyncio.create_task(self._async_remove_all_jobs())
 
     async def _async_remove_all_jobs(self):
+        self._dirty.clear()
+        self._last_runs.clear()
         await self.config.jobs.clear()
-        # await self.config.jobs_index.clear()
+        await self.config.jobs_index.clear()
 
     def shutdown(self):
         """Removes all jobs without clearing config"""
         asyncio.create_task(self.async_shutdown())
 
     async def async_shutdown(self):
-        await self.save_to_config()
-        self._jobs = []
-        self._jobs_index = {}
+        await self.flush()
+        HeapJobStore.remove_all_jobs(self)  # Not self.remove_all_jobs, that clears Config
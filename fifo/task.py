@@ -1,20 +1,23 @@
 import logging
+import time
+from collections import defaultdict
+from copy import deepcopy
 from datetime import datetime, timedelta, timezone
 from functools import partial
 from inspect import ismethod, signature
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 
 import discord
 import pytz
 from apscheduler.triggers.base import BaseTrigger
 from apscheduler.triggers.combining import OrTrigger
-from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from discord.utils import time_snowflake
 from redbot.core import Config, commands
 from redbot.core.bot import Red
 
 from fifo.date_trigger import CustomDateTrigger
+from fifo.trigger_cache import crontab_trigger
 
 log = logging.getLogger("red.fox_v3.fifo.task")
 
@@ -32,7 +35,7 @@ def get_trigger(data):
         return CustomDateTrigger(data["time_data"], timezone=data["tzinfo"])
 
     if data["type"] == "cron":
-        return CronTrigger.from_crontab(data["time_data"], timezone=data["tzinfo"])
+        return crontab_trigger(data["time_data"], timezone=data["tzinfo"])
 
     return False
 
@@ -193,6 +196,112 @@ def neuter_message(message: FakeMessage):
     return message
 
 
+class ExecutionContext:
+    """A message to copy for a task's runs, and the prefix to use"""
+
+    __slots__ = ("channel_id", "author_id", "template", "prefix", "created")
+
+    def __init__(self, channel_id, author_id, template: discord.Message):
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.template = template
+        self.prefix: Optional[str] = None
+        self.created = time.monotonic()
+
+
+class ExecutionResult:
+    """What Task.execute did. Truthy when the command ran, like the bool it used to return"""
+
+    __slots__ = ("ok", "reason")
+
+    def __init__(self, ok: bool, reason: Optional[str] = None):
+        self.ok = ok
+        self.reason = reason  # Why it didn't run
+
+    def __bool__(self):
+        return self.ok
+
+
+class ExecutionContextCache:
+    """
+    ExecutionContexts by (guild_id, task name), so a task's runs don't fetch messages
+
+    FIFO's listeners invalidate them when the channel, author or prefix changes.
+    `max_age` catches anything the listeners miss.
+    """
+
+    def __init__(self, max_age=3600):
+        self.max_age = max_age
+        self._contexts: Dict[Tuple[int, str], ExecutionContext] = {}
+        self._by_channel: Dict[int, Set[Tuple[int, str]]] = defaultdict(set)
+        self._by_member: Dict[Tuple[int, int], Set[Tuple[int, str]]] = defaultdict(set)
+
+    def __len__(self):
+        return len(self._contexts)
+
+    def get(self, guild_id, name, channel_id, author_id) -> Optional[ExecutionContext]:
+        context = self._contexts.get((guild_id, name), None)
+        if context is None:
+            return None
+        if (
+            context.channel_id != channel_id
+            or context.author_id != author_id
+            or time.monotonic() - context.created > self.max_age
+        ):
+            self.invalidate_task(guild_id, name)
+            return None
+        return context
+
+    def set(self, guild_id, name, context: ExecutionContext) -> ExecutionContext:
+        self.invalidate_task(guild_id, name)
+        key = (guild_id, name)
+        self._contexts[key] = context
+        self._by_channel[context.channel_id].add(key)
+        self._by_member[(guild_id, context.author_id)].add(key)
+        return context
+
+    def invalidate_task(self, guild_id, name):
+        context = self._contexts.pop((guild_id, name), None)
+        if context is None:
+            return
+        self._discard_index(self._by_channel, context.channel_id, (guild_id, name))
+        self._discard_index(self._by_member, (guild_id, context.author_id), (guild_id, name))
+
+    def invalidate_channel(self, channel_id):
+        for guild_id, name in list(self._by_channel.get(channel_id, ())):
+            self.invalidate_task(guild_id, name)
+
+    def invalidate_member(self, guild_id, member_id):
+        for key in list(self._by_member.get((guild_id, member_id), ())):
+            self.invalidate_task(*key)
+
+    def invalidate_guild(self, guild_id):
+        for key in [key for key in self._contexts if key[0] == guild_id]:
+            self.invalidate_task(*key)
+
+    def invalidate_prefixes(self, guild_id=None):
+        """Keeps the messages, the prefix is looked up again on the next run"""
+        for key, context in self._contexts.items():
+            if guild_id is None or key[0] == guild_id:
+                context.prefix = None
+
+    def clear(self):
+        self._contexts.clear()
+        self._by_channel.clear()
+        self._by_member.clear()
+
+    @staticmethod
+    def _discard_index(index, index_key, key):
+        keys = index.get(index_key, None)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[index_key]
+
+
+execution_contexts = ExecutionContextCache()
+
+
 class Task:
     default_task_data = {"triggers": [], "command_str": "", "expired_triggers": []}
 
@@ -218,6 +327,14 @@ class Task:
         self.author_id = author_id
         self.channel_id = channel_id
         self.data = None
+        self._triggers_decoded = False  # Triggers are decoded on first use, see _decode_once
+
+    @classmethod
+    def from_config_data(cls, name: str, task_data: Dict, config: Config, bot: Red = None):
+        """A Task from what's saved under its name, without another Config read"""
+        task = cls(name, task_data["guild_id"], config, bot=bot)
+        task._load_data(task_data)
+        return task
 
     async def _encode_time_triggers(self):
         if not self.data or not self.data.get("triggers", None):
@@ -305,6 +422,24 @@ class Task:
     # async def load_from_data(self, data: Dict):
     #     self.data = data.copy()
 
+    def _load_data(self, data: Dict):
+        self.author_id = data["author_id"]
+        self.guild_id = data["guild_id"]  # Weird I'm doing this, since self.guild_id was just used
+        self.channel_id = data["channel_id"]
+
+        self.data = data["data"]
+        self._triggers_decoded = False
+
+    def _set_default_data(self):
+        self.data = deepcopy(self.default_task_data)
+        self._triggers_decoded = True
+
+    async def _decode_once(self):
+        """Listing and executing tasks never look at triggers, so they're only decoded here"""
+        if self.data and not self._triggers_decoded:
+            await self._decode_time_triggers()
+            self._triggers_decoded = True
+
     async def load_from_config(self):
         data = await self.config.guild_from_id(self.guild_id).tasks.get_raw(
             self.name, default=None
@@ -313,18 +448,13 @@ class Task:
         if not data:
             return
 
-        self.author_id = data["author_id"]
-        self.guild_id = data["guild_id"]  # Weird I'm doing this, since self.guild_id was just used
-        self.channel_id = data["channel_id"]
-
-        self.data = data["data"]
-
-        await self._decode_time_triggers()
+        self._load_data(data)
         return self.data
 
     async def get_triggers(self) -> Tuple[List[BaseTrigger], List[BaseTrigger]]:
         if not self.data:
             await self.load_from_config()
+        await self._decode_once()
 
         if self.data is None or "triggers" not in self.data:  # No triggers
             return [], []
@@ -343,6 +473,7 @@ class Task:
     async def get_combined_trigger(self) -> Union[BaseTrigger, None]:
         if not self.data:
             await self.load_from_config()
+        await self._decode_once()
 
         return parse_triggers(self.data)
 
@@ -357,6 +488,7 @@ class Task:
 
         data_to_save = self.default_task_data.copy()
         if self.data:
+            await self._decode_once()
             data_to_save["command_str"] = self.get_command_str()
             (
                 data_to_save["triggers"],
@@ -370,12 +502,14 @@ class Task:
             "data": data_to_save,
         }
         await self.config.guild_from_id(self.guild_id).tasks.set_raw(self.name, value=to_save)
+        task_repository.invalidate(self.guild_id, self.name)
 
     async def save_data(self):
         """To be used when updating triggers"""
         if not self.data:
             return
 
+        await self._decode_once()
         data_to_save = self.data.copy()
         (
             data_to_save["triggers"],
@@ -385,70 +519,60 @@ class Task:
         await self.config.guild_from_id(self.guild_id).tasks.set_raw(
             self.name, "data", value=data_to_save
         )
+        task_repository.invalidate(self.guild_id, self.name)
+
+    async def execute(self) -> ExecutionResult:
+        """
+        Runs the task's command, the result says why if it couldn't
 
-    async def execute(self):
+        Leaves the Task as it was, so shared ones from the repository can run at once.
+        """
         if not self.data or not self.get_command_str():
             log.warning(f"Could not execute Task[{self.name}] due to data problem: {self.data=}")
-            return False
+            return ExecutionResult(False, "No command to run")
 
         guild: discord.Guild = self.bot.get_guild(self.guild_id)  # used for get_prefix
         if guild is None:
             log.warning(
                 f"Could not execute Task[{self.name}] due to missing guild: {self.guild_id}"
             )
-            return False
+            return ExecutionResult(False, "Guild not found")
         channel: discord.TextChannel = guild.get_channel(self.channel_id)
         if channel is None:
             log.warning(
                 f"Could not execute Task[{self.name}] due to missing channel: {self.channel_id}"
             )
-            return False
+            return ExecutionResult(False, "Channel not found")
         author: discord.Member = guild.get_member(self.author_id)
         if author is None:
             log.warning(
                 f"Could not execute Task[{self.name}] due to missing author: {self.author_id}"
             )
-            return False
+            return ExecutionResult(False, "Author not found")
+
+        context = execution_contexts.get(self.guild_id, self.name, channel.id, author.id)
+        if context is None:
+            actual_message = await self._find_message(channel, author)
+            if actual_message is None:
+                log.warning("No message found in channel cache yet, skipping execution")
+                return ExecutionResult(False, "No message to copy")
+            context = execution_contexts.set(
+                self.guild_id, self.name, ExecutionContext(channel.id, author.id, actual_message)
+            )
 
-        actual_message: Optional[discord.Message] = channel.last_message
-        # I'd like to present you my chain of increasingly desperate message fetching attempts
-        if actual_message is None:
-            # log.warning("No message found in channel cache yet, skipping execution")
-            # return
-            if channel.last_message_id is not None:
-                try:
-                    actual_message = await channel.fetch_message(channel.last_message_id)
-                except discord.NotFound:
-                    actual_message = None
-            if actual_message is None:  # last_message_id was an invalid message I guess
-                actual_message = (
-                    await channel.history().__anext__()
-                )  # await anext(channel.history()) py3.10+
-                if not actual_message:  # Basically only happens if the channel has no messages
-                    actual_message = await author.history().__anext__()
-                    if not actual_message:  # Okay, the *author* has never sent a message?
-                        log.warning("No message found in channel cache yet, skipping execution")
-                        return False
-
-        # message._handle_author(author)  # Option when message is subclass
-        # message._state = self.bot._get_state()
-        # Time to set the relevant attributes
-        # message.author = author
-        # Don't need guild with subclass, guild is just channel.guild
-        # message.guild = guild  # Just in case we got desperate, see above
-        # message.channel = channel
-
-        # absolutely weird that this takes a message object instead of guild
-        prefixes = await self.bot.get_prefix(actual_message)
-        if isinstance(prefixes, str):
-            prefix = prefixes
-        else:
-            prefix = prefixes[0]
+        if context.prefix is None:
+            # absolutely weird that this takes a message object instead of guild
+            prefixes = await self.bot.get_prefix(context.template)
+            if isinstance(prefixes, str):
+                context.prefix = prefixes
+            else:
+                context.prefix = prefixes[0]
+        prefix = context.prefix
 
         new_content = f"{prefix}{self.get_command_str()}"
         # log.debug(f"{new_content=}")
 
-        message = FakeMessage(message=actual_message)
+        message = FakeMessage(message=context.template)
         message = neuter_message(message)
         message.process_the_rest(author=author, channel=channel, guild=guild, content=new_content)
 
@@ -462,7 +586,7 @@ class Task:
                 f"Could not execute Task[{self.name}] due to message problem: "
                 f"{message.guild=}, {message.author=}, {message.content=}"
             )
-            return False
+            return ExecutionResult(False, "Couldn't build the message")
 
         new_ctx: commands.Context = await self.bot.get_context(message)
         new_ctx.assume_yes = True
@@ -471,10 +595,35 @@ class Task:
                 f"Could not execute Task[{self.name}] due invalid context: "
                 f"{new_ctx.invoked_with=} {new_ctx.prefix=} {new_ctx.command=}"
             )
-            return False
+            return ExecutionResult(False, f"Invalid command: {new_ctx.invoked_with}")
 
         await self.bot.invoke(new_ctx)
-        return True
+        return ExecutionResult(True)
+
+    @staticmethod
+    async def _find_message(
+        channel: discord.TextChannel, author: discord.Member
+    ) -> Optional[discord.Message]:
+        """Any message to base the fake one on, trying the cache before the API"""
+        actual_message: Optional[discord.Message] = channel.last_message
+        # I'd like to present you my chain of increasingly desperate message fetching attempts
+        if actual_message is None:
+            # log.warning("No message found in channel cache yet, skipping execution")
+            # return
+            if channel.last_message_id is not None:
+                try:
+                    actual_message = await channel.fetch_message(channel.last_message_id)
+                except discord.NotFound:
+                    actual_message = None
+            if actual_message is None:  # last_message_id was an invalid message I guess
+                actual_message = (
+                    await channel.history().__anext__()
+                )  # await anext(channel.history()) py3.10+
+                if not actual_message:  # Basically only happens if the channel has no messages
+                    actual_message = await author.history().__anext__()
+                    if not actual_message:  # Okay, the *author* has never sent a message?
+                        return None
+        return actual_message
 
     async def set_bot(self, bot: Red):
         self.bot = bot
@@ -484,19 +633,21 @@ class Task:
         await self.config.guild_from_id(self.guild_id).tasks.set_raw(
             self.name, "author_id", value=self.author_id
         )
+        task_repository.invalidate(self.guild_id, self.name)
 
     async def set_channel(self, channel: Union[discord.TextChannel, str]):
         self.channel_id = getattr(channel, "id", None) or channel
         await self.config.guild_from_id(self.guild_id).tasks.set_raw(
             self.name, "channel_id", value=self.channel_id
         )
+        task_repository.invalidate(self.guild_id, self.name)
 
     def get_command_str(self):
         return self.data.get("command_str", "")
 
     async def set_commmand_str(self, command_str):
         if not self.data:
-            self.data = self.default_task_data.copy()
+            self._set_default_data()
         self.data["command_str"] = command_str
         return True
 
@@ -516,7 +667,8 @@ class Task:
             return False
 
         if not self.data:
-            self.data = self.default_task_data.copy()
+            self._set_default_data()
+        await self._decode_once()
 
         self.data["triggers"].append(trigger_data)
         return True
@@ -529,6 +681,7 @@ class Task:
         self.author_id = None
         self.channel_id = None
         self.data = None
+        self._triggers_decoded = False
 
     def __getstate__(self):
         return {
@@ -545,3 +698,97 @@ class Task:
     async def delete_self(self):
         """Hopefully nothing uses the object after running this..."""
         await self.config.guild_from_id(self.guild_id).tasks.clear_raw(self.name)
+        task_repository.invalidate(self.guild_id, self.name)
+
+
+class TaskRepository:
+    """
+    Tasks loaded a guild at a time, or every guild at once, with one Config read
+
+    Tasks are cached until they're saved or deleted. Cached Tasks are shared,
+    so only use them to read, load a new Task to change one.
+    A read that was in flight while anything was invalidated isn't cached, it may be stale.
+    """
+
+    def __init__(self):
+        self.config: Optional[Config] = None
+        self.bot: Optional[Red] = None
+        self._tasks: Dict[int, Dict[str, Task]] = {}
+        self._complete: Set[int] = set()  # Guilds with every task in _tasks
+        self._all_complete = False  # Every guild is in _complete
+        self._generation = 0  # Bumped by invalidate and clear
+
+    def attach(self, config: Config, bot: Red):
+        self.config = config
+        self.bot = bot
+        self.clear()
+
+    def _load_guild(self, guild_id, tasks_data: Dict, cache=True) -> Dict[str, Task]:
+        tasks = {
+            name: Task.from_config_data(name, task_data, self.config, self.bot)
+            for name, task_data in tasks_data.items()
+        }
+        if cache:
+            self._tasks[guild_id] = tasks
+            self._complete.add(guild_id)
+        return tasks
+
+    async def get(self, guild_id, name) -> Optional[Task]:
+        task = self._tasks.get(guild_id, {}).get(name, None)
+        if task is not None or guild_id in self._complete:
+            return task
+
+        generation = self._generation
+        task_data = await self.config.guild_from_id(guild_id).tasks.get_raw(name, default=None)
+        if not task_data:
+            return None
+        task = Task.from_config_data(name, task_data, self.config, self.bot)
+        if generation == self._generation:
+            self._tasks.setdefault(guild_id, {})[name] = task
+        return task
+
+    async def guild_tasks(self, guild_id) -> Dict[str, Task]:
+        if guild_id in self._complete:
+            return self._tasks[guild_id]
+        generation = self._generation
+        tasks_data = await self.config.guild_from_id(guild_id).tasks()
+        return self._load_guild(guild_id, tasks_data, cache=generation == self._generation)
+
+    async def all_tasks(self) -> Dict[int, Dict[str, Task]]:
+        """Every guild's tasks, by guild id"""
+        if self._all_complete:
+            return {guild_id: tasks for guild_id, tasks in self._tasks.items() if tasks}
+
+        generation = self._generation
+        all_guilds = await self.config.all_guilds()
+        cache = generation == self._generation
+        if cache:
+            self._all_complete = True
+        return {
+            guild_id: (
+                self._tasks[guild_id]
+                if guild_id in self._complete
+                else self._load_guild(guild_id, guild_data["tasks"], cache=cache)
+            )
+            for guild_id, guild_data in all_guilds.items()
+            if guild_data.get("tasks")
+        }
+
+    def invalidate(self, guild_id, name=None):
+        """Forgets a task, or all of a guild's tasks when `name` is None"""
+        self._generation += 1
+        self._complete.discard(guild_id)
+        self._all_complete = False
+        if name is None:
+            self._tasks.pop(guild_id, None)
+        else:
+            self._tasks.get(guild_id, {}).pop(name, None)
+
+    def clear(self):
+        self._generation += 1
+        self._tasks.clear()
+        self._complete.clear()
+        self._all_complete = False
+
+
+task_repository = TaskRepository()
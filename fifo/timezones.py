@@ -6,13 +6,17 @@ All credit to https://github.com/prefrontal/dateutil-parser-timezones
 
 # from dateutil.tz import gettz
 from datetime import datetime
+from functools import lru_cache
 
 from pytz import timezone
 
 
+@lru_cache(maxsize=None)
 def assemble_timezones():
     """
     Assembles a dictionary of timezone abbreviations and values
+
+    Built on the first call, later calls return the same dictionary, so don't modify it
     :return: Dictionary of abbreviation keys and timezone values
     """
     timezones = {}
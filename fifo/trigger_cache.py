@@ -0,0 +1,96 @@
+"""
+Caches for building triggers and listing their fire times
+
+Parsing a cron expression is most of the cost of making a CronTrigger,
+so parsed fields are shared by every trigger with the same expression.
+Parsed fields are never changed after parsing, so sharing them is safe.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import astimezone
+from tzlocal import get_localzone
+
+import pytz
+
+
+@lru_cache(maxsize=1024)
+def crontab_fields(expr: str) -> List:
+    """Parsed fields of a crontab expression, raises ValueError if it's invalid"""
+    return CronTrigger.from_crontab(expr, timezone=pytz.UTC).fields
+
+
+@lru_cache(maxsize=1024)
+def cron_fields(fields: Tuple[Tuple[str, str], ...]) -> List:
+    """Parsed fields from (name, expression) pairs, as CronTrigger takes them"""
+    return CronTrigger(**dict(fields), timezone=pytz.UTC).fields
+
+
+def cron_trigger(fields: List, timezone=None, start_date=None, end_date=None, jitter=None):
+    """A CronTrigger with already parsed fields"""
+    trigger = CronTrigger.__new__(CronTrigger)
+    trigger.__setstate__(
+        {
+            "version": 2,
+            "timezone": astimezone(timezone) if timezone is not None else get_localzone(),
+            "start_date": start_date,
+            "end_date": end_date,
+            "fields": list(fields),
+            "jitter": jitter,
+        }
+    )
+    return trigger
+
+
+def crontab_trigger(expr: str, timezone=None) -> CronTrigger:
+    """Same as CronTrigger.from_crontab, parsing each expression once"""
+    return cron_trigger(crontab_fields(expr), timezone)
+
+
+class FireTimeCache:
+    """
+    The next fire times of triggers, keyed on the trigger and where to start from
+
+    Triggers are keyed by their repr, which has their fields, dates and timezone.
+    Only the `max_size` most recently used results are kept.
+    """
+
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._cache: "OrderedDict[Tuple[str, datetime], List[datetime]]" = OrderedDict()
+
+    def upcoming(
+        self, trigger: BaseTrigger, first: Optional[datetime], count=10
+    ) -> List[datetime]:
+        """`first` and the fire times after it, `count` at most"""
+        if first is None:
+            return []
+
+        key = (repr(trigger), first)
+        times = self._cache.get(key, None)
+        if times is not None and len(times) >= count:
+            self._cache.move_to_end(key)
+            return times[:count]
+
+        times = [first]
+        while len(times) < count:
+            next_time = trigger.get_next_fire_time(times[-1], times[-1])
+            if next_time is None:
+                break
+            times.append(next_time)
+
+        self._cache[key] = times
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return times
+
+    def clear(self):
+        self._cache.clear()
+
+
+fire_times = FireTimeCache()